@@ -44,6 +44,8 @@ except Exception:
 # 启动时初始化数据库（SQLite/SQLModel）
 try:
     from .db.base_models import init_database
+    from .db.maintenance import schedule_db_maintenance
+    from .db import job_models as _job_models  # noqa: F401  注册 console_jobs 表
 
     @driver.on_startup
     async def _entertain_init_database():
@@ -51,6 +53,7 @@ try:
             logger.info("--> 正在执行 nonebot-plugin-entertain 的数据库初始化...")
             await init_database()
             logger.success("--> nonebot-plugin-entertain 数据库初始化完成。")
+            schedule_db_maintenance()
         except Exception as e:
             # 修改这里！打印详细的错误信息和堆栈跟踪
             logger.error("!!! nonebot-plugin-entertain 数据库初始化失败，请检查下面的错误 !!!")
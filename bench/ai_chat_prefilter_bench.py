@@ -0,0 +1,153 @@
+"""AI 对话入口预筛基准：繁忙群消息轨迹下 ai_chat_at 的单条消息开销
+
+生成一段合成的群聊轨迹（默认 5 万条：约 3% @机器人、7% @他人、10% 图片），
+分别计时：
+
+- baseline：不做预筛，每条消息都走命令权限 + 正则规则 + 处理器入口的文本提取；
+- matcher：实际的入口权限 ``_at_cmd_permission``（预筛 + 命令权限）+ 正则规则；
+- prefilter：只计 ``_ai_chat_target``，取未 @ 机器人的消息。
+
+在仓库根目录运行（需已安装 nonebot2 与 OneBot v11 适配器）：
+
+    python bench/ai_chat_prefilter_bench.py --messages 50000 --active 0.01
+
+配置写入临时目录（NPE_CONFIG_DIR），不会改动仓库内的 config/；与正常运行一样会创建包内 data/。
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import importlib
+import os
+import random
+import re
+import sys
+import tempfile
+import time
+import types
+from pathlib import Path
+from typing import Any, Awaitable, Callable, List, Tuple
+
+ROOT = Path(__file__).resolve().parent.parent
+PKG = "nonebot_plugin_entertain"
+
+
+def _load_commands() -> Any:
+    """只导入 ai_chat 指令模块，不执行各级包的 __init__（包根会加载全部插件）。"""
+    os.environ.setdefault("NPE_CONFIG_DIR", tempfile.mkdtemp(prefix="npe_bench_"))
+    import nonebot
+    from nonebot.adapters.onebot.v11 import Adapter
+
+    nonebot.init()
+    nonebot.get_driver().register_adapter(Adapter)
+    # ai_chat/__init__ 会 require 整个插件，这里同样只登记包路径
+    plugins = ROOT / "plugins"
+    for name, path in ((PKG, ROOT), (f"{PKG}.plugins", plugins), (f"{PKG}.plugins.ai_chat", plugins / "ai_chat")):
+        mod = types.ModuleType(name)
+        mod.__path__ = [str(path)]  # type: ignore[attr-defined]
+        sys.modules.setdefault(name, mod)
+
+    commands = importlib.import_module(f"{PKG}.plugins.ai_chat.commands")
+    importlib.import_module(f"{PKG}.core.framework.perm").prime_permissions_cache()
+    return commands
+
+
+def _trace(n: int, self_id: int, seed: int) -> List[Any]:
+    from nonebot.adapters.onebot.v11 import GroupMessageEvent, Message, MessageSegment
+    from nonebot.adapters.onebot.v11.event import Sender
+
+    rnd = random.Random(seed)
+    out: List[Any] = []
+    for i in range(n):
+        r = rnd.random()
+        to_me = False
+        msg = Message(f"消息 {i} 今天吃什么 哈哈哈")
+        if r < 0.02:
+            to_me = True
+        elif r < 0.03:
+            msg = Message([MessageSegment.text("喂 "), MessageSegment.at(self_id), MessageSegment.text(" 在吗")])
+        elif r < 0.10:
+            msg = Message([MessageSegment.at(12345), MessageSegment.text(" 你好")])
+        elif r < 0.20:
+            msg = Message([MessageSegment.image("abc.jpg"), MessageSegment.text("看图")])
+        uid = rnd.randint(1, 500)
+        out.append(
+            GroupMessageEvent(
+                time=0,
+                self_id=self_id,
+                post_type="message",
+                sub_type="normal",
+                user_id=uid,
+                message_type="group",
+                message_id=i,
+                message=msg,
+                original_message=msg,
+                raw_message=str(msg),
+                font=0,
+                sender=Sender(user_id=uid, nickname="u", card=""),
+                to_me=to_me,
+                group_id=rnd.randint(1, 3),
+            )
+        )
+    return out
+
+
+async def _per_message(trace: List[Any], fn: Callable[[Any], Awaitable[bool]]) -> Tuple[float, int]:
+    passed = 0
+    t0 = time.perf_counter()
+    for e in trace:
+        if await fn(e):
+            passed += 1
+    return (time.perf_counter() - t0) / len(trace) * 1e6, passed
+
+
+async def _run(args: argparse.Namespace) -> None:
+    C = _load_commands()
+    from nonebot import get_adapter
+    from nonebot.adapters.onebot.v11 import Adapter, Bot
+
+    self_id = 10000
+    bot = Bot(get_adapter(Adapter), str(self_id))
+    cfg = C.get_config()
+    cfg.session.active_reply_enable = args.active > 0
+    cfg.session.active_reply_probability = args.active
+    trace = _trace(args.messages, self_id, args.seed)
+    pat = re.compile(r"^(.+)$")
+
+    async def baseline(e: Any) -> bool:
+        if not await C._at_cmd_perm(bot, e):
+            return False
+        if not pat.search(e.get_plaintext()):
+            return False
+        C.extract_plain_text(e.message)
+        return C._is_at_bot_robust(bot, e) or random.random() <= args.active
+
+    async def matcher(e: Any) -> bool:
+        if not await C._at_cmd_permission(bot, e):
+            return False
+        return bool(pat.search(e.get_plaintext()))
+
+    print(f"messages={len(trace)} active_reply={args.active}")
+    for _ in range(args.rounds):
+        for name, fn in (("baseline", baseline), ("matcher", matcher)):
+            us, passed = await _per_message(trace, fn)
+            print(f"{name:<10}{us:>8.2f} us/msg  passed={passed}")
+    untargeted = [e for e in trace if not C._is_at_bot_robust(bot, e)]
+    t0 = time.perf_counter()
+    for e in untargeted:
+        C._ai_chat_target(bot, e)
+    us = (time.perf_counter() - t0) / max(1, len(untargeted)) * 1e6
+    print(f"{'prefilter':<10}{us:>8.2f} us/msg  (untargeted={len(untargeted)})")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=50000)
+    ap.add_argument("--active", type=float, default=0.01, help="主动回复概率")
+    ap.add_argument("--rounds", type=int, default=2)
+    ap.add_argument("--seed", type=int, default=1)
+    asyncio.run(_run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
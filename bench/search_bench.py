@@ -0,0 +1,119 @@
+"""AI 对话检索基准：trigram 主索引 / 逐字索引 / LIKE 扫描的查询耗时
+
+表结构与查询语句与 plugins/ai_chat/search.py 一致，只依赖标准库 sqlite3，可直接运行：
+
+    python bench/search_bench.py --rows 120000 --repeat 20
+
+输出每个关键词在各路径下的中位耗时（毫秒）与命中数。
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import sqlite3
+import statistics
+import time
+from typing import Any, List, Tuple
+
+MSG_TABLE = "ai_chat_messages"
+MSG_FTS = "ai_chat_messages_fts"
+CHARS_FTS = "ai_chat_messages_chars"
+CHARS_FN = "ai_chat_chars"
+LIKE_WINDOW = 20000
+
+WORDS = (
+    "今天 天气 不错 我们 一起 去 吃饭 吧 机器人 你好 会员 到期 续费 群聊 插件 数据库 查询 优化 "
+    "hello world python sqlite search index"
+).split()
+
+
+def _spaced_chars(content: Any) -> str:
+    return " ".join(ch for ch in str(content or "") if not ch.isspace())
+
+
+def _chars_query(q: str) -> str:
+    return " ".join('"' + _spaced_chars(t).replace('"', '""') + '"' for t in q.split())
+
+
+def build(rows: int, seed: int) -> sqlite3.Connection:
+    con = sqlite3.connect(":memory:")
+    con.create_function(CHARS_FN, 1, _spaced_chars, deterministic=True)
+    con.execute(f"CREATE TABLE {MSG_TABLE}(id INTEGER PRIMARY KEY, session_id TEXT, content TEXT)")
+    con.execute(
+        f"CREATE VIRTUAL TABLE {MSG_FTS} USING fts5(content, content='{MSG_TABLE}', "
+        f"content_rowid='id', tokenize='trigram')"
+    )
+    con.execute(f"CREATE VIRTUAL TABLE {CHARS_FTS} USING fts5(content, content='', tokenize='unicode61')")
+    con.execute(
+        f"CREATE TRIGGER {MSG_FTS}_ai AFTER INSERT ON {MSG_TABLE} BEGIN "
+        f"INSERT INTO {MSG_FTS}(rowid, content) VALUES (new.id, new.content); END"
+    )
+    con.execute(
+        f"CREATE TRIGGER {CHARS_FTS}_ai AFTER INSERT ON {MSG_TABLE} BEGIN "
+        f"INSERT INTO {CHARS_FTS}(rowid, content) VALUES (new.id, {CHARS_FN}(new.content)); END"
+    )
+    rnd = random.Random(seed)
+    data = [
+        (i + 1, f"g{i // 200}", " ".join(rnd.choice(WORDS) for _ in range(20)) + f" 编号{i}")
+        for i in range(rows)
+    ]
+    # 一条只出现一次的生僻字，用于测稀有短词
+    data[rows // 2] = (rows // 2 + 1, "g0", data[rows // 2][2] + " 鑫")
+    t0 = time.perf_counter()
+    con.executemany(f"INSERT INTO {MSG_TABLE}(id, session_id, content) VALUES (?, ?, ?)", data)
+    con.commit()
+    print(f"rows={rows} insert+index {time.perf_counter() - t0:.2f}s")
+    return con
+
+
+def timed(con: sqlite3.Connection, sql: str, params: Tuple[Any, ...], repeat: int) -> Tuple[float, int]:
+    samples: List[float] = []
+    n = 0
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        n = len(con.execute(sql, params).fetchall())
+        samples.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(samples), n
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rows", type=int, default=120000)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--limit", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+    con = build(args.rows, args.seed)
+    n = args.limit
+
+    chars_sql = (
+        f"SELECT m.session_id, m.content FROM {CHARS_FTS} JOIN {MSG_TABLE} m ON m.id = {CHARS_FTS}.rowid "
+        f"WHERE {CHARS_FTS} MATCH ? ORDER BY {CHARS_FTS}.rowid DESC LIMIT ?"
+    )
+    trigram_sql = (
+        f"SELECT m.session_id, snippet({MSG_FTS}, 0, '[', ']', '…', 16) FROM {MSG_FTS} "
+        f"JOIN {MSG_TABLE} m ON m.id = {MSG_FTS}.rowid WHERE {MSG_FTS} MATCH ? ORDER BY {MSG_FTS}.rank LIMIT ?"
+    )
+    like_sql = f"SELECT m.session_id, m.content FROM {MSG_TABLE} m WHERE m.content LIKE ? ORDER BY m.id DESC LIMIT ?"
+    bounded_sql = (
+        f"SELECT m.session_id, m.content FROM {MSG_TABLE} m "
+        f"WHERE m.id > (SELECT coalesce(max(id), 0) FROM {MSG_TABLE}) - ? "
+        f"AND m.content LIKE ? ORDER BY m.id DESC LIMIT ?"
+    )
+
+    print(f"{'keyword':<12}{'path':<14}{'median_ms':>10}{'hits':>6}")
+    for kw in ("你", "你好", "鑫", "吃饭", "o", "py"):
+        for path, sql, params in (
+            ("chars", chars_sql, (_chars_query(kw), n)),
+            ("like_full", like_sql, (f"%{kw}%", n)),
+            ("like_bounded", bounded_sql, (LIKE_WINDOW, f"%{kw}%", n)),
+        ):
+            ms, hits = timed(con, sql, params, args.repeat)
+            print(f"{kw:<12}{path:<14}{ms:>10.2f}{hits:>6}")
+    for kw in ("数据库", "编号11999"):
+        ms, hits = timed(con, trigram_sql, ('"' + kw + '"', n), args.repeat)
+        print(f"{kw:<12}{'trigram':<14}{ms:>10.2f}{hits:>6}")
+
+
+if __name__ == "__main__":
+    main()
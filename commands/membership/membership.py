@@ -2,7 +2,8 @@ from __future__ import annotations
 
 import re
 from datetime import datetime, timezone
-from typing import Tuple
+from functools import partial
+from typing import Any, Awaitable, Callable, Optional, Tuple
 import asyncio
 
 from nonebot.adapters.onebot.v11 import (
@@ -16,25 +17,33 @@ from nonebot.matcher import Matcher
 from nonebot.permission import SUPERUSER
 from nonebot.plugin import PluginMetadata
 from nonebot import on_regex
+from ...core.dispatcher import get_dispatcher
+from ...core.roster import get_roster
 from ...core.system_config import load_cfg, save_cfg
 from ...console.membership_service import (
     _add_duration,
-    _choose_bots,
     _days_remaining,
     _format_cn,
     _now_utc,
+    _parse_expiry,
     _read_data,
     _today_str,
-    _write_data,
-    generate_unique_code,
-    _ensure_generated_codes,
+    generate_codes,
+    group_lock,
+)
+from ...db.membership_models import GeneratedCode, Membership
+from ...console.expiry_timer import (
+    act_on_group,
+    get_expiry_timer,
+    notify_record_changed,
+    timer_enabled,
 )
 
 # 插件元信息（中文，UTF-8）
 __plugin_meta__ = PluginMetadata(
     name="会员与控制台",
     description="群会员到期提醒/自动退群，续费码生成与兑换，简易 Web 控制台",
-    usage="命令：控制台登录 / ww生成续费<数字><天|月|年> / ww续费<数字><天|月|年>-<随机码> / ww到期",
+    usage="命令：控制台登录 / ww生成续费码<数字><天|月|年>[x数量] / ww续费<数字><天|月|年>-<随机码> / ww到期",
     type="application",
 )
 
@@ -82,9 +91,9 @@ async def _(matcher: Matcher, event: MessageEvent):
     await matcher.finish(Message(f"控制台登录地址：{login_url}"))
 
 
-# 生成续费码（超级用户）
+# 生成续费码（超级用户）；可选 “x数量” 批量生成，如 ww生成续费码30天x20
 gen_code_cmd = on_regex(
-    r"^ww生成续费码(\d+)(天|月|年)$",
+    r"^ww生成续费码(\d+)(天|月|年)(?:[xX×*](\d+))?$",
     
     priority=5,
     block=True,
@@ -94,31 +103,35 @@ gen_code_cmd = on_regex(
     
 )
 
+# 私聊单次最多发送的续费码数量，更多请使用控制台批量生成并导出
+_CHAT_BULK_LIMIT = 50
+
 
 @gen_code_cmd.handle()
 async def _(matcher: Matcher, event: MessageEvent):
     if not isinstance(event, PrivateMessageEvent):
         await matcher.finish("为安全起见，请在私聊生成续费码")
     matched = event.get_plaintext()
-    m = re.match(r"^ww生成续费码(\d+)(天|月|年)$", matched)
+    m = re.match(r"^ww生成续费码(\d+)(天|月|年)(?:[xX×*](\d+))?$", matched)
     assert m
     length = int(m.group(1))
     unit = m.group(2)
-
-    data = _ensure_generated_codes(await _read_data())
-    code = generate_unique_code(length, unit)
-    data["generatedCodes"][code] = {
-        "length": length,
-        "unit": unit,
-        "generated_time": _now_utc().isoformat(),
-    }
-    await _write_data(data)
-
-    await matcher.finish(
-        Message(
-            f"已生成续费码（默认一次性）：{code}\n"
-            "请将其发送到需要开通/续费的群聊中（首次开通也使用此码）"
+    count = int(m.group(3) or 1)
+    if count < 1 or count > _CHAT_BULK_LIMIT:
+        await matcher.finish(f"单次最多生成 {_CHAT_BULK_LIMIT} 个，更多请在控制台批量生成并导出")
+
+    # 保持原有默认：一次性、不过期
+    codes = await generate_codes(length, unit, count, max_use=1, expire_days=0)
+
+    if len(codes) == 1:
+        await matcher.finish(
+            Message(
+                f"已生成续费码（默认一次性）：{codes[0]}\n"
+                "请将其发送到需要开通/续费的群聊中（首次开通也使用此码）"
+            )
         )
+    await matcher.finish(
+        Message(f"已生成 {len(codes)} 个续费码（默认一次性）：\n" + "\n".join(codes))
     )
 
 
@@ -146,42 +159,36 @@ async def _(matcher: Matcher, event: MessageEvent):
     code = matched
     gid = str(event.group_id)
 
-    data = _ensure_generated_codes(await _read_data())
-    rec = data["generatedCodes"].get(code)
-    if not rec:
+    rec = await GeneratedCode.get_by_code(code)
+    if rec is None:
         await matcher.finish("该续费码无效或已被使用")
 
-    if rec.get("length") != parsed_len or rec.get("unit") != parsed_unit:
+    if rec.length != parsed_len or rec.unit != parsed_unit:
         await matcher.finish("续费码信息不匹配，请检查")
 
-    now = _now_utc()
-    current_expiry_str = (data.get(gid) or {}).get("expiry")
-    if current_expiry_str:
-        try:
-            current_expiry = datetime.fromisoformat(current_expiry_str)
-            if current_expiry.tzinfo is None:
-                current_expiry = current_expiry.replace(tzinfo=timezone.utc)
-        except Exception:
+    def _renew(current: dict | None) -> dict:
+        now = _now_utc()
+        current_expiry = _parse_expiry((current or {}).get("expiry")) or now
+        if current_expiry < now:
             current_expiry = now
-    else:
-        current_expiry = now
-
-    if current_expiry < now:
-        current_expiry = now
-
-    new_expiry = _add_duration(current_expiry, parsed_len, parsed_unit)
-
-    data[gid] = {
-        "group_id": gid,
-        "expiry": new_expiry.isoformat(),
-        "last_renewed_by": str(event.user_id),
-        "renewal_code_used": code,
-        "managed_by_bot": str(event.self_id),
-        "status": "active",
-        "last_reminder_on": None,
-    }
-    data["generatedCodes"].pop(code, None)
-    await _write_data(data)
+        return {
+            "expiry": _add_duration(current_expiry, parsed_len, parsed_unit).isoformat(),
+            "last_renewed_by": str(event.user_id),
+            "renewal_code_used": code,
+            "managed_by_bot": str(event.self_id),
+            "status": "active",
+            "last_reminder_on": None,
+            "expired_at": None,
+        }
+
+    # 消耗续费码与写入本群记录在同一事务内完成；并发兑换同一码时只有一方成功
+    async with group_lock(gid):
+        saved = await Membership.redeem(gid, code, parsed_len, parsed_unit, _renew)
+        if saved is not None:
+            notify_record_changed(gid, saved)
+    if saved is None:
+        await matcher.finish("该续费码无效或已被使用")
+    new_expiry = _parse_expiry(saved["expiry"]) or _now_utc()
 
     await matcher.finish(
         Message(f"本群会员已成功续费{parsed_len}{parsed_unit}，到期时间：{_format_cn(new_expiry)}")
@@ -290,184 +297,117 @@ except Exception:
     logger.warning("nonebot-plugin-apscheduler 未安装或未加载，跳过计划任务")
 
 
-async def _check_and_process() -> Tuple[int, int]:
+# 每日检查与控制台“立即检查”任务共用，同一时间只运行一次
+_sweep_lock = asyncio.Lock()
+# 每批并发处理的群数量；批与批之间检查取消并汇报进度
+_SWEEP_WINDOW = 20
+
+
+async def _check_and_process(
+    check_cancelled: Optional[Callable[[], None]] = None,
+    progress: Optional[Callable[[int, int], Awaitable[None]]] = None,
+) -> Tuple[int, int]:
     """检查群到期，提醒或退群
 
+    所有发送/退群操作交给全局出站调度器（按 Bot/群限速、失败重试与切换 Bot），
+    按批并发提交，由调度器统一排队。单个群的处理与到期定时器共用 act_on_group：
+    持有同一把群锁、在锁内重新读取记录，只写回该群自己的记录。
+    定时任务与控制台任务经 _sweep_lock 串行；check_cancelled 在每批之前调用（抛出异常即中止），
+    progress(已处理, 总数) 在每批之后调用。
+
     返回 (提醒数量, 退群数量)
     """
+    async with _sweep_lock:
+        return await _sweep(check_cancelled, progress)
+
+
+async def _sweep(
+    check_cancelled: Optional[Callable[[], None]],
+    progress: Optional[Callable[[int, int], Awaitable[None]]],
+) -> Tuple[int, int]:
     data = await _read_data()
     cfg = load_cfg()
     reminder_days = int(cfg.get("member_renewal_reminder_days_before", 7) or 7)
+    daily_remind_once = bool(cfg.get("member_renewal_daily_remind_once", True))
     today = _today_str()
-    reminders = 0
-    left = 0
-    changed = False
-    keys_to_remove: list[str] = []
+    now = _now_utc()
+    dispatcher = get_dispatcher()
 
     # 先处理“不在会员数据库中的群”——通过 Bot 实时群列表比对
+    work: list[tuple[str, Callable[[], Awaitable[Any]]]] = []
     try:
-        present_groups: set[str] = set()
-        # 汇总所有在线 Bot 的群列表
-        for bot in _choose_bots(None):
-            try:
-                gl = await bot.get_group_list()  # type: ignore[attr-defined]
-                for g in gl or []:
-                    try:
-                        gid = int((g.get("group_id") if isinstance(g, dict) else getattr(g, "group_id", 0)) or 0)
-                        if gid:
-                            present_groups.add(str(gid))
-                    except Exception:
-                        continue
-            except Exception as e:
-                logger.debug(f"get_group_list failed: {e}")
-                continue
+        # 群列表缓存：群号 -> 所在 Bot（过期时才重新拉取）
+        roster = get_roster()
+        await roster.ensure_loaded()
+        present_groups = {str(gid): bots for gid, bots in roster.group_map().items()}
 
         # 计算非会员群：不在数据库中的群记录
         member_keys = {k for k, v in data.items() if k != "generatedCodes" and isinstance(v, dict)}
-        non_member_groups = {gid for gid in present_groups if gid not in member_keys}
-
-        for gid_str in sorted(non_member_groups):
-            # 逐个尝试提醒并退群（非会员群）
-            for bot in _choose_bots(None):
-                try:
-                    # 先提示后退出
-                    try:
-                        content = "本群未在会员列表中，机器人将退出。如需使用请加群757463664联系管理员开通。"
-                        await bot.send_group_msg(group_id=int(gid_str), message=Message(content))
-                    except Exception as e:
-                        logger.debug(f"notify non-member failed {gid_str}: {e}")
-                    delay = float(cfg.get("member_renewal_batch_delay_seconds", 0) or 0.0)
-                    if delay > 0:
-                        try:
-                            await asyncio.sleep(delay)
-                        except Exception:
-                            pass
-
-                    await bot.set_group_leave(group_id=int(gid_str))
-                    left += 1
-                    # throttle per group
-                    if delay > 0:
-                        try:
-                            await asyncio.sleep(delay)
-                        except Exception:
-                            pass
-                    break
-                except Exception as e:
-                    logger.debug(f"leave non-member failed {gid_str}: {e}")
-                    continue
+
+        async def _leave_non_member(gid_str: str, bot_ids: list[str]) -> bool:
+            async with group_lock(gid_str):
+                # 读取快照后可能刚开通会员：锁内再确认一次
+                if await Membership.get_by_group_id(gid_str) is not None:
+                    return False
+                # 先提示后退出
+                content = "本群未在会员列表中，机器人将退出。如需使用请加群757463664联系管理员开通。"
+                notice = await dispatcher.send_group(int(gid_str), Message(content), bot_ids=bot_ids)
+                if not notice.ok:
+                    logger.debug(f"notify non-member failed {gid_str}: {notice.error}")
+                receipt = await dispatcher.leave_group(int(gid_str), bot_ids=bot_ids)
+                if not receipt.ok:
+                    logger.debug(f"leave non-member failed {gid_str}: {receipt.error}")
+                return receipt.ok
+
+        for gid_str in sorted(present_groups):
+            if gid_str not in member_keys:
+                work.append(("non_member", partial(_leave_non_member, gid_str, present_groups[gid_str])))
     except Exception as e:
         logger.debug(f"non-member leave pass failed: {e}")
 
+    # 按快照筛出需要处理的群（已到期或在提醒窗口内），具体动作在 act_on_group 中按最新记录决定
     for k, v in data.items():
         if k == "generatedCodes" or not isinstance(v, dict):
             continue
-        try:
-            expiry = datetime.fromisoformat(v.get("expiry"))
-            if expiry.tzinfo is None:
-                expiry = expiry.replace(tzinfo=timezone.utc)
-        except Exception:
+        if v.get("status", "active") == "expired":
+            continue
+        expiry = _parse_expiry(v.get("expiry"))
+        if expiry is None:
             continue
-
-        status = v.get("status", "active")
         gid_str = str(v.get("group_id", k))
         try:
-            gid = int(gid_str)
+            int(gid_str)
         except Exception:
             continue
+        if expiry > now:
+            if not 0 <= _days_remaining(expiry) <= reminder_days:
+                continue
+            if daily_remind_once and v.get("last_reminder_on") == today:
+                continue
+        work.append(("member", partial(act_on_group, gid_str, cfg, remind_once=daily_remind_once)))
 
-        days = _days_remaining(expiry)
-
-        # 已过期
-        if days < 0 and status != "expired":
-            # 若配置开启自动退群，先尝试退群，成功则从数据库删除该记录
-            if bool(cfg.get("member_renewal_auto_leave_on_expire", True)):
-                preferred = v.get("managed_by_bot")
-                left_success = False
-                for bot in _choose_bots(preferred):
-                    try:
-                        await bot.set_group_leave(group_id=gid)
-                        left += 1
-                        left_success = True
-                        break
-                    except Exception as e:
-                        logger.debug(f"退群失败 {gid} : {e}")
-                        continue
-                delay = float(cfg.get("member_renewal_batch_delay_seconds", 0) or 0.0)
-                if left_success:
-                    if delay > 0:
-                        try:
-                            await asyncio.sleep(delay)
-                        except Exception:
-                            pass
-                    # 延后统一删除，避免遍历时改动 dict
-                    keys_to_remove.append(k)
-                    changed = True
-                    # 已删除该记录，继续处理下一个
-                    continue
-            # 未配置自动退群或退群未成功：标记为已到期
-            v["status"] = "expired"
-            v["expired_at"] = _now_utc().isoformat()
-            changed = True
-            continue
-
-        # 即将到期提醒
-        if 0 <= days <= reminder_days and status != "expired":
-            last = v.get("last_reminder_on")
-
-            # 检查是否每日仅提醒一次
-            daily_remind_once = bool(cfg.get("member_renewal_daily_remind_once", True))
-            should_remind = True
-
-            if daily_remind_once:
-                # 启用每日仅提醒一次：检查是否今天已提醒
-                should_remind = (last != today)
-            # else: 不启用时，每次检查都提醒（不检查 last）
-
-            if should_remind:
-                preferred = v.get("managed_by_bot")
-                if days <= 0:
-                    content = ("本群会员已到期。请尽快加群757463664联系管理员购买续费码（首次开通与续费同用），并在群内发送完成续费")
-                else:
-                    content = (f"本群会员将在 {days} 天后到期。请尽快加群757463664联系管理员购买续费码（首次开通与续费同用），并在群内发送完成续费")
-                # 统一改为使用配置模板（如未设置则使用默认模板）
-                tmpl = str(
-                    cfg.get("member_renewal_remind_template")
-                )
-                try:
-                    content = tmpl.format(days=days, expiry=_format_cn(expiry))
-                except Exception:
-                    # 保底沿用原有文案
-                    content = (f"本群会员将在 {days} 天后到期。请尽快联系管理员购买续费码（首次开通与续费同用），并在群内发送完成续费")
-                # 去掉提醒尾注：不再追加联系方式后缀
-                sent = False
-                for bot in _choose_bots(preferred):
-                    try:
-                        await bot.send_group_msg(group_id=gid, message=Message(content))
-                        sent = True
-                        break
-                    except Exception as e:
-                        logger.debug(f"提醒发送失败 {gid}: {e}")
-                        continue
-                if sent:
-                    v["last_reminder_on"] = today
-                    reminders += 1
-                    changed = True
-                    if delay > 0:
-                        try:
-                            await asyncio.sleep(delay)
-                        except Exception:
-                            pass
-
-    # 统一删除需要移除的记录
-    if keys_to_remove:
-        for rk in keys_to_remove:
-            try:
-                data.pop(rk, None)
-            except Exception:
-                pass
-        changed = True
-    if changed:
-        await _write_data(data)
+    left = 0
+    reminders = 0
+    for idx in range(0, len(work), _SWEEP_WINDOW):
+        if check_cancelled is not None:
+            check_cancelled()
+        window = work[idx : idx + _SWEEP_WINDOW]
+        results = await asyncio.gather(*(run() for _, run in window))
+        for (kind, _), res in zip(window, results):
+            if kind == "non_member":
+                left += 1 if res else 0
+            elif res == "left":
+                left += 1
+            elif res == "reminded":
+                reminders += 1
+        if progress is not None:
+            await progress(idx + len(window), len(work))
+    # 对账：以数据库为准重建到期定时器
+    if timer_enabled():
+        try:
+            await get_expiry_timer().rebuild()
+        except Exception as e:
+            logger.debug(f"[membership] 重建到期定时器失败: {e}")
     return reminders, left
 
 
@@ -522,3 +462,21 @@ try:
     logger.debug("[membership] 已注册配置重载回调")
 except Exception as e:
     logger.debug(f"[membership] 注册配置重载回调失败: {e}")
+
+
+# 到期定时器：启动时从数据库构建，关闭时停止
+try:
+    from nonebot import get_driver
+
+    _driver = get_driver()
+
+    @_driver.on_startup
+    async def _start_expiry_timer():
+        if timer_enabled():
+            get_expiry_timer().start()
+
+    @_driver.on_shutdown
+    async def _stop_expiry_timer():
+        await get_expiry_timer().stop()
+except Exception as e:
+    logger.debug(f"[membership] 注册到期定时器失败: {e}")
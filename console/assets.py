@@ -0,0 +1,161 @@
+"""控制台静态资源：启动时预压缩并生成带内容哈希的文件名。
+
+- console.js / console.css 以 ``console.<hash>.js`` 形式引用，响应 ``Cache-Control: immutable``；
+- console.html 改写资源引用后以 ETag + ``no-cache`` 下发，浏览器每次只做一次条件请求；
+- 预先生成 gzip（以及安装了 ``brotli`` 时的 br）版本，按 Accept-Encoding 协商；
+- ``If-None-Match`` 命中时返回 304；源文件修改时间变化时自动重建（便于调试时直接改文件）。
+"""
+
+from __future__ import annotations
+
+import gzip
+import hashlib
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+try:  # 可选依赖
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover
+    brotli = None  # type: ignore
+
+
+WEB_DIR = Path(__file__).parent / "web"
+_MEDIA_TYPES = {
+    ".js": "application/javascript; charset=utf-8",
+    ".css": "text/css; charset=utf-8",
+    ".html": "text/html; charset=utf-8",
+}
+# 小于该大小的文件不压缩
+_MIN_COMPRESS = 1024
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "no-cache"
+
+
+@dataclass
+class Asset:
+    name: str
+    media_type: str
+    digest: str
+    bodies: Dict[str, bytes] = field(default_factory=dict)  # encoding -> bytes（identity/gzip/br）
+    mtime: float = 0.0
+
+    @property
+    def hashed_name(self) -> str:
+        p = Path(self.name)
+        return f"{p.stem}.{self.digest}{p.suffix}"
+
+    def etag(self, encoding: str) -> str:
+        return f'"{self.digest}-{encoding}"' if encoding != "identity" else f'"{self.digest}"'
+
+
+def _build(name: str, raw: bytes, mtime: float) -> Asset:
+    suffix = Path(name).suffix
+    asset = Asset(
+        name=name,
+        media_type=_MEDIA_TYPES.get(suffix, "application/octet-stream"),
+        digest=hashlib.sha256(raw).hexdigest()[:12],
+        mtime=mtime,
+    )
+    asset.bodies["identity"] = raw
+    if len(raw) >= _MIN_COMPRESS:
+        asset.bodies["gzip"] = gzip.compress(raw, compresslevel=9, mtime=0)
+        if brotli is not None:
+            try:
+                asset.bodies["br"] = brotli.compress(raw, quality=11)
+            except Exception:
+                pass
+    return asset
+
+
+class AssetStore:
+    def __init__(self, directory: Path = WEB_DIR) -> None:
+        self.directory = directory
+        self._assets: Dict[str, Asset] = {}
+        self._page: Optional[Asset] = None
+
+    def _stale(self) -> bool:
+        if self._page is None:
+            return True
+        for a in list(self._assets.values()) + [self._page]:
+            try:
+                if (self.directory / a.name).stat().st_mtime != a.mtime:
+                    return True
+            except OSError:
+                return True
+        return False
+
+    def refresh(self, force: bool = False) -> None:
+        if not force and not self._stale():
+            return
+        assets: Dict[str, Asset] = {}
+        for path in sorted(self.directory.iterdir()):
+            if path.suffix in (".js", ".css") and path.is_file():
+                assets[path.name] = _build(path.name, path.read_bytes(), path.stat().st_mtime)
+        page_path = self.directory / "console.html"
+        html = page_path.read_text(encoding="utf-8-sig")
+
+        def _sub(m: "re.Match[str]") -> str:
+            a = assets.get(m.group(2))
+            return f"{m.group(1)}{a.hashed_name}" if a else m.group(0)
+
+        html = re.sub(r"(static/)([\w.-]+\.(?:js|css))", _sub, html)
+        self._assets = assets
+        self._page = _build("console.html", html.encode("utf-8"), page_path.stat().st_mtime)
+
+    def page(self) -> Asset:
+        self.refresh()
+        assert self._page is not None
+        return self._page
+
+    def lookup(self, name: str) -> Tuple[Optional[Asset], bool]:
+        """按文件名查找资源；返回 (资源, 是否为带哈希的不可变地址)。"""
+        self.refresh()
+        if name in self._assets:
+            return self._assets[name], False
+        for a in self._assets.values():
+            if a.hashed_name == name:
+                return a, True
+        return None, False
+
+
+def choose_encoding(accept: str, asset: Asset) -> str:
+    """按 Accept-Encoding 选择已预压缩的版本（br 优先于 gzip）。"""
+    accepted = set()
+    for part in (accept or "").lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if not token:
+            continue
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(token.strip())
+    for enc in ("br", "gzip"):
+        if enc in asset.bodies and (enc in accepted or "*" in accepted):
+            return enc
+    return "identity"
+
+
+def not_modified(if_none_match: str, asset: Asset) -> bool:
+    """If-None-Match 是否命中当前内容（忽略 W/ 前缀与编码后缀）。"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag == "*":
+            return True
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag.strip('"').split("-", 1)[0] == asset.digest:
+            return True
+    return False
+
+
+_store: Optional[AssetStore] = None
+
+
+def get_asset_store() -> AssetStore:
+    global _store
+    if _store is None:
+        _store = AssetStore()
+    return _store
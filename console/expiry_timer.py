@@ -0,0 +1,298 @@
+"""会员到期定时器：按各群“下一次动作时间”准时触发提醒与到期退群。
+
+- 以最小堆保存 (到期时间戳, 序号, 群号)，配合 ``_due`` 字典做惰性删除；
+- 启动时从数据库全量构建，续费/延期/退群时按群更新；
+- 每日 ``membership_check`` 定时任务保留为对账，跑完后重建堆；
+- 定时器与每日检查都经 :func:`act_on_group` 处理单个群：持有同一把群锁并在锁内重新读取记录，
+  不会重复提醒，也不会把已删除的记录写回。
+
+下一次动作时间：
+- 已过到期时刻：立即执行到期处理；
+- 进入提醒窗口（到期日前 N 天起）：当天 ``member_renewal_timer_remind_hour`` 时刻提醒，
+  当天已提醒则顺延到次日；
+- 否则为到期时刻本身。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time as _time
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from nonebot.adapters.onebot.v11 import Message
+from nonebot.log import logger
+
+from ..core.dispatcher import get_dispatcher
+from ..core.system_config import load_cfg
+from ..db.membership_models import Membership
+from .membership_service import (
+    _days_remaining,
+    _now_utc,
+    _parse_expiry,
+    _remind_content,
+    _today_str,
+    _tz,
+    group_lock,
+)
+
+
+# 发送失败后的重试间隔
+_RETRY_AFTER = timedelta(minutes=15)
+# 单次最长休眠，便于感知系统时间跳变
+_MAX_SLEEP = 300.0
+
+async def act_on_group(gid: str, cfg: Dict[str, Any], *, remind_once: bool = True) -> str:
+    """在群锁内重新读取记录并执行到期处理。
+
+    返回 ``"left"``（已退群并删除记录）、``"expired"``（标记为已到期）、
+    ``"reminded"``、``"remind_failed"``，无需处理时返回空串。
+    ``remind_once`` 为真时当天已提醒过的群不再提醒。
+    """
+    async with group_lock(gid):
+        row = await Membership.get_by_group_id(gid)
+        if row is None:
+            return ""
+        rec = row.to_record()
+        now = _now_utc()
+        expiry = _parse_expiry(rec.get("expiry"))
+        if expiry is None or str(rec.get("status") or "active") == "expired":
+            return ""
+        dispatcher = get_dispatcher()
+
+        if expiry <= now:
+            if bool(cfg.get("member_renewal_auto_leave_on_expire", True)):
+                receipt = await dispatcher.leave_group(int(gid), bot_id=rec.get("managed_by_bot"))
+                if receipt.ok:
+                    await Membership.delete_by_group_id(gid)
+                    logger.info(f"[membership] 群 {gid} 会员到期，已退群")
+                    return "left"
+                logger.debug(f"退群失败 {gid} : {receipt.error}")
+            await Membership.update_by_group_id(gid, status="expired", expired_at=now.isoformat())
+            return "expired"
+
+        days = _days_remaining(expiry)
+        reminder_days = int(cfg.get("member_renewal_reminder_days_before", 7) or 7)
+        today = _today_str()
+        if not 0 <= days <= reminder_days:
+            return ""
+        if remind_once and rec.get("last_reminder_on") == today:
+            return ""
+        content = _remind_content(cfg, days, expiry)
+        receipt = await dispatcher.send_group(int(gid), Message(content), bot_id=rec.get("managed_by_bot"))
+        if not receipt.ok:
+            logger.debug(f"提醒发送失败 {gid}: {receipt.error}")
+            return "remind_failed"
+        await Membership.update_by_group_id(gid, last_reminder_on=today)
+        return "reminded"
+
+
+def next_action_at(rec: Dict[str, Any], cfg: Dict[str, Any], now: datetime) -> Optional[datetime]:
+    """计算某条会员记录的下一次动作时间（UTC）；无需处理时返回 None。"""
+    if str(rec.get("status") or "active") == "expired":
+        return None
+    expiry = _parse_expiry(rec.get("expiry"))
+    if expiry is None:
+        return None
+    if expiry <= now:
+        return now
+
+    tz = _tz()
+    reminder_days = int(cfg.get("member_renewal_reminder_days_before", 7) or 7)
+    hour = int(cfg.get("member_renewal_timer_remind_hour", 10) or 0)
+    minute = int(cfg.get("member_renewal_timer_remind_minute", 0) or 0)
+    expiry_day = expiry.astimezone(tz).date()
+    today = now.astimezone(tz).date()
+    day = max(today, expiry_day - timedelta(days=reminder_days))
+    if rec.get("last_reminder_on") == day.isoformat():
+        day += timedelta(days=1)
+    if day <= expiry_day:
+        remind_at = datetime.combine(day, time(hour % 24, minute % 60), tzinfo=tz).astimezone(timezone.utc)
+        if remind_at < now:
+            remind_at = now
+        if remind_at < expiry:
+            return remind_at
+    return expiry
+
+
+class ExpiryTimer:
+    def __init__(self) -> None:
+        self._heap: List[Tuple[float, int, str]] = []
+        self._due: Dict[str, float] = {}
+        self._seq = itertools.count()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._firing: Set[str] = set()
+        self._bg: Set[asyncio.Task] = set()
+
+    # ---- 堆维护 ----
+
+    def schedule(self, group_id: str, due: Optional[datetime]) -> None:
+        gid = str(group_id)
+        if due is None:
+            self._due.pop(gid, None)
+            return
+        ts = due.timestamp()
+        self._due[gid] = ts
+        heapq.heappush(self._heap, (ts, next(self._seq), gid))
+        if self._wake is not None:
+            self._wake.set()
+
+    def discard(self, group_id: str) -> None:
+        self._due.pop(str(group_id), None)
+
+    def reschedule_record(self, group_id: str, rec: Optional[Dict[str, Any]]) -> None:
+        """续费/延期后按最新记录重新排期；rec 为空表示记录已删除。"""
+        if not rec:
+            self.discard(group_id)
+            return
+        try:
+            self.schedule(group_id, next_action_at(rec, load_cfg(), _now_utc()))
+        except Exception as e:
+            logger.debug(f"[membership] 定时器排期失败 {group_id}: {e}")
+
+    async def rebuild(self) -> int:
+        """从数据库全量重建；返回已排期的群数量。"""
+        rows = await Membership.all()
+        cfg = load_cfg()
+        now = _now_utc()
+        due: Dict[str, float] = {}
+        for m in rows:
+            try:
+                at = next_action_at(m.to_record(), cfg, now)
+            except Exception:
+                continue
+            if at is not None:
+                due[str(m.group_id)] = at.timestamp()
+        self._due = due
+        self._heap = [(ts, next(self._seq), gid) for gid, ts in due.items()]
+        heapq.heapify(self._heap)
+        if self._wake is not None:
+            self._wake.set()
+        return len(due)
+
+    def pending(self, limit: int = 50) -> List[Dict[str, Any]]:
+        items = sorted(self._due.items(), key=lambda kv: kv[1])[: max(1, int(limit))]
+        return [
+            {"group_id": gid, "due_at": datetime.fromtimestamp(ts, timezone.utc).isoformat()}
+            for gid, ts in items
+        ]
+
+    # ---- 运行 ----
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        from ..db.base_models import init_database
+
+        try:
+            # 与数据库初始化的启动钩子并发时，等待其完成（幂等）
+            await init_database()
+            n = await self.rebuild()
+            logger.info(f"[membership] 到期定时器已启动，排期 {n} 个群")
+        except Exception as e:
+            logger.warning(f"[membership] 到期定时器初始化失败: {e}")
+        assert self._wake is not None
+        while True:
+            # 丢弃失效条目（已重新排期或已移除）
+            while self._heap and self._due.get(self._heap[0][2]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            self._wake.clear()
+            timeout = _MAX_SLEEP
+            if self._heap:
+                timeout = min(_MAX_SLEEP, self._heap[0][0] - _time.time())
+            if timeout > 0:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, gid = heapq.heappop(self._heap)
+            self._due.pop(gid, None)
+            if gid in self._firing:
+                continue
+            self._firing.add(gid)
+            t = asyncio.create_task(self._fire(gid))
+            self._bg.add(t)
+            t.add_done_callback(self._bg.discard)
+
+    async def _fire(self, gid: str) -> None:
+        try:
+            await self._act(gid)
+        except Exception as e:
+            logger.warning(f"[membership] 定时处理群 {gid} 失败: {e}")
+            self.schedule(gid, _now_utc() + _RETRY_AFTER)
+        finally:
+            self._firing.discard(gid)
+
+    async def _act(self, gid: str) -> None:
+        if await act_on_group(gid, load_cfg()) == "remind_failed":
+            self.schedule(gid, _now_utc() + _RETRY_AFTER)
+            return
+        # 按处理后的最新记录排期（已删除/已到期的记录不再排期）
+        row = await Membership.get_by_group_id(gid)
+        self.reschedule_record(gid, row.to_record() if row is not None else None)
+
+
+_timer: Optional[ExpiryTimer] = None
+
+
+def get_expiry_timer() -> ExpiryTimer:
+    global _timer
+    if _timer is None:
+        _timer = ExpiryTimer()
+    return _timer
+
+
+def timer_enabled() -> bool:
+    try:
+        return bool(load_cfg().get("member_renewal_timer_enable", True))
+    except Exception:
+        return False
+
+
+def notify_record_changed(group_id: str, rec: Optional[Dict[str, Any]]) -> None:
+    """供续费/控制台调用：记录变化后更新排期（定时器未运行时忽略）。"""
+    t = get_expiry_timer()
+    if t._task is None or t._task.done():
+        return
+    t.reschedule_record(group_id, rec)
+
+
+def _reload_timer() -> None:
+    # 配置变化（开关/提醒时刻/窗口）后重新启停并重建
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    t = get_expiry_timer()
+    if not timer_enabled():
+        loop.create_task(t.stop())
+        return
+    if t._task is None or t._task.done():
+        t.start()
+    else:
+        loop.create_task(t.rebuild())
+
+
+try:
+    from ..core.framework.config import register_reload_callback
+
+    register_reload_callback("system", _reload_timer)
+except Exception:
+    pass
@@ -0,0 +1,344 @@
+"""控制台后台任务：批量操作立即返回 job_id，在后台执行。
+
+- 任务记录与断点状态持久化在 SQLite（``console_jobs``）；
+- 进度通过订阅队列推送，供 SSE 接口 ``/jobs/{job_id}/events`` 使用；
+- 取消为协作式：处理函数在每批之间检查取消标记；
+- 进程重启时仍在运行的任务标记为 ``interrupted``，可在控制台从断点继续。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Set
+
+from nonebot.adapters.onebot.v11 import Message, MessageSegment
+from nonebot.log import logger
+
+from ..core.dispatcher import get_dispatcher
+from ..db.job_models import ConsoleJob
+
+
+TERMINAL = {"succeeded", "failed", "cancelled", "interrupted"}
+# 进度落库的最小间隔（秒），推送不受此限制
+_PERSIST_INTERVAL = 1.0
+# 订阅流的心跳间隔（秒）
+_HEARTBEAT = 15.0
+
+
+class JobCancelled(Exception):
+    pass
+
+
+def _now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+class JobContext:
+    """传给处理函数的运行上下文。"""
+
+    def __init__(self, manager: "JobManager", row: ConsoleJob) -> None:
+        self._manager = manager
+        self.job_id = row.job_id
+        self.kind = row.kind
+        self.params: Dict[str, Any] = json.loads(row.params_json or "{}")
+        self.state: Dict[str, Any] = json.loads(row.state_json or "{}")
+        self.total = int(row.total or 0)
+        self.done = int(row.done or 0)
+        self.failed = int(row.failed or 0)
+        self.message: Optional[str] = row.message
+        self._persisted_at = 0.0
+
+    def check_cancelled(self) -> None:
+        if self.job_id in self._manager._cancelled:
+            raise JobCancelled()
+
+    async def progress(
+        self,
+        *,
+        done: Optional[int] = None,
+        failed: Optional[int] = None,
+        total: Optional[int] = None,
+        message: Optional[str] = None,
+        state: Optional[Dict[str, Any]] = None,
+        force: bool = False,
+    ) -> None:
+        if done is not None:
+            self.done = int(done)
+        if failed is not None:
+            self.failed = int(failed)
+        if total is not None:
+            self.total = int(total)
+        if message is not None:
+            self.message = message
+        if state is not None:
+            self.state = state
+        self._manager._publish(self.job_id, self.snapshot("running"))
+        now = time.monotonic()
+        if force or now - self._persisted_at >= _PERSIST_INTERVAL:
+            self._persisted_at = now
+            await ConsoleJob.update_fields(
+                self.job_id,
+                done=self.done,
+                failed=self.failed,
+                total=self.total,
+                message=self.message,
+                state_json=json.dumps(self.state, ensure_ascii=False),
+                updated_at=_now_iso(),
+            )
+
+    def snapshot(self, status: str, result: Any = None) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": status,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "message": self.message,
+            "result": result,
+        }
+
+
+Handler = Callable[[JobContext], Awaitable[Any]]
+
+
+class JobManager:
+    def __init__(self) -> None:
+        self._handlers: Dict[str, Handler] = {}
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self._cancelled: Set[str] = set()
+        self._subs: Dict[str, Set[asyncio.Queue]] = {}
+        self._live: Dict[str, Dict[str, Any]] = {}
+
+    def register(self, kind: str, handler: Handler) -> None:
+        self._handlers[kind] = handler
+
+    # ---- 推送 ----
+
+    def _publish(self, job_id: str, snap: Dict[str, Any]) -> None:
+        self._live[job_id] = snap
+        for q in list(self._subs.get(job_id, ())):
+            try:
+                q.put_nowait(snap)
+            except Exception:
+                pass
+
+    async def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        if job_id in self._live:
+            return dict(self._live[job_id])
+        row = await ConsoleJob.get_by_job_id(job_id)
+        return row.to_dict() if row else None
+
+    async def subscribe(self, job_id: str) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """先推当前快照，之后推送每次进度；任务结束后停止。None 表示心跳。"""
+        q: asyncio.Queue = asyncio.Queue()
+        self._subs.setdefault(job_id, set()).add(q)
+        try:
+            snap = await self.get(job_id)
+            if snap is None:
+                return
+            yield snap
+            if snap.get("status") in TERMINAL:
+                return
+            while True:
+                try:
+                    snap = await asyncio.wait_for(q.get(), timeout=_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield snap
+                if snap.get("status") in TERMINAL:
+                    return
+        finally:
+            subs = self._subs.get(job_id)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    self._subs.pop(job_id, None)
+
+    # ---- 生命周期 ----
+
+    async def submit(self, kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        if kind not in self._handlers:
+            raise ValueError(f"未知任务类型: {kind}")
+        now = _now_iso()
+        row = await ConsoleJob.create(
+            {
+                "job_id": uuid.uuid4().hex,
+                "kind": kind,
+                "status": "pending",
+                "params_json": json.dumps(params or {}, ensure_ascii=False),
+                "state_json": "{}",
+                "created_at": now,
+                "updated_at": now,
+            }
+        )
+        self._start(row)
+        return row.to_dict()
+
+    async def resume(self, job_id: str) -> Dict[str, Any]:
+        row = await ConsoleJob.get_by_job_id(job_id)
+        if row is None:
+            raise KeyError(job_id)
+        if job_id in self._tasks:
+            return row.to_dict()
+        if row.status not in {"interrupted", "failed", "cancelled"}:
+            raise ValueError(f"任务状态为 {row.status}，无法继续")
+        self._cancelled.discard(job_id)
+        self._start(row)
+        return row.to_dict()
+
+    async def cancel(self, job_id: str) -> bool:
+        if job_id in self._tasks:
+            self._cancelled.add(job_id)
+            return True
+        row = await ConsoleJob.get_by_job_id(job_id)
+        if row is not None and row.status == "pending":
+            await ConsoleJob.update_fields(job_id, status="cancelled", updated_at=_now_iso())
+            return True
+        return False
+
+    def _start(self, row: ConsoleJob) -> None:
+        ctx = JobContext(self, row)
+        task = asyncio.create_task(self._run(ctx))
+        self._tasks[ctx.job_id] = task
+
+    async def _finish(self, ctx: JobContext, status: str, result: Any = None) -> None:
+        snap = ctx.snapshot(status, result)
+        try:
+            await ConsoleJob.update_fields(
+                ctx.job_id,
+                status=status,
+                done=ctx.done,
+                failed=ctx.failed,
+                total=ctx.total,
+                message=ctx.message,
+                state_json=json.dumps(ctx.state, ensure_ascii=False),
+                result_json=json.dumps(result, ensure_ascii=False) if result is not None else None,
+                updated_at=_now_iso(),
+            )
+        except Exception as e:
+            logger.warning(f"[console] 保存任务状态失败 {ctx.job_id}: {e}")
+        self._publish(ctx.job_id, snap)
+        self._live.pop(ctx.job_id, None)
+
+    async def _run(self, ctx: JobContext) -> None:
+        handler = self._handlers[ctx.kind]
+        try:
+            await ConsoleJob.update_fields(ctx.job_id, status="running", updated_at=_now_iso())
+            self._publish(ctx.job_id, ctx.snapshot("running"))
+            result = await handler(ctx)
+            await self._finish(ctx, "succeeded", result)
+        except JobCancelled:
+            ctx.message = "已取消"
+            await self._finish(ctx, "cancelled")
+        except asyncio.CancelledError:
+            # 进程关闭：保留断点，下次可继续
+            ctx.message = "进程退出，任务中断"
+            await self._finish(ctx, "interrupted")
+            raise
+        except Exception as e:
+            logger.exception(f"[console] 后台任务失败 {ctx.job_id}: {e}")
+            ctx.message = f"执行失败: {e}"
+            await self._finish(ctx, "failed")
+        finally:
+            self._tasks.pop(ctx.job_id, None)
+            self._cancelled.discard(ctx.job_id)
+
+    async def recover(self) -> None:
+        """启动时将上次未结束的任务标记为 interrupted。"""
+        from ..db.base_models import init_database
+
+        try:
+            await init_database()
+            rows = await ConsoleJob.list_by_status(["pending", "running"])
+            for r in rows:
+                await ConsoleJob.update_fields(
+                    r.job_id, status="interrupted", message="进程重启，任务中断", updated_at=_now_iso()
+                )
+            if rows:
+                logger.info(f"[console] {len(rows)} 个后台任务在上次运行中断，可在控制台继续")
+        except Exception as e:
+            logger.debug(f"[console] 恢复后台任务状态失败: {e}")
+
+    async def shutdown(self) -> None:
+        tasks = list(self._tasks.values())
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+job_manager = JobManager()
+
+
+# ---- 内置任务 ----
+
+# 每批并发提交给出站调度器的群数量；批与批之间检查取消并保存断点
+_NOTIFY_WINDOW = 20
+
+
+def _build_notify_message(params: Dict[str, Any]) -> Optional[Message]:
+    segs: List[MessageSegment] = []
+    text = str(params.get("text") or "")
+    if text:
+        segs.append(MessageSegment.text(text))
+    for img in params.get("images") or []:
+        try:
+            segs.append(MessageSegment.image(img))
+        except Exception:
+            continue
+    return Message(segs) if segs else None
+
+
+async def _notify_handler(ctx: JobContext) -> Dict[str, Any]:
+    group_ids = [int(x) for x in ctx.params.get("group_ids") or []]
+    message = _build_notify_message(ctx.params)
+    idx = int(ctx.state.get("next", 0) or 0)
+    sent = int(ctx.state.get("sent", 0) or 0)
+    failed: List[Dict[str, Any]] = list(ctx.state.get("failed") or [])
+    await ctx.progress(total=len(group_ids), done=idx, failed=len(failed), force=True)
+    if message is None:
+        return {"sent": 0, "failed": []}
+    dispatcher = get_dispatcher()
+    while idx < len(group_ids):
+        ctx.check_cancelled()
+        window = group_ids[idx : idx + _NOTIFY_WINDOW]
+        receipts = await asyncio.gather(
+            *(dispatcher.submit("send_group_msg", gid, message=message) for gid in window)
+        )
+        for r in receipts:
+            if r.ok:
+                sent += 1
+            else:
+                failed.append({"group_id": r.group_id, "error": r.error})
+                logger.debug(f"notify failed for {r.group_id}: {r.error}")
+        idx += len(window)
+        await ctx.progress(
+            done=idx,
+            failed=len(failed),
+            message=f"已发送 {sent}/{len(group_ids)}",
+            state={"next": idx, "sent": sent, "failed": failed},
+        )
+    return {"sent": sent, "failed": failed}
+
+
+async def _membership_check_handler(ctx: JobContext) -> Dict[str, Any]:
+    from ..commands.membership.membership import _check_and_process  # type: ignore
+
+    async def _progress(done: int, total: int) -> None:
+        await ctx.progress(done=done, total=total, message=f"已处理 {done}/{total} 个群")
+
+    # 每日定时检查正在运行时排队等待，二者共用同一把锁
+    await ctx.progress(total=0, done=0, message="正在检查会员到期", force=True)
+    r, l = await _check_and_process(check_cancelled=ctx.check_cancelled, progress=_progress)
+    await ctx.progress(message=f"提醒 {r} 个群，退出 {l} 个群", force=True)
+    return {"reminded": r, "left": l}
+
+
+job_manager.register("notify", _notify_handler)
+job_manager.register("membership_check", _membership_check_handler)
@@ -1,22 +1,34 @@
 from __future__ import annotations
 
+import asyncio
+import codecs
+import csv
+import io
+import json
 import math
 import secrets
+from contextlib import AsyncExitStack, asynccontextmanager
 from datetime import datetime, timedelta, timezone
-from typing import Any, Dict, List, Optional
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional, Tuple
 
-from nonebot import get_bots
-from nonebot.adapters.onebot.v11 import Bot
 from nonebot.log import logger
  
 from zoneinfo import ZoneInfo
 
 from ..core.system_config import load_cfg
-from ..db.membership_models import read_snapshot, write_snapshot
+from ..db.membership_models import (
+    GeneratedCode,
+    Membership,
+    code_row,
+    membership_row,
+    read_snapshot,
+)
 
 
 # 有效时长单位
 UNITS = ("天", "月", "年")
+# 单次批量生成续费码的上限
+MAX_BULK_CODES = 10000
 
 
 # 时区与时间工具
@@ -52,6 +64,105 @@ def _days_remaining(expiry: datetime) -> int:
     return (local_expiry.date() - today).days
 
 
+def _day_start_utc(offset_days: int) -> str:
+    """本地时区“今天 + offset_days”零点对应的 UTC ISO 字符串。"""
+    day = _now_local().date() + timedelta(days=offset_days)
+    start = datetime(day.year, day.month, day.day, tzinfo=_tz())
+    return start.astimezone(timezone.utc).isoformat()
+
+
+def _status_of(days: Optional[int], soon_days: int) -> str:
+    """与控制台一致的展示状态：expired / today / soon / active。"""
+    if days is None:
+        return "active"
+    if days < 0:
+        return "expired"
+    if days == 0:
+        return "today"
+    if days <= soon_days:
+        return "soon"
+    return "active"
+
+
+def _expiry_filter(status: str, within_days: Optional[int], soon_days: int) -> Dict[str, Any]:
+    """把状态筛选与“N 天内到期”换算为到期时间的 UTC 区间（供索引范围查询）。"""
+    lo: Optional[str] = None
+    hi: Optional[str] = None
+    include_none = False
+    if status == "expired":
+        hi = _day_start_utc(0)
+    elif status == "today":
+        lo, hi = _day_start_utc(0), _day_start_utc(1)
+    elif status == "soon":
+        lo, hi = _day_start_utc(1), _day_start_utc(soon_days + 1)
+    elif status == "active":
+        lo, include_none = _day_start_utc(soon_days + 1), True
+    if within_days is not None and within_days >= 0:
+        w_lo, w_hi = _day_start_utc(0), _day_start_utc(within_days + 1)
+        # ISO UTC 字符串可直接按文本比较
+        lo = max(lo, w_lo) if lo else w_lo
+        hi = min(hi, w_hi) if hi else w_hi
+        include_none = False
+    return {"expiry_from": lo, "expiry_before": hi, "include_no_expiry": include_none}
+
+
+def _parse_expiry(value: Any) -> Optional[datetime]:
+    """解析记录中的到期时间（ISO 字符串，缺少时区视为 UTC）。"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        dt = datetime.fromisoformat(value)
+    except Exception:
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def _remind_content(cfg: Dict[str, Any], days: int, expiry: datetime) -> str:
+    """按配置模板生成到期提醒文案。"""
+    tmpl = str(cfg.get("member_renewal_remind_template"))
+    try:
+        return tmpl.format(days=days, expiry=_format_cn(expiry))
+    except Exception:
+        # 保底沿用原有文案
+        return f"本群会员将在 {days} 天后到期。请尽快联系管理员购买续费码（首次开通与续费同用），并在群内发送完成续费"
+
+
+# 按群的处理锁及其使用者数，无人使用时移除
+_group_locks: Dict[str, asyncio.Lock] = {}
+_group_lock_users: Dict[str, int] = {}
+
+
+@asynccontextmanager
+async def group_lock(group_id: str) -> AsyncIterator[None]:
+    """同一群的读-改-写串行执行：到期定时器、每日检查、非会员退群、兑换、控制台修改"""
+    gid = str(group_id)
+    lock = _group_locks.get(gid)
+    if lock is None:
+        lock = _group_locks[gid] = asyncio.Lock()
+    _group_lock_users[gid] = _group_lock_users.get(gid, 0) + 1
+    try:
+        async with lock:
+            yield
+    finally:
+        left = _group_lock_users.get(gid, 1) - 1
+        if left <= 0:
+            _group_lock_users.pop(gid, None)
+            _group_locks.pop(gid, None)
+        else:
+            _group_lock_users[gid] = left
+
+
+@asynccontextmanager
+async def group_locks(*group_ids: str) -> AsyncIterator[None]:
+    """同时持有多个群的锁（按群号排序加锁，避免互相等待）"""
+    async with AsyncExitStack() as stack:
+        for gid in sorted({str(g) for g in group_ids}):
+            await stack.enter_async_context(group_lock(gid))
+        yield
+
+
 # 数据库存储（SQLite via SQLModel）
 async def _read_data() -> Dict[str, Any]:
     """Load all memberships and codes from the database as a dict structure.
@@ -66,11 +177,6 @@ async def _read_data() -> Dict[str, Any]:
     return await read_snapshot()
 
 
-async def _write_data(obj: Dict[str, Any]) -> None:
-    """Persist the given data snapshot into database via model helpers."""
-    await write_snapshot(obj)
-
-
 def _add_duration(start: datetime, length: int, unit: str) -> datetime:
     if unit == "天":
         return start + timedelta(days=length)
@@ -88,21 +194,183 @@ def _ensure_generated_codes(obj: Dict[str, Any]) -> Dict[str, Any]:
     return obj
 
 
-def generate_unique_code(length: int, unit: str) -> str:
-    # 生成唯一续费码：前缀 + 时长 + 单位 + 随机串
+def _code_factory(length: int, unit: str) -> Callable[[], str]:
+    # 续费码格式：前缀 + 时长 + 单位 + 随机串（配置只读取一次）
     cfg = load_cfg()
     prefix = str(cfg.get("member_renewal_code_prefix", "ww续费") or "ww续费")
     n = int(cfg.get("member_renewal_code_random_len", 6) or 6)
     n = max(2, n)
     b = math.ceil(n / 2)
-    rand = secrets.token_hex(b)[:n]
-    return f"{prefix}{length}{unit}-{rand}"
+
+    def _make() -> str:
+        return f"{prefix}{length}{unit}-{secrets.token_hex(b)[:n]}"
+
+    return _make
+
+
+async def generate_codes(
+    length: int,
+    unit: str,
+    count: int = 1,
+    *,
+    max_use: Optional[int] = None,
+    expire_days: Optional[int] = None,
+) -> List[str]:
+    """在一个事务内批量生成续费码；max_use / expire_days 为 None 时使用系统配置。"""
+    if unit not in UNITS:
+        raise ValueError("单位无效")
+    count = int(count)
+    if count < 1 or count > MAX_BULK_CODES:
+        raise ValueError(f"数量需在 1~{MAX_BULK_CODES} 之间")
+    cfg = load_cfg()
+    if max_use is None:
+        max_use = int(cfg.get("member_renewal_code_max_use", 1) or 1)
+    if expire_days is None:
+        expire_days = int(cfg.get("member_renewal_code_expire_days", 0) or 0)
+    now = _now_utc()
+    fields: Dict[str, Any] = {
+        "length": int(length),
+        "unit": unit,
+        "generated_time": now.isoformat(),
+        "max_use": max(1, int(max_use)),
+        "used_count": 0,
+        "expire_at": _add_duration(now, expire_days, UNITS[0]).isoformat() if expire_days > 0 else None,
+    }
+    return await GeneratedCode.bulk_create(_code_factory(int(length), unit), count, fields)
+
+
+# 导出 / 导入（流式，按块读写，不一次性载入全部数据）
+EXPORT_FIELDS: Dict[str, Tuple[str, ...]] = {
+    "memberships": (
+        "group_id",
+        "expiry",
+        "last_renewed_by",
+        "renewal_code_used",
+        "managed_by_bot",
+        "status",
+        "last_reminder_on",
+        "expired_at",
+    ),
+    "codes": ("code", "length", "unit", "generated_time", "max_use", "used_count", "expire_at"),
+}
+_EXPORT_CHUNK = 500
+# 每批导入行数（列数 x 行数需低于 SQLite 变量上限）
+_IMPORT_BATCH = 100
+
+
+def _export_model(kind: str) -> Any:
+    return Membership if kind == "memberships" else GeneratedCode
+
+
+async def export_stream(kind: str, fmt: str) -> AsyncIterator[str]:
+    """按 id 分块读取并逐块输出 CSV / NDJSON 文本。"""
+    fields = EXPORT_FIELDS[kind]
+    model = _export_model(kind)
+    if fmt == "csv":
+        buf = io.StringIO()
+        csv.writer(buf).writerow(fields)
+        # BOM 便于 Excel 正确识别中文
+        yield "\ufeff" + buf.getvalue()
+    after = 0
+    while True:
+        rows = await model.select_after_id(after, _EXPORT_CHUNK)
+        if not rows:
+            break
+        after = rows[-1].id
+        buf = io.StringIO()
+        if fmt == "csv":
+            w = csv.writer(buf)
+            for r in rows:
+                w.writerow(["" if getattr(r, f) is None else getattr(r, f) for f in fields])
+        else:
+            for r in rows:
+                buf.write(json.dumps({f: getattr(r, f) for f in fields}, ensure_ascii=False))
+                buf.write("\n")
+        yield buf.getvalue()
+
+
+async def _iter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    async for chunk in chunks:
+        pending += decoder.decode(chunk)
+        *lines, pending = pending.split("\n")
+        for line in lines:
+            yield line.rstrip("\r")
+    pending += decoder.decode(b"", final=True)
+    if pending.strip():
+        yield pending.rstrip("\r")
+
+
+async def import_stream(kind: str, fmt: str, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+    """逐行解析上传内容并按批 upsert（会员按 group_id，续费码按 code）。
+
+    CSV 需带表头且每条记录占一行；NDJSON 每行一个 JSON 对象。
+    每批单独提交，返回导入/跳过条数与前若干条错误。
+    """
+    model = _export_model(kind)
+    key = EXPORT_FIELDS[kind][0]
+    header: Optional[List[str]] = None
+    batch: List[Dict[str, Any]] = []
+    imported = skipped = 0
+    errors: List[str] = []
+    lineno = 0
+
+    def _skip(msg: str) -> None:
+        nonlocal skipped
+        skipped += 1
+        if len(errors) < 20:
+            errors.append(f"第 {lineno} 行: {msg}")
+
+    async for line in _iter_lines(chunks):
+        lineno += 1
+        if not line.strip():
+            continue
+        try:
+            if fmt == "csv":
+                values = next(csv.reader([line]))
+                if header is None:
+                    cols = [h.strip() for h in values]
+                    if key not in cols:
+                        raise ValueError(f"CSV 表头缺少 {key} 列")
+                    header = cols
+                    continue
+                rec = {h: (v if v != "" else None) for h, v in zip(header, values)}
+            else:
+                rec = json.loads(line)
+                if not isinstance(rec, dict):
+                    raise ValueError("不是 JSON 对象")
+        except (ValueError, csv.Error) as e:
+            if header is None and fmt == "csv":
+                raise
+            _skip(str(e))
+            continue
+        ident = rec.get(key)
+        if ident is None or str(ident).strip() == "":
+            _skip(f"缺少 {key}")
+            continue
+        if kind == "memberships":
+            row: Optional[Dict[str, Any]] = membership_row(str(ident).strip(), rec)
+        else:
+            row = code_row(str(ident).strip(), rec)
+        if row is None:
+            _skip("字段无效")
+            continue
+        batch.append(row)
+        if len(batch) >= _IMPORT_BATCH:
+            await _import_batch(kind, model, batch)
+            imported += len(batch)
+            batch = []
+    if batch:
+        await _import_batch(kind, model, batch)
+        imported += len(batch)
+    return {"imported": imported, "skipped": skipped, "errors": errors}
 
 
-def _choose_bots(preferred_id: Optional[str]) -> List[Bot]:
-    bots_map = get_bots()
-    bots: List[Bot] = []
-    if preferred_id and preferred_id in bots_map:
-        bots.append(bots_map[preferred_id])
-    bots.extend([b for sid, b in bots_map.items() if sid != preferred_id])
-    return bots
+async def _import_batch(kind: str, model: Any, batch: List[Dict[str, Any]]) -> None:
+    if kind != "memberships":
+        await model.upsert_rows(batch)
+        return
+    # 会员行与到期处理、兑换互斥；导入结束后由调用方重建到期定时器
+    async with group_locks(*(r["group_id"] for r in batch)):
+        await model.upsert_rows(batch)
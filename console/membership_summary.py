@@ -0,0 +1,200 @@
+"""会员仪表盘聚合计数：按状态、管理 Bot、到期分档统计，供 ``/summary`` 直接返回。
+
+- 启动时从数据库全量计算一次，之后订阅行级变更（``db.change_feed``）按群增量更新；
+- 每个群只记录其当前贡献 (status, bot, expiry)，更新时先减旧值再加新值，重复事件无副作用；
+- 到期分档依赖“今天”，每天本地零点全量重算一次（兼作对账），阈值配置变更时也会重算；
+- 收到 resync（批量导入、订阅积压）时全量重算。
+"""
+
+from __future__ import annotations
+
+import asyncio
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from nonebot.log import logger
+
+from ..core.system_config import load_cfg
+from ..db.change_feed import feed
+from ..db.membership_models import Membership
+from .membership_service import _days_remaining, _now_local, _parse_expiry, _status_of, _tz
+
+
+# 每行的贡献：(status 列, 管理 Bot, 到期分档, 是否无到期时间)
+_Entry = Tuple[str, str, str, bool]
+
+
+def _soon_days() -> int:
+    try:
+        return int(load_cfg().get("member_renewal_soon_threshold_days", 7) or 7)
+    except Exception:
+        return 7
+
+
+class MembershipSummary:
+    def __init__(self) -> None:
+        self._rows: Dict[str, _Entry] = {}
+        self.by_status: Counter = Counter()
+        self.by_bot: Counter = Counter()
+        self.by_bucket: Counter = Counter()
+        self.no_expiry = 0
+        self._soon = 7
+        self._computed_at: Optional[str] = None
+        self._updated_at: Optional[str] = None
+        self._task: Optional[asyncio.Task] = None
+        self._queue: Optional[asyncio.Queue] = None
+
+    # ---- 计数维护 ----
+
+    def _entry(self, rec: Dict[str, Any]) -> _Entry:
+        expiry = _parse_expiry(rec.get("expiry"))
+        days = _days_remaining(expiry) if expiry is not None else None
+        return (
+            str(rec.get("status") or "active"),
+            str(rec.get("managed_by_bot") or ""),
+            _status_of(days, self._soon),
+            expiry is None,
+        )
+
+    def _add(self, e: _Entry, sign: int) -> None:
+        status, bot, bucket, no_exp = e
+        for counter, key in ((self.by_status, status), (self.by_bot, bot), (self.by_bucket, bucket)):
+            counter[key] += sign
+            if counter[key] <= 0:
+                del counter[key]
+        if no_exp:
+            self.no_expiry += sign
+
+    def set_row(self, group_id: str, rec: Optional[Dict[str, Any]]) -> None:
+        """按群更新贡献；rec 为空表示记录已删除。"""
+        gid = str(group_id)
+        old = self._rows.pop(gid, None)
+        if old is not None:
+            self._add(old, -1)
+        if rec:
+            e = self._entry(rec)
+            self._rows[gid] = e
+            self._add(e, 1)
+        self._updated_at = datetime.now(timezone.utc).isoformat()
+
+    async def recompute(self) -> int:
+        """从数据库全量重算；返回群数量。"""
+        rows = await Membership.all()
+        self._soon = _soon_days()
+        self._rows = {}
+        self.by_status, self.by_bot, self.by_bucket = Counter(), Counter(), Counter()
+        self.no_expiry = 0
+        for m in rows:
+            e = self._entry(m.to_record())
+            self._rows[str(m.group_id)] = e
+            self._add(e, 1)
+        self._computed_at = self._updated_at = datetime.now(timezone.utc).isoformat()
+        return len(rows)
+
+    def apply(self, evt: Dict[str, Any]) -> bool:
+        """应用一条变更事件；需要全量重算时返回 True。"""
+        if evt.get("op") == "resync":
+            return True
+        if evt.get("kind") != "membership":
+            return False
+        self.set_row(str(evt.get("key")), None if evt.get("op") == "delete" else evt.get("data"))
+        return False
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "total": len(self._rows),
+            "by_status": dict(self.by_status),
+            "by_bot": dict(self.by_bot),
+            "by_bucket": dict(self.by_bucket),
+            "no_expiry": self.no_expiry,
+            "soon_days": self._soon,
+            "computed_at": self._computed_at,
+            "updated_at": self._updated_at,
+        }
+
+    # ---- 运行 ----
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        # 先订阅再全量计算，避免遗漏计算期间的写入
+        self._queue = feed.subscribe()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._queue is not None:
+            feed.unsubscribe(self._queue)
+            self._queue = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+            self._task = None
+
+    async def _safe_recompute(self) -> None:
+        try:
+            await self.recompute()
+        except Exception as e:
+            logger.warning(f"[membership] 仪表盘计数重算失败: {e}")
+
+    def request_recompute(self) -> None:
+        """配置变化（临近到期阈值）后重算。"""
+        if self._queue is not None:
+            try:
+                self._queue.put_nowait({"kind": "*", "op": "resync"})
+            except asyncio.QueueFull:
+                pass
+
+    async def _run(self) -> None:
+        from ..db.base_models import init_database
+
+        try:
+            # 与数据库初始化的启动钩子并发时，等待其完成（幂等）
+            await init_database()
+        except Exception as e:
+            logger.warning(f"[membership] 仪表盘计数初始化失败: {e}")
+        await self._safe_recompute()
+        assert self._queue is not None
+        q = self._queue
+        while True:
+            # 下一个本地零点稍后全量重算（到期分档按天变化）
+            now = _now_local()
+            midnight = datetime(now.year, now.month, now.day, tzinfo=_tz()) + timedelta(days=1, seconds=5)
+            timeout = max(1.0, (midnight - now).total_seconds())
+            try:
+                evt = await asyncio.wait_for(q.get(), timeout=timeout)
+            except asyncio.TimeoutError:
+                await self._safe_recompute()
+                continue
+            if self.apply(evt):
+                # 合并积压的事件，只重算一次
+                while not q.empty():
+                    q.get_nowait()
+                await self._safe_recompute()
+
+
+_summary: Optional[MembershipSummary] = None
+
+
+def get_membership_summary() -> MembershipSummary:
+    global _summary
+    if _summary is None:
+        _summary = MembershipSummary()
+    return _summary
+
+
+def _reload_summary() -> None:
+    s = get_membership_summary()
+    if s._soon != _soon_days():
+        s.request_recompute()
+
+
+try:
+    from ..core.framework.config import register_reload_callback
+
+    register_reload_callback("system", _reload_summary)
+except Exception:
+    pass
@@ -5,28 +5,44 @@ from ..core.http import get_shared_async_client
 
 from datetime import datetime, timezone
 import asyncio
+import json
 from pathlib import Path
 from typing import Any, Dict
 
 import httpx
 from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import FileResponse
-from fastapi.staticfiles import StaticFiles
+from fastapi.responses import Response, StreamingResponse
 from nonebot import get_app, get_bots
 from nonebot.adapters.onebot.v11 import Message, MessageSegment
 from nonebot.log import logger
 
+from ..core.dispatcher import Priority, get_dispatcher
 from ..core.system_config import load_cfg, save_cfg
+from ..db.job_models import ConsoleJob
+from ..db.membership_models import Membership
+from .assets import IMMUTABLE, REVALIDATE, Asset, choose_encoding, get_asset_store, not_modified
+from .jobs import job_manager
+from .membership_summary import get_membership_summary
+from .stats_cache import SWRCache
+from .expiry_timer import get_expiry_timer, notify_record_changed, timer_enabled
 from .membership_service import (
     _add_duration,
     _now_utc,
     _read_data,
-    _write_data,
     _days_remaining,
+    _expiry_filter,
     _format_cn,
-    generate_unique_code,
+    _parse_expiry,
+    _status_of,
     _ensure_generated_codes,
+    EXPORT_FIELDS,
+    MAX_BULK_CODES,
     UNITS,
+    export_stream,
+    generate_codes,
+    group_lock,
+    group_locks,
+    import_stream,
 )
 
 # === AI Chat personas (file-based) & sessions ===
@@ -39,12 +55,28 @@ try:
         get_config as ai_get_config,
     )
     from ..plugins.ai_chat.models import ChatSession
+    from ..plugins.ai_chat.search import ChatSearchIndex
 except Exception:
     ai_get_personas = None  # type: ignore
     ai_get_personas_dir = None  # type: ignore
     ai_reload_ai_configs = None  # type: ignore
     ai_get_config = None  # type: ignore
     ChatSession = None  # type: ignore
+    ChatSearchIndex = None  # type: ignore
+try:
+    # 会话缓存：控制台读写历史前先落库缓存中尚未写入的对话
+    from ..plugins.ai_chat.manager import chat_manager as ai_chat_manager
+except Exception:
+    ai_chat_manager = None  # type: ignore
+
+
+async def _ai_flush_pending(sid: str) -> None:
+    if ai_chat_manager is None:
+        return
+    try:
+        await ai_chat_manager.cache.flush_session(sid)
+    except Exception as e:
+        logger.debug(f"[AI Chat] 写入缓存中的对话失败 {sid}: {e}")
 
 
 def _extract_token(request: Request) -> str:
@@ -179,15 +211,12 @@ def setup_web_console() -> None:
                 except Exception:
                     content = "本群会员即将到期，请尽快续费"
             # 按要求移除尾注，不再追加联系方式后缀
-            live = get_bots()
-            bot = next(iter(live.values()), None)
-            if not bot:
+            if not get_bots():
                 raise HTTPException(500, "无可用 Bot 可发送提醒")
-            try:
-                await bot.send_group_msg(group_id=gid, message=Message(content))
-            except Exception as e:
-                logger.debug(f"remind_multi send failed: {e}")
-                raise HTTPException(500, f"发送提醒失败: {e}")
+            receipt = await get_dispatcher().send_group(gid, Message(content), priority=Priority.NORMAL)
+            if not receipt.ok:
+                logger.debug(f"remind_multi send failed: {receipt.error}")
+                raise HTTPException(500, f"发送提醒失败: {receipt.error}")
             return {"sent": 1}
 
         # 自定义通知：支持文本与图片（base64:// 或 URL），批量群发
@@ -230,44 +259,19 @@ def setup_web_console() -> None:
                     if v:
                         images.append(v)
 
-            # 取一个可用的 Bot
-            live = get_bots()
-            bot = next(iter(live.values()), None)
-            if not bot:
+            if not get_bots():
                 raise HTTPException(500, "无可用 Bot 可发送通知")
 
-            sent = 0
-            delay = 0.0
+            if not text and not images:
+                raise HTTPException(400, "请填写文本或选择图片")
+            # 作为后台任务执行，立即返回 job_id；进度见 /jobs/{job_id}/events
             try:
-                delay = float(load_cfg().get("member_renewal_batch_delay_seconds", 0) or 0.0)
-                if delay < 0:
-                    delay = 0.0
-            except Exception:
-                delay = 0.0
-            for gid in group_ids:
-                segs = []
-                if text:
-                    segs.append(MessageSegment.text(text))
-                for img in images:
-                    try:
-                        segs.append(MessageSegment.image(img))
-                    except Exception:
-                        continue
-                if not segs:
-                    continue
-                try:
-                    await bot.send_group_msg(group_id=int(gid), message=Message(segs))
-                    sent += 1
-                except Exception as e:
-                    logger.debug(f"notify failed for {gid}: {e}")
-                    continue
-                # throttle between batch operations to avoid risk control
-                if delay > 0:
-                    try:
-                        await asyncio.sleep(delay)
-                    except Exception:
-                        pass
-            return {"sent": sent}
+                job = await job_manager.submit(
+                    "notify", {"group_ids": group_ids, "text": text, "images": images}
+                )
+            except Exception as e:
+                raise HTTPException(500, f"创建任务失败: {e}")
+            return {"job_id": job["job_id"], "total": len(group_ids)}
 
         # 退群（不再需要 bot_ids）
         @router.post("/leave_multi")
@@ -280,36 +284,60 @@ def setup_web_console() -> None:
             # 读取退群模式配置
             cfg = load_cfg()
 
-            live = get_bots()
-            bot = next(iter(live.values()), None)
-            if not bot:
+            if not get_bots():
                 raise HTTPException(500, "无可用 Bot 可退群")
-            try:
-                await bot.set_group_leave(group_id=gid)
-            except Exception as e:
-                logger.debug(f"leave_multi failed: {e}")
-                raise HTTPException(500, f"退出失败: {e}")
-            # 删除记录（可选）
-            try:
-                data = await _read_data()
-                data.pop(str(gid), None)
-                await _write_data(data)
-            except Exception as e:
-                logger.debug(f"web console leave_multi: remove record failed: {e}")
+            async with group_lock(str(gid)):
+                receipt = await get_dispatcher().leave_group(gid, priority=Priority.NORMAL)
+                if not receipt.ok:
+                    logger.debug(f"leave_multi failed: {receipt.error}")
+                    raise HTTPException(500, f"退出失败: {receipt.error}")
+                # 删除记录（可选）
+                try:
+                    await Membership.delete_by_group_id(str(gid))
+                    notify_record_changed(str(gid), None)
+                except Exception as e:
+                    logger.debug(f"web console leave_multi: remove record failed: {e}")
             return {"left": 1}
 
-        # 统计：转发到统计服务 API
+        # 统计：转发到统计服务 API（stale-while-revalidate 缓存，按 API 地址区分）
+        stats_caches: Dict[str, SWRCache] = {}
+
+        def _stats_cache(stats_api_url: str) -> SWRCache:
+            cache = stats_caches.get(stats_api_url)
+            if cache is None:
+                async def _fetch() -> Any:
+                    client = await get_shared_async_client()
+                    resp = await client.get(f"{stats_api_url}/stats/today", timeout=DEFAULT_HTTP_TIMEOUT)
+                    resp.raise_for_status()
+                    return resp.json()
+
+                # 地址变更后旧缓存不再使用
+                stats_caches.clear()
+                cache = stats_caches[stats_api_url] = SWRCache(_fetch)
+            return cache
+
         @router.get("/stats/today")
-        async def api_stats_today(_: dict = Depends(_auth)):
-            stats_api_url = str(load_cfg().get("member_renewal_stats_api_url")).rstrip("/")
+        async def api_stats_today(refresh: bool = False, _: dict = Depends(_auth)):
+            cfg = load_cfg()
+            stats_api_url = str(cfg.get("member_renewal_stats_api_url")).rstrip("/")
+            ttl = max(0.0, float(cfg.get("member_renewal_stats_cache_ttl_seconds", 30) or 0))
+            max_stale = max(ttl, float(cfg.get("member_renewal_stats_max_stale_seconds", 600) or 0))
+            cache = _stats_cache(stats_api_url)
+            if refresh:
+                ttl = max_stale = 0.0
             try:
-                client = await get_shared_async_client()
-                resp = await client.get(f"{stats_api_url}/stats/today", timeout=DEFAULT_HTTP_TIMEOUT)
-                resp.raise_for_status()
-                return resp.json()
+                data, meta = await cache.get(ttl, max_stale)
             except Exception as e:
                 logger.error(f"获取统计失败: {e}")
                 raise HTTPException(500, f"获取统计失败: {e}")
+            if meta.get("error"):
+                logger.warning(f"刷新统计失败，返回缓存数据: {meta['error']}")
+            body = dict(data, _cache=meta) if isinstance(data, dict) else data
+            return Response(
+                content=json.dumps(body, ensure_ascii=False),
+                media_type="application/json",
+                headers={"Age": str(int(meta["age_seconds"])), "Cache-Control": "no-store"},
+            )
         # 权限
         @router.get("/permissions")
         async def api_get_permissions(_: dict = Depends(_auth)):
@@ -548,52 +576,120 @@ def setup_web_console() -> None:
         # ==================== AI 对话：会话信息表 ====================
         @router.get("/ai_chat/providers")
         async def api_ai_providers(_: dict = Depends(_auth)):
-            """列出可用服务商名称及默认项。"""
+            """列出可用服务商名称、服务商组及默认项，附带各服务商的延迟/错误率统计。"""
             if not ai_get_config:
-                return {"providers": [], "default": ""}
+                return {"providers": [], "default": "", "groups": {}, "stats": {}}
             try:
                 cfg = ai_get_config()
                 apis = list((getattr(cfg, "api", {}) or {}).keys())
+                groups = dict(getattr(cfg, "provider_groups", {}) or {})
                 default_name = getattr(getattr(cfg, "session", object()), "default_provider", "") or ""
-                return {"providers": apis, "default": default_name}
+                stats = ai_chat_manager.providers.snapshot(apis) if ai_chat_manager is not None else {}
+                return {"providers": apis, "default": default_name, "groups": groups, "stats": stats}
             except Exception as e:
                 raise HTTPException(500, f"获取服务商失败: {e}")
 
         @router.get("/ai_chat/sessions")
         async def api_ai_sessions(request: Request, _: dict = Depends(_auth)):
-            """获取会话信息列表，支持按群号/用户模糊搜索（query: q）。"""
+            """获取会话信息列表（服务端筛选 + 游标分页）。
+
+            query: q, type(group|private), provider（空值=默认服务商）, persona,
+            active(1|0), sort(updated_at|created_at|id), order(asc|desc), limit, cursor。
+            """
             if ChatSession is None:
                 raise HTTPException(500, "未找到 AI 对话模块，无法获取会话")
+            qp = request.query_params
+            q = str(qp.get("q") or "").strip()
+            session_type = str(qp.get("type") or "").strip()
+            if session_type in {"", "all"}:
+                session_type = ""
+            provider = qp.get("provider")
+            if provider is not None:
+                provider = str(provider).strip()
+            persona = str(qp.get("persona") or "").strip()
+            active = None
+            act_raw = str(qp.get("active") or "").strip().lower()
+            if act_raw in {"1", "true", "active"}:
+                active = True
+            elif act_raw in {"0", "false", "inactive"}:
+                active = False
             try:
-                q = str(request.query_params.get("q") or "").strip()
+                limit = int(qp.get("limit") or 50)
             except Exception:
-                q = ""
+                limit = 50
             try:
-                # 调用模型层封装的查询
-                rows = await ChatSession.search_sessions(keyword=q)  # type: ignore[attr-defined]
+                rows, next_cursor, total = await ChatSession.page_sessions(  # type: ignore[attr-defined]
+                    keyword=q,
+                    session_type=session_type or None,
+                    provider=provider,
+                    persona=persona or None,
+                    active=active,
+                    sort=str(qp.get("sort") or "updated_at"),
+                    order=str(qp.get("order") or "desc"),
+                    limit=limit,
+                    cursor=qp.get("cursor") or None,
+                )
                 data = []
                 for r in rows:
                     try:
-                        item = {
-                            "id": r.id,
-                            "session_id": r.session_id,
-                            "session_type": r.session_type,
-                            "group_id": r.group_id,
-                            "user_id": r.user_id,
-                            "provider_name": getattr(r, "provider_name", None),
-                            "persona_name": r.persona_name,
-                            "max_history": r.max_history,
-                            "is_active": r.is_active,
-                            "created_at": r.created_at,
-                            "updated_at": r.updated_at,
-                        }
-                        data.append(item)
+                        data.append(r.to_summary())
                     except Exception:
                         continue
-                return {"sessions": data}
+                return {"sessions": data, "next_cursor": next_cursor, "total": total}
             except Exception as e:
                 raise HTTPException(500, f"获取会话失败: {e}")
 
+        @router.get("/ai_chat/search")
+        async def api_ai_search(request: Request, _: dict = Depends(_auth)):
+            """全文检索会话元数据与历史消息（query: q, limit, session_id），返回高亮片段与耗时。"""
+            if ChatSearchIndex is None:
+                raise HTTPException(500, "未找到 AI 对话模块，无法检索")
+            qp = request.query_params
+            q = str(qp.get("q") or "").strip()
+            if not q:
+                raise HTTPException(400, "请输入检索关键词")
+            try:
+                limit = int(qp.get("limit") or 20)
+            except Exception:
+                limit = 20
+            try:
+                await ChatSearchIndex.ensure()
+                return await ChatSearchIndex.search(q=q, limit=limit, session_id=(qp.get("session_id") or None))
+            except Exception as e:
+                raise HTTPException(500, f"检索失败: {e}")
+
+        @router.get("/ai_chat/search/status")
+        async def api_ai_search_status(_: dict = Depends(_auth)):
+            if ChatSearchIndex is None:
+                return {"enabled": False, "tokenizer": None, "messages": 0}
+            try:
+                await ChatSearchIndex.ensure()
+                return await ChatSearchIndex.stats()
+            except Exception as e:
+                raise HTTPException(500, f"读取索引状态失败: {e}")
+
+        @router.post("/ai_chat/search/rebuild")
+        async def api_ai_search_rebuild(_: dict = Depends(_auth)):
+            """从会话表全量重建全文索引。"""
+            if ChatSearchIndex is None:
+                raise HTTPException(500, "未找到 AI 对话模块")
+            try:
+                if not await ChatSearchIndex.ensure():
+                    raise HTTPException(400, "当前 SQLite 不支持 FTS5")
+                n = await ChatSearchIndex.rebuild()
+                return {"messages": n}
+            except HTTPException:
+                raise
+            except Exception as e:
+                raise HTTPException(500, f"重建索引失败: {e}")
+
+        @router.get("/ai_chat/stats")
+        async def api_ai_stats(_: dict = Depends(_auth)):
+            """会话缓存命中与提示词前缀缓存（按布局统计的 cached tokens 占比）。"""
+            if ai_chat_manager is None:
+                raise HTTPException(500, "未找到 AI 对话模块")
+            return ai_chat_manager.stats()
+
         @router.put("/ai_chat/session/{sid}")
         async def api_ai_session_update(sid: str, payload: Dict[str, Any], _: dict = Depends(_auth)):
             """更新单个会话的部分字段。
@@ -620,6 +716,7 @@ def setup_web_console() -> None:
             if ChatSession is None:
                 raise HTTPException(500, "未找到 AI 对话模块，无法读取历史")
             try:
+                await _ai_flush_pending(sid)
                 lst = await ChatSession.get_history_list(session_id=sid)  # type: ignore[attr-defined]
                 return {"history": lst}
             except Exception as e:
@@ -630,6 +727,7 @@ def setup_web_console() -> None:
             if ChatSession is None:
                 raise HTTPException(500, "未找到 AI 对话模块，无法保存历史")
             try:
+                await _ai_flush_pending(sid)
                 ok = await ChatSession.set_history_raw(session_id=sid, raw=payload.get("history"))  # type: ignore[attr-defined]
                 if not ok:
                     raise HTTPException(404, "未找到会话")
@@ -671,19 +769,73 @@ def setup_web_console() -> None:
         async def api_get_all(_: dict = Depends(_auth)):
             return await _read_data()
 
+        @router.get("/groups")
+        async def api_groups_page(request: Request, _: dict = Depends(_auth)):
+            """群会员列表（游标分页）。
+
+            query: status(all|active|soon|today|expired), within_days, q, sort(expiry|group),
+            order(asc|desc), limit, cursor；ids_only=1 时返回全部匹配群号（用于跨页全选）。
+            """
+            qp = request.query_params
+            status = str(qp.get("status") or "all").strip()
+            if status not in {"all", "active", "soon", "today", "expired"}:
+                raise HTTPException(400, "无效的状态筛选")
+            within_days = None
+            if str(qp.get("within_days") or "").strip():
+                try:
+                    within_days = max(0, int(qp.get("within_days")))
+                except Exception:
+                    raise HTTPException(400, "within_days 需为整数")
+            sort = "group" if str(qp.get("sort") or "") == "group" else "expiry"
+            order = "desc" if str(qp.get("order") or "").lower() == "desc" else "asc"
+            try:
+                limit = int(qp.get("limit") or 20)
+            except Exception:
+                limit = 20
+            cfg = load_cfg()
+            soon_days = int(cfg.get("member_renewal_soon_threshold_days", 7) or 7)
+            filters = _expiry_filter(status, within_days, soon_days)
+            keyword = str(qp.get("q") or "").strip()
+            try:
+                await Membership.ensure_expiry_normalized()
+                if str(qp.get("ids_only") or "") in {"1", "true"}:
+                    ids = await Membership.list_group_ids(keyword=keyword, **filters)
+                    return {"group_ids": ids, "total": len(ids)}
+                rows, next_cursor, total = await Membership.page(
+                    keyword=keyword,
+                    sort=sort,
+                    order=order,
+                    limit=limit,
+                    cursor=qp.get("cursor") or None,
+                    **filters,
+                )
+            except Exception as e:
+                raise HTTPException(500, f"读取群列表失败: {e}")
+            items = []
+            for r in rows:
+                rec = r.to_record()
+                expiry = _parse_expiry(rec.get("expiry"))
+                days = _days_remaining(expiry) if expiry else None
+                rec["days"] = days
+                rec["display_status"] = _status_of(days, soon_days)
+                items.append(rec)
+            return {"items": items, "next_cursor": next_cursor, "total": total}
+
         # Bot 列表（用于前端下拉选择管理Bot）
         @router.get("/bots")
         async def api_get_bots(_: dict = Depends(_auth)):
             try:
                 bots_map = get_bots()
-                # 返回 self_id 列表
+                # 返回 self_id 列表，附带群列表缓存中的群数量
                 ids = list(bots_map.keys())
-                return {"bots": ids}
+                from ..core.roster import get_roster
+
+                return {"bots": ids, "roster": get_roster().summary()}
             except Exception as e:
                 logger.debug(f"/bots error: {e}")
                 return {"bots": []}
 
-        # 生成续费码
+        # 生成续费码（count > 1 时批量生成，单个事务内完成）
         @router.post("/generate")
         async def api_generate(payload: Dict[str, Any], request: Request, ctx: dict = Depends(_auth)):
             try:
@@ -691,26 +843,59 @@ def setup_web_console() -> None:
                 unit = str(payload.get("unit"))
                 if unit not in UNITS:
                     raise ValueError("单位无效")
+                count = int(payload.get("count") or 1)
+                if count < 1 or count > MAX_BULK_CODES:
+                    raise ValueError(f"数量需在 1~{MAX_BULK_CODES} 之间")
+                max_use = int(payload["max_use"]) if payload.get("max_use") else None
+                expire_days = int(payload["expire_days"]) if payload.get("expire_days") else None
             except Exception as e:
                 raise HTTPException(400, f"参数无效: {e}")
-            data = _ensure_generated_codes(await _read_data())
-            code = generate_unique_code(length, unit)
-            rec = {
-                "length": length,
-                "unit": unit,
-                "generated_time": _now_utc().isoformat(),
-            }
-            cfg = load_cfg()
-            max_use = int(payload.get("max_use") or cfg.get("member_renewal_code_max_use", 1) or 1)
-            rec["max_use"] = max_use
-            rec["used_count"] = 0
-            expire_days = int(payload.get("expire_days") or cfg.get("member_renewal_code_expire_days", 0) or 0)
-            if expire_days > 0:
-                # 使用 UNITS[0] 对应的单位（通常为“天”）
-                rec["expire_at"] = _add_duration(_now_utc(), expire_days, UNITS[0]).isoformat()
-            data["generatedCodes"][code] = rec
-            await _write_data(data)
-            return {"code": code}
+            try:
+                codes = await generate_codes(length, unit, count, max_use=max_use, expire_days=expire_days)
+            except Exception as e:
+                logger.error(f"生成续费码失败: {e}")
+                raise HTTPException(500, f"生成失败: {e}")
+            return {"code": codes[0], "codes": codes, "count": len(codes)}
+
+        # 导出会员 / 续费码（CSV 或 NDJSON，流式输出）
+        @router.get("/export")
+        async def api_export(kind: str = "codes", format: str = "csv", _: dict = Depends(_auth)):
+            if kind not in EXPORT_FIELDS:
+                raise HTTPException(400, "kind 仅支持 memberships / codes")
+            if format not in ("csv", "ndjson"):
+                raise HTTPException(400, "format 仅支持 csv / ndjson")
+            media = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            return StreamingResponse(
+                export_stream(kind, format),
+                media_type=media,
+                headers={
+                    "Content-Disposition": f'attachment; filename="{kind}-{stamp}.{format}"',
+                    "Cache-Control": "no-store",
+                },
+            )
+
+        # 导入会员 / 续费码（请求体为 CSV 或 NDJSON，边读边写入）
+        @router.post("/import")
+        async def api_import(request: Request, kind: str = "codes", format: str = "", _: dict = Depends(_auth)):
+            if kind not in EXPORT_FIELDS:
+                raise HTTPException(400, "kind 仅支持 memberships / codes")
+            fmt = format or ("ndjson" if "json" in (request.headers.get("content-type") or "") else "csv")
+            if fmt not in ("csv", "ndjson"):
+                raise HTTPException(400, "format 仅支持 csv / ndjson")
+            try:
+                result = await import_stream(kind, fmt, request.stream())
+            except ValueError as e:
+                raise HTTPException(400, f"导入失败: {e}")
+            except Exception as e:
+                logger.error(f"导入失败: {e}")
+                raise HTTPException(500, f"导入失败: {e}")
+            if kind == "memberships" and result["imported"] and timer_enabled():
+                try:
+                    await get_expiry_timer().rebuild()
+                except Exception as e:
+                    logger.debug(f"[membership] 重建到期定时器失败: {e}")
+            return result
 
         # 延长到期
         @router.post("/extend")
@@ -724,7 +909,6 @@ def setup_web_console() -> None:
             """
 
             now = _now_utc()
-            data = await _read_data()
 
             # Parse optional fields
             gid_raw = payload.get("group_id")
@@ -757,84 +941,100 @@ def setup_web_console() -> None:
             # Determine target record: by id, or by existing group_id, or create new
             rec: Dict[str, Any] | None = None
             target_gid: str | None = None
+            renamed_from: str | None = None
 
+            # 先确定涉及的群号并加锁，锁内重新读取记录再计算（与到期处理、兑换互斥）
+            rid: int | None = None
+            lock_ids: set[str] = set()
             rid_raw = payload.get("id")
             if rid_raw is not None and str(rid_raw).strip() != "":
-                # Edit by id
                 try:
                     rid = int(rid_raw)
                 except Exception:
                     raise HTTPException(400, "同名人格已存在")
-                for k, v in data.items():
-                    if k == "generatedCodes" or not isinstance(v, dict):
-                        continue
-                    try:
-                        if int(v.get("id") or -1) == rid:
-                            target_gid = str(k)
-                            rec = dict(v)
-                            break
-                    except Exception:
-                        continue
-                if not target_gid:
+                found = await Membership.get_by_ids([rid])
+                if not found:
                     raise HTTPException(404, "未找到对应记录")
-
-                # Allow renaming group_id when provided and unused
-                if gid and gid != target_gid:
-                    if isinstance(data.get(gid), dict):
+                lock_ids.add(str(found[0].group_id))
+            if gid:
+                lock_ids.add(gid)
+
+            async with group_locks(*lock_ids):
+                if rid is not None:
+                    # Edit by id
+                    found = await Membership.get_by_ids([rid])
+                    if not found:
+                        raise HTTPException(404, "未找到对应记录")
+                    target_gid = str(found[0].group_id)
+                    if target_gid not in lock_ids:
+                        # 加锁前记录已被改群号
+                        raise HTTPException(409, "记录已被修改，请刷新后重试")
+                    rec = found[0].to_record()
+
+                    # Allow renaming group_id when provided and unused
+                    if gid and gid != target_gid:
+                        if await Membership.get_by_group_id(gid) is not None:
+                            raise HTTPException(400, "同名人格已存在")
+                        renamed_from = target_gid
+                        target_gid = gid
+                else:
+                    # Only allow create when group_id not exists; editing requires id
+                    if not gid or gid.lower() == "none":
+                        raise HTTPException(400, "同名人格已存在")
+                    if await Membership.get_by_group_id(gid) is not None:
                         raise HTTPException(400, "同名人格已存在")
-                    # Move key later by updating target_gid and removing old
-                    data.pop(target_gid, None)
                     target_gid = gid
-            else:
-                # Only allow create when group_id not exists; editing requires id
-                if not gid or gid.lower() == "none":
-                    raise HTTPException(400, "同名人格已存在")
-                if isinstance(data.get(gid), dict):
-                    raise HTTPException(400, "同名人格已存在")
-                target_gid = gid
-                rec = {}
-
-            # Calculate new expiry
-            assert target_gid is not None
-            rec = rec or {}
-
-            new_expiry: datetime | None = None
-            if length is not None and length > 0 and unit:
-                # Add duration from current (or now if past/empty)
-                current = now
-                cur = rec.get("expiry")
-                if cur:
-                    try:
-                        current = datetime.fromisoformat(cur)
-                        if current.tzinfo is None:
-                            current = current.replace(tzinfo=timezone.utc)
-                    except Exception:
-                        current = now
-                if current < now:
-                    current = now
-                new_expiry = _add_duration(current, length, unit)
-            elif expiry_dt is not None:
-                new_expiry = expiry_dt
-            else:
-                raise HTTPException(400, "同名人格已存在")
+                    rec = {}
 
-            # Optional fields
-            managed_by_bot = str(payload.get("managed_by_bot") or "").strip()
-            renewed_by = str(payload.get("renewed_by") or "").strip()
+                # Calculate new expiry
+                assert target_gid is not None
+                rec = rec or {}
 
-            updates: Dict[str, Any] = {
-                "group_id": target_gid,
-                "expiry": new_expiry.isoformat(),
-                "status": "active",
-            }
-            if managed_by_bot:
-                updates["managed_by_bot"] = managed_by_bot
-            if renewed_by:
-                updates["last_renewed_by"] = renewed_by
+                new_expiry: datetime | None = None
+                if length is not None and length > 0 and unit:
+                    # Add duration from current (or now if past/empty)
+                    current = now
+                    cur = rec.get("expiry")
+                    if cur:
+                        try:
+                            current = datetime.fromisoformat(cur)
+                            if current.tzinfo is None:
+                                current = current.replace(tzinfo=timezone.utc)
+                        except Exception:
+                            current = now
+                    if current < now:
+                        current = now
+                    new_expiry = _add_duration(current, length, unit)
+                elif expiry_dt is not None:
+                    new_expiry = expiry_dt
+                else:
+                    raise HTTPException(400, "同名人格已存在")
 
-            rec.update(updates)
-            data[target_gid] = rec
-            await _write_data(data)
+                # Optional fields
+                managed_by_bot = str(payload.get("managed_by_bot") or "").strip()
+                renewed_by = str(payload.get("renewed_by") or "").strip()
+
+                updates: Dict[str, Any] = {
+                    "group_id": target_gid,
+                    "expiry": new_expiry.isoformat(),
+                    "status": "active",
+                }
+                if managed_by_bot:
+                    updates["managed_by_bot"] = managed_by_bot
+                if renewed_by:
+                    updates["last_renewed_by"] = renewed_by
+
+                if renamed_from:
+                    # 改群号：原行改名，保留 id 与其它字段
+                    saved = await Membership.rename_group(renamed_from, target_gid, **updates)
+                    if saved is None:
+                        raise HTTPException(404, "未找到对应记录")
+                    rec = saved
+                else:
+                    rec = await Membership.upsert_by_group_id(target_gid, **updates)
+                notify_record_changed(target_gid, rec)
+                if renamed_from:
+                    notify_record_changed(renamed_from, None)
 
             resp: Dict[str, Any] = {"group_id": target_gid, "expiry": new_expiry.isoformat()}
             if rid_raw is not None and str(rid_raw).strip() != "":
@@ -844,32 +1044,224 @@ def setup_web_console() -> None:
                     pass
             return resp
 
+        # 仪表盘聚合计数（按状态 / 管理 Bot / 到期分档），内存维护，无需读全表
+        @router.get("/summary")
+        async def api_summary(_: dict = Depends(_auth)):
+            summary = get_membership_summary()
+            if summary.snapshot()["computed_at"] is None:
+                # 启动后尚未完成首次计算
+                try:
+                    await summary.recompute()
+                except Exception as e:
+                    raise HTTPException(500, f"读取会员统计失败: {e}")
+            return summary.snapshot()
+
         # 列出生成的续费码
         @router.get("/codes")
         async def api_codes(_: dict = Depends(_auth)):
             data = _ensure_generated_codes(await _read_data())
             return data.get("generatedCodes", {})
 
-        # 运行定时任务
+        # 运行定时任务（后台执行，立即返回 job_id）
         @router.post("/job/run")
         async def api_run_job(_: dict = Depends(_auth)):
             try:
-                from ..commands.membership.membership import _check_and_process  # type: ignore
-                r, l = await _check_and_process()
-                return {"reminded": r, "left": l}
+                job = await job_manager.submit("membership_check", {})
+                return {"job_id": job["job_id"]}
             except Exception as e:
                 raise HTTPException(500, f"执行失败: {e}")
 
-        # 静态资源与控制台页面
-        static_dir = Path(__file__).parent / "web"
-        app.mount("/member_renewal/static", StaticFiles(directory=str(static_dir)), name="member_renewal_static")
+        # 后台任务：列表 / 详情 / 进度流 / 取消 / 继续
+        @router.get("/jobs")
+        async def api_jobs(request: Request, _: dict = Depends(_auth)):
+            try:
+                limit = int(request.query_params.get("limit") or 20)
+            except Exception:
+                limit = 20
+            rows = await ConsoleJob.recent(limit=limit)
+            jobs = []
+            for r in rows:
+                live = await job_manager.get(r.job_id)
+                jobs.append(live or r.to_dict())
+            return {"jobs": jobs}
+
+        @router.get("/jobs/{job_id}")
+        async def api_job(job_id: str, _: dict = Depends(_auth)):
+            snap = await job_manager.get(job_id)
+            if snap is None:
+                raise HTTPException(404, "任务不存在")
+            return snap
+
+        @router.get("/jobs/{job_id}/events")
+        async def api_job_events(job_id: str, _: dict = Depends(_auth)):
+            if await job_manager.get(job_id) is None:
+                raise HTTPException(404, "任务不存在")
+
+            async def _stream():
+                async for snap in job_manager.subscribe(job_id):
+                    if snap is None:
+                        yield ": ping\n\n"
+                    else:
+                        yield f"data: {json.dumps(snap, ensure_ascii=False)}\n\n"
+
+            return StreamingResponse(
+                _stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        @router.post("/jobs/{job_id}/cancel")
+        async def api_job_cancel(job_id: str, _: dict = Depends(_auth)):
+            if not await job_manager.cancel(job_id):
+                raise HTTPException(409, "任务未在运行")
+            return {"success": True}
+
+        @router.post("/jobs/{job_id}/resume")
+        async def api_job_resume(job_id: str, _: dict = Depends(_auth)):
+            try:
+                return await job_manager.resume(job_id)
+            except KeyError:
+                raise HTTPException(404, "任务不存在")
+            except ValueError as e:
+                raise HTTPException(409, str(e))
+
+        # 行级变更推送（SSE）：会员增删改、续费码消耗、AI 会话更新
+        @router.get("/events")
+        async def api_change_events(_: dict = Depends(_auth)):
+            from ..db.change_feed import feed
+
+            async def _stream():
+                # 在生成器内订阅：响应未开始发送即被丢弃时不会留下订阅队列
+                q = feed.subscribe()
+                try:
+                    yield ": connected\n\n"
+                    while True:
+                        try:
+                            evt = await asyncio.wait_for(q.get(), timeout=15.0)
+                        except asyncio.TimeoutError:
+                            yield ": ping\n\n"
+                            continue
+                        yield f"data: {json.dumps(evt, ensure_ascii=False)}\n\n"
+                finally:
+                    feed.unsubscribe(q)
+
+            return StreamingResponse(
+                _stream(),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+            )
+
+        # 到期定时器：即将触发的动作
+        @router.get("/timer")
+        async def api_timer(request: Request, _: dict = Depends(_auth)):
+            try:
+                limit = int(request.query_params.get("limit") or 50)
+            except Exception:
+                limit = 50
+            return {"enabled": timer_enabled(), "pending": get_expiry_timer().pending(limit)}
+
+        # 数据库：当前大小与历史
+        @router.get("/db/status")
+        async def api_db_status(request: Request, _: dict = Depends(_auth)):
+            try:
+                limit = int(request.query_params.get("limit") or 48)
+            except Exception:
+                limit = 48
+            try:
+                from ..db.maintenance import current_status, size_history
+
+                return {"current": await current_status(), "history": await size_history(limit=limit)}
+            except Exception as e:
+                raise HTTPException(500, f"读取数据库状态失败: {e}")
+
+        # 数据库：手动执行维护（full=false 仅 checkpoint）
+        @router.post("/db/maintenance")
+        async def api_db_maintenance(payload: Dict[str, Any], _: dict = Depends(_auth)):
+            try:
+                from ..db.maintenance import run_maintenance
+
+                return await run_maintenance(full=bool((payload or {}).get("full", True)))
+            except Exception as e:
+                raise HTTPException(500, f"数据库维护失败: {e}")
+
+        # 数据库：在线备份列表
+        @router.get("/db/backups")
+        async def api_db_backups(_: dict = Depends(_auth)):
+            from ..db.backup import last_backup_report, list_backups
+
+            return {"backups": list_backups(), "last": last_backup_report()}
+
+        # 数据库：立即执行一次在线备份
+        @router.post("/db/backup")
+        async def api_db_backup(_: dict = Depends(_auth)):
+            try:
+                from ..db.backup import run_backup
+
+                return await run_backup()
+            except RuntimeError as e:
+                raise HTTPException(409, str(e))
+            except Exception as e:
+                raise HTTPException(500, f"数据库备份失败: {e}")
+
+        # 数据库：SQL 指纹统计与慢查询日志
+        @router.get("/db/queries")
+        async def api_db_queries(request: Request, _: dict = Depends(_auth)):
+            from ..db.query_stats import snapshot
+
+            try:
+                limit = int(request.query_params.get("limit") or 50)
+            except Exception:
+                limit = 50
+            return snapshot(sort=str(request.query_params.get("sort") or "total_ms"), limit=limit)
+
+        @router.post("/db/queries/reset")
+        async def api_db_queries_reset(_: dict = Depends(_auth)):
+            from ..db.query_stats import reset
+
+            reset()
+            return {"success": True}
+
+        # 静态资源与控制台页面（预压缩 + 内容哈希，见 console/assets.py）
+        assets = get_asset_store()
+        assets.refresh(force=True)
+
+        def _asset_response(request: Request, asset: Asset, cache_control: str) -> Response:
+            encoding = choose_encoding(request.headers.get("accept-encoding", ""), asset)
+            headers = {
+                "ETag": asset.etag(encoding),
+                "Cache-Control": cache_control,
+                "Vary": "Accept-Encoding",
+            }
+            if not_modified(request.headers.get("if-none-match", ""), asset):
+                return Response(status_code=304, headers=headers)
+            if encoding != "identity":
+                headers["Content-Encoding"] = encoding
+            return Response(content=asset.bodies[encoding], media_type=asset.media_type, headers=headers)
+
+        @router.get("/static/{name}")
+        async def console_static(name: str, request: Request):
+            try:
+                asset, immutable = assets.lookup(name)
+            except Exception as e:
+                raise HTTPException(500, f"读取静态资源失败: {e}")
+            if asset is None:
+                raise HTTPException(404, "资源不存在")
+            # 带哈希的地址内容永不变化；旧的未带哈希地址仍可访问，但每次需校验
+            return _asset_response(request, asset, IMMUTABLE if immutable else REVALIDATE)
 
         @router.get("/console")
-        async def console(_: dict = Depends(_auth)):
-            path = Path(__file__).parent / "web" / "console.html"
-            return FileResponse(path, media_type="text/html")
+        async def console(request: Request, _: dict = Depends(_auth)):
+            try:
+                page = assets.page()
+            except Exception as e:
+                raise HTTPException(500, f"读取控制台页面失败: {e}")
+            return _asset_response(request, page, REVALIDATE)
 
         app.include_router(router)
+        # 上次进程中未结束的后台任务标记为中断（等待数据库初始化后执行）
+        asyncio.get_running_loop().create_task(job_manager.recover())
+        # 仪表盘聚合计数：全量计算一次后按行级变更增量维护
+        get_membership_summary().start()
         logger.info("member_renewal Web 控制台已挂载 /member_renewal")
     except Exception as e:
         logger.warning(f"member_renewal Web 控制台挂载失败: {e}")
@@ -0,0 +1,78 @@
+"""``/stats/today`` 的 stale-while-revalidate 缓存。
+
+- 在 TTL 内直接返回缓存，不访问上游统计服务；
+- 过期但未超过最大容忍时长时，立即返回旧数据，同时只启动一个后台刷新；
+- 没有缓存或旧数据过于陈旧时，所有请求共同等待同一次刷新（single-flight）；
+- 刷新失败时若仍有旧数据则继续返回，并在 ``error`` 中附带失败原因。
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+Fetcher = Callable[[], Awaitable[Any]]
+
+
+class SWRCache:
+    def __init__(self, fetcher: Fetcher) -> None:
+        self._fetcher = fetcher
+        self._value: Any = None
+        self._has_value = False
+        self._fetched_mono = 0.0
+        self._fetched_at: Optional[str] = None
+        self._error: Optional[str] = None
+        self._inflight: Optional[asyncio.Task] = None
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self._fetched_mono if self._has_value else 0.0
+
+    async def _refresh(self) -> Any:
+        try:
+            value = await self._fetcher()
+        except Exception as e:
+            self._error = str(e) or e.__class__.__name__
+            raise
+        self._value = value
+        self._has_value = True
+        self._fetched_mono = time.monotonic()
+        self._fetched_at = datetime.now(timezone.utc).isoformat()
+        self._error = None
+        return value
+
+    def _start_refresh(self) -> asyncio.Task:
+        if self._inflight is None or self._inflight.done():
+            task = asyncio.get_running_loop().create_task(self._refresh())
+            # 后台刷新的异常已记录在 _error 中，这里取出避免 "never retrieved" 警告
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())
+            self._inflight = task
+        return self._inflight
+
+    def _meta(self) -> Dict[str, Any]:
+        return {
+            "age_seconds": round(self.age, 1),
+            "fetched_at": self._fetched_at,
+            "refreshing": bool(self._inflight and not self._inflight.done()),
+            "error": self._error,
+        }
+
+    async def get(self, ttl: float, max_stale: float) -> Tuple[Any, Dict[str, Any]]:
+        """返回 (数据, 缓存信息)；没有任何可用数据时抛出上游异常。"""
+        age = self.age
+        if self._has_value and age < ttl:
+            return self._value, dict(self._meta(), stale=False)
+        if self._has_value and age < max_stale:
+            self._start_refresh()
+            return self._value, dict(self._meta(), stale=True)
+        task = self._start_refresh()
+        try:
+            # shield：单个请求断开不会取消其他请求共享的刷新
+            value = await asyncio.shield(task)
+            return value, dict(self._meta(), stale=False)
+        except Exception:
+            if not self._has_value:
+                raise
+            return self._value, dict(self._meta(), stale=True)
@@ -10,7 +10,10 @@ const state = {
   pluginNames: {},
   commandNames: {},  // 命令中文名: {plugin: {command: displayName}}
   theme: localStorage.getItem('theme') || 'light',
-  sortBy: 'days', sortDir: 'asc', filter: 'all', keyword: '',
+  sortBy: 'days', sortDir: 'asc', filter: 'all', keyword: '', withinDays: '',
+  // 续费列表游标：groupCursors[i] 为第 i+1 页的起始游标（服务端分页）
+  groupCursors: [null],
+  groupMatchIds: null, // 当前筛选下全部群号（跨页全选时按需拉取）
   statsSort: 'total_desc', // total_desc | total_asc | bot_asc | bot_desc | group_desc | private_desc
   statsKeyword: '',
   personas: {}, // {key: {name, details}}
@@ -21,6 +24,11 @@ const state = {
   aiSessionsKeyword: '',
   aiSessionsType: 'all',
   aiSessionsActive: 'all',
+  aiSessionsProvider: '',
+  aiSessionsPersona: '',
+  aiSessionsCursors: [null],
+  aiSessionsPage: 1,
+  aiSessionsTotal: 0,
   // 分页状态
   pagination: {
     currentPage: 1,
@@ -122,9 +130,11 @@ function switchTab(tab){
 }
 
 // ========== AI 会话 ==========
-async function apiAISessionsList(q=''){
-  const qs = q ? ('?q='+encodeURIComponent(q)) : '';
-  return apiCall('/ai_chat/sessions'+qs);
+async function apiAISessionsList(params={}){
+  const p = new URLSearchParams();
+  for(const [k,v] of Object.entries(params)){ if(v!==undefined && v!==null) p.set(k, String(v)); }
+  const qs = p.toString();
+  return apiCall('/ai_chat/sessions'+(qs?('?'+qs):''));
 }
 async function apiAIProviders(){
   return apiCall('/ai_chat/providers');
@@ -143,7 +153,8 @@ async function loadAISessions(){
     // fetch providers and personas for dropdowns
     try{
       const p = await apiAIProviders();
-      state.aiProviders = (p && p.providers) || [];
+      // 服务商组也可作为会话服务商
+      state.aiProviders = ((p && p.providers) || []).concat(Object.keys((p && p.groups) || {}));
       state.aiProvidersDefault = (p && p.default) || '';
     }catch{}
     try{
@@ -151,9 +162,8 @@ async function loadAISessions(){
       state.personas = (ps && ps.personas) || {};
     }catch{}
 
-    const data = await apiAISessionsList(state.aiSessionsKeyword);
-    state.aiSessions = (data && data.sessions) || [];
-    renderAISessionsTable();
+    populateAISessionFilterDropdowns();
+    await fetchAISessionsPage();
     populateAISessionEditDropdowns();
   }catch(e){
     showToast('�����Ự�б�ʧ��: '+(e && e.message ? e.message : e), 'error');
@@ -161,6 +171,78 @@ async function loadAISessions(){
   }finally{ showLoading(false); }
 }
 
+// 会话列表：筛选/排序在服务端完成，按游标逐页读取
+const AI_SESSIONS_PAGE_SIZE = 50;
+async function fetchAISessionsPage(){
+  const params = { limit: AI_SESSIONS_PAGE_SIZE };
+  if(state.aiSessionsKeyword) params.q = state.aiSessionsKeyword;
+  if(state.aiSessionsType && state.aiSessionsType!=='all') params.type = state.aiSessionsType;
+  if(state.aiSessionsActive && state.aiSessionsActive!=='all') params.active = state.aiSessionsActive;
+  if(state.aiSessionsProvider==='__default__') params.provider = '';
+  else if(state.aiSessionsProvider) params.provider = state.aiSessionsProvider;
+  if(state.aiSessionsPersona) params.persona = state.aiSessionsPersona;
+  const cur = state.aiSessionsCursors[state.aiSessionsPage-1];
+  if(cur) params.cursor = cur;
+  const data = await apiAISessionsList(params);
+  state.aiSessions = (data && data.sessions) || [];
+  state.aiSessionsTotal = Number((data && data.total) || 0);
+  if(data && data.next_cursor) state.aiSessionsCursors[state.aiSessionsPage] = data.next_cursor;
+  else state.aiSessionsCursors.length = state.aiSessionsPage;
+  renderAISessionsTable();
+}
+async function reloadAISessionsFromFirstPage(){
+  state.aiSessionsCursors = [null];
+  state.aiSessionsPage = 1;
+  try{ await fetchAISessionsPage(); }
+  catch(e){ showToast('加载会话列表失败: '+(e&&e.message?e.message:e),'error'); }
+}
+async function goToAISessionsPage(page){
+  if(page < 1 || page > state.aiSessionsCursors.length) return;
+  state.aiSessionsPage = page;
+  try{ await fetchAISessionsPage(); }
+  catch(e){ showToast('加载会话列表失败: '+(e&&e.message?e.message:e),'error'); }
+}
+// 全文检索（FTS5）：片段中的 \x02/\x03 为高亮标记
+function renderSearchSnippet(snip){
+  return escapeHtml(snip||'').replace(/\x02/g,'<mark>').replace(/\x03/g,'</mark>');
+}
+async function runAISearch(){
+  const q = ($('#ai-search-input')?.value||'').trim();
+  const box = $('#ai-search-results'); const meta = $('#ai-search-meta');
+  if(!q){ if(box) box.innerHTML=''; if(meta) meta.textContent=''; return; }
+  try{
+    const data = await apiCall('/ai_chat/search?'+new URLSearchParams({ q, limit: '30' }).toString());
+    const sessions = data.sessions||[]; const messages = data.messages||[];
+    if(meta) meta.textContent = `${data.mode==='fts5'?'全文索引':(data.mode==='fts5_chars'?'逐字索引':(data.bounded?'模糊匹配（仅最近消息）':'模糊匹配'))} · 会话 ${sessions.length} · 消息 ${messages.length} · 耗时 ${Number(data.took_ms||0).toFixed(2)} ms`;
+    if(!box) return;
+    const sHtml = sessions.map(s=>`<div class="search-hit"><button class="btn-action ai-session-history" data-sid="${encodeURIComponent(s.session_id)}">${escapeHtml(s.session_id)}</button> <span class="muted">${escapeHtml(s.persona_name||'')} ${escapeHtml(s.provider_name||'')}</span></div>`).join('');
+    const mHtml = messages.map(m=>`<div class="search-hit"><button class="btn-action ai-session-history" data-sid="${encodeURIComponent(m.session_id)}">${escapeHtml(m.session_id)}</button> <span class="muted">${escapeHtml(m.role||'')}${m.user_name?(' · '+escapeHtml(m.user_name)):''} · ${escapeHtml(formatDate(m.created_at))}</span><div>${renderSearchSnippet(m.snippet)}</div></div>`).join('');
+    box.innerHTML = (sHtml||mHtml) ? (sHtml + mHtml) : '<div class="empty-state">无匹配结果</div>';
+  }catch(e){ showToast('检索失败: '+(e&&e.message?e.message:e),'error'); }
+}
+async function rebuildAISearchIndex(){
+  try{ const r = await apiCall('/ai_chat/search/rebuild',{method:'POST'}); showToast(`索引已重建，共 ${r.messages||0} 条消息`,'success'); }
+  catch(e){ showToast('重建失败: '+(e&&e.message?e.message:e),'error'); }
+}
+function populateAISessionFilterDropdowns(){
+  const provSel = $('#ai-sessions-provider'); if(provSel){
+    const cur = provSel.value;
+    provSel.innerHTML = '';
+    provSel.appendChild(new Option('全部服务商',''));
+    provSel.appendChild(new Option('(默认服务商)','__default__'));
+    for(const n of (state.aiProviders||[])) provSel.appendChild(new Option(n,n));
+    provSel.value = cur || '';
+  }
+  const personSel = $('#ai-sessions-persona'); if(personSel){
+    const cur = personSel.value;
+    personSel.innerHTML = '';
+    personSel.appendChild(new Option('全部人格',''));
+    const keys = Object.keys(state.personas||{});
+    for(const k of ['default', ...keys.filter(k=>k!=='default')]) personSel.appendChild(new Option(k,k));
+    personSel.value = cur || '';
+  }
+}
+
 function populateAISessionEditDropdowns(){
   const personSel = $('#ai-edit-persona'); if(personSel){
     const cur = personSel.value;
@@ -182,16 +264,15 @@ function populateAISessionEditDropdowns(){
 
 function renderAISessionsTable(){
   const tbody = $('#ai-sessions-table-body'); if(!tbody) return;
-  let list = Array.isArray(state.aiSessions) ? [...state.aiSessions] : [];
-  const kw = (state.aiSessionsKeyword||'').trim();
-  const typ = state.aiSessionsType||'all';
-  const act = state.aiSessionsActive||'all';
-  if(kw){ list = list.filter(s=> String(s.group_id||'').includes(kw) || String(s.user_id||'').includes(kw) || String(s.session_id||'').includes(kw)); }
-  if(typ!=='all'){ list = list.filter(s=> String(s.session_type||'')===typ); }
-  if(act!=='all'){
-    const want = (act==='active');
-    list = list.filter(s=> !!s.is_active === want);
+  const list = Array.isArray(state.aiSessions) ? state.aiSessions : [];
+  const info = $('#ai-sessions-page-info');
+  if(info){
+    const total = state.aiSessionsTotal||0;
+    const pages = Math.ceil(total / AI_SESSIONS_PAGE_SIZE) || 1;
+    info.textContent = `共 ${total} 个会话，第 ${state.aiSessionsPage}/${pages} 页`;
   }
+  const prev = $('#ai-sessions-prev'); if(prev) prev.disabled = state.aiSessionsPage <= 1;
+  const next = $('#ai-sessions-next'); if(next) next.disabled = state.aiSessionsPage >= state.aiSessionsCursors.length;
   if(list.length===0){ tbody.innerHTML = '<tr><td colspan="9" class="text-center">������</td></tr>'; return; }
   tbody.innerHTML = list.map(s=>`
     <tr>
@@ -315,61 +396,171 @@ function closePersonaModal(){
 // 仪表盘
 async function loadDashboard(){
   try{
-    const data=await apiCall('/data');
-    state.groups = Object.entries(data)
-      .filter(([k,v])=>k!=='generatedCodes'&&typeof v==='object')
-      .map(([gid,info])=>{ const d=daysRemaining(info.expiry); let s='active'; if(d<0)s='expired'; else if(d===0)s='today'; else if(d<=SOON_THRESHOLD_DAYS)s='soon'; return { gid, ...info, days:d, status:s };});
-    $('#stat-active-groups').textContent=state.groups.length;
-    $('#stat-valid-members').textContent=state.groups.filter(g=>g.status==='active').length;
-    $('#stat-expiring-soon').textContent=state.groups.filter(g=>g.status==='soon'||g.status==='today').length;
-    $('#stat-expired').textContent=state.groups.filter(g=>g.status==='expired').length;
+    state.summary = await apiCall('/summary');
+    renderDashboardCounts();
   } catch(e){ showToast('加载仪表盘失败: '+(e&&e.message?e.message:e),'error'); }
 }
+// 行级变更后合并刷新聚合计数（服务端增量维护，请求很轻）
+function scheduleSummaryRefresh(){
+  if(state.summaryTimer) return;
+  state.summaryTimer = setTimeout(async ()=>{
+    state.summaryTimer = null;
+    try{ state.summary = await apiCall('/summary'); renderDashboardCounts(); }catch{}
+  }, 500);
+}
+function decorateGroup(gid, info){
+  const d=daysRemaining(info.expiry); let s='active'; if(d<0)s='expired'; else if(d===0)s='today'; else if(d<=SOON_THRESHOLD_DAYS)s='soon';
+  return { gid, ...info, days:d, status:s };
+}
+function renderDashboardCounts(){
+  const sm = state.summary || {};
+  const b = sm.by_bucket || {};
+  $('#stat-active-groups').textContent=sm.total||0;
+  $('#stat-valid-members').textContent=b.active||0;
+  $('#stat-expiring-soon').textContent=(b.soon||0)+(b.today||0);
+  $('#stat-expired').textContent=b.expired||0;
+  const box=$('#stat-by-bot');
+  if(box){
+    const bots=Object.entries(sm.by_bot||{}).sort((x,y)=>y[1]-x[1]);
+    box.textContent = bots.length ? '按管理 Bot：'+bots.map(([k,v])=>`${k||'未指定'} ${v}`).join(' · ') : '';
+  }
+}
+
+// 数据库大小与维护
+function formatBytes(n){ const v=Number(n)||0; if(v<1024) return v+' B'; if(v<1048576) return (v/1024).toFixed(1)+' KB'; if(v<1073741824) return (v/1048576).toFixed(1)+' MB'; return (v/1073741824).toFixed(2)+' GB'; }
+async function loadDbStatus(){
+  try{
+    const r = await apiCall('/db/status?limit=24');
+    const cur = (r && r.current) || {};
+    const box = $('#db-status-summary');
+    if(box){
+      box.textContent = `数据库 ${formatBytes(cur.db_bytes)} · WAL ${formatBytes(cur.wal_bytes)} · 空闲页 ${cur.freelist_count||0}/${cur.page_count||0} · auto_vacuum=${cur.auto_vacuum||'-'} · journal=${cur.journal_mode||'-'}`;
+    }
+    const tbody = $('#db-history-body');
+    const hist = (r && r.history) || [];
+    if(tbody){
+      tbody.innerHTML = hist.length ? hist.map(h=>`
+        <tr>
+          <td>${formatDate(h.sampled_at)}</td>
+          <td>${h.action==='full'?'整理':'checkpoint'}</td>
+          <td>${formatBytes(h.db_bytes)}</td>
+          <td>${formatBytes(h.wal_bytes)}</td>
+          <td>${Number(h.freelist_count||0)}</td>
+          <td>${Number(h.duration_ms||0).toFixed(1)} ms</td>
+        </tr>`).join('') : '<tr><td colspan="6" class="text-center">暂无数据</td></tr>';
+    }
+  }catch(e){ const box=$('#db-status-summary'); if(box) box.textContent='读取数据库状态失败'; }
+}
+async function runDbMaintenance(full){
+  try{
+    showLoading(true);
+    const r = await apiCall('/db/maintenance',{method:'POST', body: JSON.stringify({ full: !!full })});
+    showToast(`数据库${full?'整理':'checkpoint'}完成，用时 ${Number((r&&r.duration_ms)||0).toFixed(1)} ms`,'success');
+    await loadDbStatus();
+  }catch(e){ showToast('数据库维护失败: '+(e&&e.message?e.message:e),'error'); }
+  finally{ showLoading(false); }
+}
+async function loadDbBackups(){
+  try{
+    const r = await apiCall('/db/backups');
+    const list = (r && r.backups) || [];
+    const last = r && r.last;
+    const box = $('#db-backup-summary');
+    if(!box) return;
+    const head = list.length ? `备份 ${list.length} 份，最新 ${list[0].file}（${formatBytes(list[0].bytes)}）` : '暂无备份';
+    box.textContent = last ? `${head} · 上次用时 ${Number(last.duration_ms||0).toFixed(1)} ms，${last.pages_per_sec} 页/秒` : head;
+  }catch(e){ /* 静默 */ }
+}
+async function runDbBackup(){
+  try{
+    showLoading(true);
+    const r = await apiCall('/db/backup',{method:'POST'});
+    showToast(`备份完成：${r.file}，${r.pages} 页，用时 ${Number(r.duration_ms||0).toFixed(1)} ms（${r.pages_per_sec} 页/秒）`,'success');
+    await loadDbBackups();
+  }catch(e){ showToast('数据库备份失败: '+(e&&e.message?e.message:e),'error'); }
+  finally{ showLoading(false); }
+}
+async function loadDbQueries(){
+  try{
+    const r = await apiCall('/db/queries?limit=20');
+    const box = $('#db-queries-summary');
+    if(box){
+      const slow = (r && r.slow) || [];
+      box.textContent = `自 ${formatDate(r.since)} 起 ${r.fingerprints||0} 类语句 · 慢查询阈值 ${r.slow_ms} ms · 最近慢查询 ${slow.length} 条` + (slow[0] ? `（${slow[0].ms} ms，${slow[0].caller||'-'}）` : '');
+    }
+    const tbody = $('#db-queries-body');
+    const rows = (r && r.queries) || [];
+    if(tbody){
+      tbody.innerHTML = rows.length ? rows.map(q=>`
+        <tr>
+          <td title="${escapeHtml(q.sql)}" style="max-width:360px;overflow:hidden;text-overflow:ellipsis;white-space:nowrap;">${escapeHtml(q.sql)}</td>
+          <td>${q.count}</td>
+          <td>${Number(q.total_ms||0).toFixed(1)} ms</td>
+          <td>${Number(q.p50_ms||0).toFixed(2)}</td>
+          <td>${Number(q.p95_ms||0).toFixed(2)}</td>
+          <td>${Number(q.p99_ms||0).toFixed(2)}</td>
+          <td>${escapeHtml(((q.callers||[])[0]||{}).caller||'-')}</td>
+        </tr>`).join('') : '<tr><td colspan="7" class="text-center">暂无数据</td></tr>';
+    }
+  }catch(e){ const box=$('#db-queries-summary'); if(box) box.textContent='读取 SQL 统计失败'; }
+}
+async function resetDbQueries(){
+  try{ await apiCall('/db/queries/reset',{method:'POST'}); await loadDbQueries(); }
+  catch(e){ showToast('清零失败: '+(e&&e.message?e.message:e),'error'); }
+}
 
 // 续费
 async function loadRenewalData(){
   try{
     showLoading(true);
-    const data=await apiCall('/data');
-    state.groups = Object.entries(data)
-      .filter(([k,v])=>k!=='generatedCodes'&&typeof v==='object')
-      .map(([gid,info])=>{ const d=daysRemaining(info.expiry); let s='active'; if(d<0)s='expired'; else if(d===0)s='today'; else if(d<=SOON_THRESHOLD_DAYS)s='soon'; return { gid, ...info, days:d, status:s };});
-    renderGroupsTable();
+    resetGroupPaging();
+    await fetchGroupsPage();
     const codes=await apiCall('/codes');
-    renderCodes(codes);
+    state.codes = codes || {};
+    renderCodes(state.codes);
   } catch(e){ showToast('加载续费数据失败: '+(e&&e.message?e.message:e),'error'); }
   finally{ showLoading(false);} }
 
-function renderGroupsTable(){
-  const tbody=$('#groups-table-body'); if(!tbody) return;
-  let list=[...state.groups];
-  if(state.filter!=='all') list=list.filter(g=>g.status===state.filter);
-  if(state.keyword) list=list.filter(g=>String(g.gid).includes(state.keyword));
-  const dir=state.sortDir==='asc'?1:-1;
-  list.sort((a,b)=>{
-    if(state.sortBy==='group') return String(a.gid).localeCompare(String(b.gid))*dir;
-    if(state.sortBy==='status') return String(a.status).localeCompare(String(b.status))*dir;
-    if(state.sortBy==='expiry') return String(a.expiry||'').localeCompare(String(b.expiry||''))*dir;
-    if(state.sortBy==='days') return (a.days-b.days)*dir;
-    return 0;
-  });
-
-  // 分页计算
-  state.pagination.totalItems = list.length;
-  state.pagination.totalPages = Math.ceil(list.length / state.pagination.pageSize) || 1;
+// 当前筛选/排序对应的查询参数（不含游标）
+function groupQueryParams(){
+  const p = new URLSearchParams();
+  if(state.filter && state.filter!=='all') p.set('status', state.filter);
+  if(state.keyword) p.set('q', state.keyword);
+  if(String(state.withinDays||'').trim()!=='') p.set('within_days', String(state.withinDays).trim());
+  p.set('sort', state.sortBy==='group' ? 'group' : 'expiry');
+  p.set('order', state.sortDir==='desc' ? 'desc' : 'asc');
+  return p;
+}
+
+function resetGroupPaging(){
+  state.groupCursors = [null];
+  state.groupMatchIds = null;
+  state.pagination.currentPage = 1;
+}
+
+async function fetchGroupsPage(){
+  const p = groupQueryParams();
+  p.set('limit', String(state.pagination.pageSize));
+  const cur = state.groupCursors[state.pagination.currentPage-1];
+  if(cur) p.set('cursor', cur);
+  const data = await apiCall('/groups?'+p.toString());
+  state.groups = (data.items||[]).map(r=>({ gid: r.group_id, ...r, days: (r.days===null||r.days===undefined)?NaN:r.days, status: r.display_status||'active' }));
+  state.pagination.totalItems = Number(data.total||0);
+  state.pagination.totalPages = Math.ceil(state.pagination.totalItems / state.pagination.pageSize) || 1;
+  if(data.next_cursor) state.groupCursors[state.pagination.currentPage] = data.next_cursor;
+  else state.groupCursors.length = state.pagination.currentPage;
+  renderGroupsTable();
+}
 
-  // 确保当前页在有效范围内
-  if (state.pagination.currentPage > state.pagination.totalPages) {
-    state.pagination.currentPage = state.pagination.totalPages;
-  }
-  if (state.pagination.currentPage < 1) {
-    state.pagination.currentPage = 1;
-  }
+async function reloadGroupsFromFirstPage(){
+  resetGroupPaging();
+  try{ await fetchGroupsPage(); }
+  catch(e){ showToast('加载群列表失败: '+(e&&e.message?e.message:e),'error'); }
+}
 
-  // 获取当前页的数据
-  const startIndex = (state.pagination.currentPage - 1) * state.pagination.pageSize;
-  const endIndex = startIndex + state.pagination.pageSize;
-  const pageList = list.slice(startIndex, endIndex);
+function renderGroupsTable(){
+  const tbody=$('#groups-table-body'); if(!tbody) return;
+  const pageList = state.groups||[];
 
   tbody.innerHTML = pageList.length? pageList.map(g=>`
     <tr>
@@ -377,7 +568,7 @@ function renderGroupsTable(){
       <td>${g.gid}</td>
       <td>${getStatusLabel(g.days)}</td>
       <td>${formatDate(g.expiry)}</td>
-      <td>${g.days}</td>
+      <td>${Number.isFinite(g.days)?g.days:'-'}</td>
       <td>
         <button class="btn-action btn-remind" data-gid="${g.gid}">提醒</button>
         <button class="btn-action btn-extend" data-gid="${g.gid}">+30天</button>
@@ -387,20 +578,23 @@ function renderGroupsTable(){
 
   // 更新分页控件
   updatePaginationControls();
+  syncSelectAll();
+}
 
-  // 更新“全选”复选框状态（基于当前筛选结果，跨页）
+// “全选”复选框状态：已拉取全部匹配群号时按跨页统计，否则按当前页
+function syncSelectAll(){
   const selAll = document.getElementById('select-all');
-  if(selAll){
-    if(list.length === 0){
-      selAll.checked = false;
-      selAll.indeterminate = false;
-    } else {
-      let selected = 0;
-      for(const g of list){ if(state.selectedIds.has(Number(g.gid))) selected++; }
-      selAll.checked = selected === list.length;
-      selAll.indeterminate = selected > 0 && selected < list.length;
-    }
+  if(!selAll) return;
+  const list = state.groupMatchIds || (state.groups||[]).map(g=>g.gid);
+  if(list.length === 0){
+    selAll.checked = false;
+    selAll.indeterminate = false;
+    return;
   }
+  let selected = 0;
+  for(const gid of list){ if(state.selectedIds.has(Number(gid))) selected++; }
+  selAll.checked = !!state.groupMatchIds && selected === list.length;
+  selAll.indeterminate = selected > 0 && !selAll.checked;
 }
 
 function renderCodes(codes){
@@ -429,10 +623,12 @@ function updatePaginationControls() {
   const nextBtn = $('#pagination-next');
   const lastBtn = $('#pagination-last');
 
+  // 游标分页只能跳到已知起始游标的页
+  const reachable = state.groupCursors.length;
   if (firstBtn) firstBtn.disabled = currentPage <= 1;
   if (prevBtn) prevBtn.disabled = currentPage <= 1;
-  if (nextBtn) nextBtn.disabled = currentPage >= totalPages;
-  if (lastBtn) lastBtn.disabled = currentPage >= totalPages;
+  if (nextBtn) nextBtn.disabled = currentPage >= totalPages || currentPage >= reachable;
+  if (lastBtn) lastBtn.disabled = currentPage >= totalPages || totalPages > reachable;
 
   // 更新页码显示
   const pagesContainer = $('#pagination-pages');
@@ -461,31 +657,36 @@ function updatePaginationControls() {
         return '<span class="pagination-ellipsis">...</span>';
       }
       const active = page === currentPage ? 'active' : '';
-      return `<button class="pagination-page ${active}" data-page="${page}">${page}</button>`;
+      const disabled = page > state.groupCursors.length ? 'disabled' : '';
+      return `<button class="pagination-page ${active}" data-page="${page}" ${disabled}>${page}</button>`;
     }).join('');
   }
 }
 
 // 分页跳转函数
-function goToPage(page) {
+async function goToPage(page) {
   const { totalPages } = state.pagination;
-  if (page < 1) page = 1;
   if (page > totalPages) page = totalPages;
+  if (page > state.groupCursors.length) page = state.groupCursors.length;
+  if (page < 1) page = 1;
   state.pagination.currentPage = page;
-  renderGroupsTable();
+  try{ await fetchGroupsPage(); }
+  catch(e){ showToast('加载群列表失败: '+(e&&e.message?e.message:e),'error'); }
 }
 
 function changePageSize(size) {
   state.pagination.pageSize = parseInt(size) || 20;
-  state.pagination.currentPage = 1; // 重置到第一页
-  renderGroupsTable();
+  reloadGroupsFromFirstPage(); // 重置到第一页
 }
 
 // 统计（读取 /member_renewal/stats/today 并仅展示今天）
-async function loadStatsData(){
+async function loadStatsData(force=false){
   try{
     showLoading(true);
-    let today = await apiCall('/stats/today');
+    let today = await apiCall('/stats/today'+(force?'?refresh=1':''));
+    const cache = (today && typeof today==='object') ? today._cache : null;
+    if(cache) delete today._cache;
+    renderStatsAge(cache);
     if(today && !today.bots && typeof today==='object'){
       const ks=Object.keys(today);
       if(ks.length===1 && today[ks[0]] && typeof today[ks[0]]==='object'){
@@ -498,6 +699,16 @@ async function loadStatsData(){
   } catch(e){ showToast('加载统计失败: '+(e&&e.message?e.message:e),'error'); }
   finally{ showLoading(false);} }
 
+function renderStatsAge(cache){
+  const el=$('#stats-age'); if(!el) return;
+  if(!cache){ el.textContent=''; return; }
+  const age=Math.round(cache.age_seconds||0);
+  let text = age<60 ? `数据更新于 ${age} 秒前` : `数据更新于 ${Math.floor(age/60)} 分钟前`;
+  if(cache.refreshing) text+='，后台刷新中';
+  if(cache.error) text+=`（刷新失败: ${cache.error}）`;
+  el.textContent=text;
+}
+
 function renderStatsOverviewAll(today){
   try{
     const bots=today.bots||{}; let total=0, gsum=0, psum=0, gcount=0, pcount=0;
@@ -1336,16 +1547,7 @@ function renderConfigForm(data, parentKey = '') {
       const gid = Number(cb.dataset.gid);
       if(!Number.isFinite(gid)) return;
       if(cb.checked) state.selectedIds.add(gid); else state.selectedIds.delete(gid);
-      const selAll = document.getElementById('select-all');
-      if(selAll){
-        let list=[...state.groups];
-        if(state.filter!=='all') list=list.filter(g=>g.status===state.filter);
-        if(state.keyword) list=list.filter(g=>String(g.gid).includes(state.keyword));
-        if(list.length===0){ selAll.checked=false; selAll.indeterminate=false; return; }
-        let cnt=0; for(const g of list){ if(state.selectedIds.has(Number(g.gid))) cnt++; }
-        selAll.checked = cnt === list.length;
-        selAll.indeterminate = cnt > 0 && cnt < list.length;
-      }
+      syncSelectAll();
     });
   }
 
@@ -1708,16 +1910,80 @@ async function sendNotify(){
   closeModal('notify-modal');
 
   try{
-    showLoading(true);
-    await apiCall('/notify', { method:'POST', body: JSON.stringify({ group_ids: ids, text, images: imgs }) });
-    showToast(`已向 ${ids.length} 个群发送通知`,'success');
+    const r = await apiCall('/notify', { method:'POST', body: JSON.stringify({ group_ids: ids, text, images: imgs }) });
+    showToast(`已创建通知任务（${ids.length} 个群），可在仪表盘查看进度`,'info');
+    trackJob(r.job_id);
   }catch(e){
     showToast('发送失败: '+(e&&e.message?e.message:e),'error');
-  }finally{
-    showLoading(false);
   }
 }
 
+// 后台任务：列表与进度推送（SSE）
+const JOB_KIND_LABEL = { notify: '群通知', membership_check: '会员检查' };
+const JOB_STATUS_LABEL = { pending:'等待中', running:'运行中', succeeded:'已完成', failed:'失败', cancelled:'已取消', interrupted:'已中断' };
+const __jobStreams = {};
+function jobRowHtml(j){
+  const pct = j.total ? Math.floor((j.done||0)*100/j.total) : (j.status==='succeeded'?100:0);
+  const actions = [];
+  if(j.status==='running' || j.status==='pending') actions.push(`<button class="btn btn-secondary btn-sm" data-job-cancel="${j.job_id}">取消</button>`);
+  if(['interrupted','failed','cancelled'].includes(j.status) && j.kind==='notify') actions.push(`<button class="btn btn-secondary btn-sm" data-job-resume="${j.job_id}">继续</button>`);
+  return `
+    <td>${JOB_KIND_LABEL[j.kind]||escapeHtml(j.kind)}</td>
+    <td>${JOB_STATUS_LABEL[j.status]||escapeHtml(j.status)}</td>
+    <td>${j.done||0}/${j.total||0}（${pct}%）${j.failed?` · 失败 ${j.failed}`:''}</td>
+    <td>${escapeHtml(j.message||'')}</td>
+    <td>${j.created_at?formatDate(j.created_at):'-'}</td>
+    <td>${actions.join(' ')}</td>`;
+}
+function renderJobRow(j){
+  const tbody = $('#jobs-body'); if(!tbody) return;
+  let tr = tbody.querySelector(`tr[data-job="${j.job_id}"]`);
+  if(!tr){
+    const empty = tbody.querySelector('td[colspan]'); if(empty) tbody.innerHTML='';
+    tr = document.createElement('tr'); tr.dataset.job = j.job_id; tbody.prepend(tr);
+  }
+  if(!j.created_at){ const old = tr.dataset.created; if(old) j.created_at = old; }
+  if(j.created_at) tr.dataset.created = j.created_at;
+  tr.innerHTML = jobRowHtml(j);
+}
+async function loadJobs(){
+  try{
+    const r = await apiCall('/jobs?limit=10');
+    const jobs = (r && r.jobs) || [];
+    const tbody = $('#jobs-body'); if(!tbody) return;
+    tbody.innerHTML = jobs.length ? '' : '<tr><td colspan="6" class="text-center">暂无任务</td></tr>';
+    jobs.slice().reverse().forEach(renderJobRow);
+    jobs.filter(j=>j.status==='running'||j.status==='pending').forEach(j=>trackJob(j.job_id, true));
+  }catch(e){ /* 静默 */ }
+}
+function trackJob(jobId, quiet=false){
+  if(!jobId || __jobStreams[jobId]) return;
+  const t = __getToken();
+  const es = new EventSource(`/member_renewal/jobs/${encodeURIComponent(jobId)}/events?token=${encodeURIComponent(t)}`);
+  __jobStreams[jobId] = es;
+  es.onmessage = (ev)=>{
+    let j; try{ j = JSON.parse(ev.data); }catch{ return; }
+    renderJobRow(j);
+    if(['succeeded','failed','cancelled','interrupted'].includes(j.status)){
+      es.close(); delete __jobStreams[jobId];
+      if(quiet) return;
+      const res = j.result || {};
+      if(j.status==='succeeded' && j.kind==='notify') showToast(`通知完成：成功 ${res.sent||0} 个群${(res.failed||[]).length?`，失败 ${(res.failed||[]).length} 个`:''}`,'success');
+      else if(j.status==='succeeded' && j.kind==='membership_check') showToast(`检查完成！提醒 ${res.reminded||0} 个群，退出 ${res.left||0} 个群`,'success');
+      else showToast(`任务${JOB_STATUS_LABEL[j.status]||j.status}：${j.message||''}`, j.status==='cancelled'?'info':'error');
+    }
+  };
+  es.onerror = ()=>{ es.close(); delete __jobStreams[jobId]; };
+}
+async function cancelJob(jobId){
+  try{ await apiCall(`/jobs/${encodeURIComponent(jobId)}/cancel`,{method:'POST'}); showToast('已请求取消','info'); }
+  catch(e){ showToast('取消失败: '+(e&&e.message?e.message:e),'error'); }
+}
+async function resumeJob(jobId){
+  try{ await apiCall(`/jobs/${encodeURIComponent(jobId)}/resume`,{method:'POST'}); trackJob(jobId); await loadJobs(); }
+  catch(e){ showToast('继续失败: '+(e&&e.message?e.message:e),'error'); }
+}
+
 // 读取系统配置中的“临近到期阈值(天)”配置
 async function loadSoonThreshold(){
   try{
@@ -1971,6 +2237,20 @@ function bindEvents(){
   $('#theme-toggle')?.addEventListener('click', toggleTheme);
   $$('.nav-item').forEach(i=> i.addEventListener('click', e=>{ e.preventDefault(); switchTab(i.dataset.tab);}));
   $('#generate-code-btn')?.addEventListener('click', generateCode);
+  $('#export-btn')?.addEventListener('click', exportData);
+  $('#import-btn')?.addEventListener('click', ()=>$('#import-file')?.click());
+  $('#import-file')?.addEventListener('change', e=>{ const f=e.target.files&&e.target.files[0]; e.target.value=''; importData(f); });
+  $('#db-checkpoint-btn')?.addEventListener('click', ()=>runDbMaintenance(false));
+  $('#db-maintenance-btn')?.addEventListener('click', ()=>runDbMaintenance(true));
+  $('#db-backup-btn')?.addEventListener('click', runDbBackup);
+  $('#db-queries-refresh-btn')?.addEventListener('click', loadDbQueries);
+  $('#jobs-refresh-btn')?.addEventListener('click', loadJobs);
+  $('#stats-refresh-btn')?.addEventListener('click', ()=>loadStatsData(true));
+  $('#jobs-body')?.addEventListener('click', (e)=>{
+    const c = e.target.closest('[data-job-cancel]'); if(c){ cancelJob(c.dataset.jobCancel); return; }
+    const r = e.target.closest('[data-job-resume]'); if(r){ resumeJob(r.dataset.jobResume); }
+  });
+  $('#db-queries-reset-btn')?.addEventListener('click', resetDbQueries);
   $('#save-permissions-btn')?.addEventListener('click', savePermissions);
   $('#open-permissions-json-btn')?.addEventListener('click', openPermJsonModal);
   $('#perm-json-close')?.addEventListener('click', closePermJsonModal);
@@ -1985,18 +2265,33 @@ function bindEvents(){
   $('#extend-close')?.addEventListener('click', ()=>closeModal('extend-modal'));
   $('#extend-cancel')?.addEventListener('click', ()=>closeModal('extend-modal'));
   $('#extend-confirm')?.addEventListener('click', submitManualExtend);
-  $('#group-search')?.addEventListener('input', e=>{ state.keyword=e.target.value.trim(); state.pagination.currentPage=1; renderGroupsTable(); });
-  $('#status-filter')?.addEventListener('change', e=>{ state.filter=e.target.value; state.pagination.currentPage=1; renderGroupsTable(); });
-  // 全选（跨页）：基于当前筛选结果
-  $('#select-all')?.addEventListener('change', e=>{
-    let list=[...state.groups];
-    if(state.filter!=='all') list=list.filter(g=>g.status===state.filter);
-    if(state.keyword) list=list.filter(g=>String(g.gid).includes(state.keyword));
-    if(e.target.checked){
-      for(const g of list){ state.selectedIds.add(Number(g.gid)); }
-    } else {
-      for(const g of list){ state.selectedIds.delete(Number(g.gid)); }
-    }
+  let groupSearchTimer=null;
+  $('#group-search')?.addEventListener('input', e=>{
+    state.keyword=e.target.value.trim();
+    clearTimeout(groupSearchTimer); groupSearchTimer=setTimeout(reloadGroupsFromFirstPage, 300);
+  });
+  $('#status-filter')?.addEventListener('change', e=>{ state.filter=e.target.value; reloadGroupsFromFirstPage(); });
+  $('#within-days-filter')?.addEventListener('change', e=>{ state.withinDays=e.target.value; reloadGroupsFromFirstPage(); });
+  // 表头排序：状态/剩余天数均按到期时间排序
+  $$('th[data-sort]').forEach(th=>th.addEventListener('click', ()=>{
+    const key=th.dataset.sort;
+    if(state.sortBy===key) state.sortDir = state.sortDir==='asc'?'desc':'asc';
+    else { state.sortBy=key; state.sortDir='asc'; }
+    reloadGroupsFromFirstPage();
+  }));
+  // 全选（跨页）：向服务端拉取当前筛选下的全部群号
+  $('#select-all')?.addEventListener('change', async e=>{
+    const checked = e.target.checked;
+    try{
+      if(!state.groupMatchIds){
+        const p = groupQueryParams(); p.set('ids_only','1');
+        const data = await apiCall('/groups?'+p.toString());
+        state.groupMatchIds = data.group_ids||[];
+      }
+      for(const gid of state.groupMatchIds){
+        if(checked) state.selectedIds.add(Number(gid)); else state.selectedIds.delete(Number(gid));
+      }
+    } catch(err){ showToast('获取群列表失败: '+(err&&err.message?err.message:err),'error'); }
     renderGroupsTable();
   });
   $('#refresh-btn')?.addEventListener('click', ()=>{ const active=$('.nav-item.active'); if(active) switchTab(active.dataset.tab); });
@@ -2083,11 +2378,46 @@ function bindEvents(){
 async function generateCode(){
   const btn=$('#generate-code-btn'); if(btn && btn.dataset.busy==='1') return; if(btn){ btn.dataset.busy='1'; btn.setAttribute('disabled','disabled'); }
   const length=parseInt($("#renewal-length").value)||30; let unit=$("#renewal-unit")?.value||"天"; unit = normalizeUnit(unit);
-  try{ showLoading(true); const r=await apiCall('/generate',{method:'POST', body: JSON.stringify({ length, unit })}); showToast(`续费码已生成: ${r.code}`,'success'); await loadRenewalData(); }
+  const count=Math.max(1, parseInt($("#renewal-count")?.value)||1);
+  try{
+    showLoading(true);
+    const r=await apiCall('/generate',{method:'POST', body: JSON.stringify({ length, unit, count })});
+    if((r.count||1) > 1) showToast(`已生成 ${r.count} 个续费码，可通过“导出”下载`,'success');
+    else showToast(`续费码已生成: ${r.code}`,'success');
+    await loadRenewalData();
+  }
   catch(e){ showToast('生成失败: '+(e&&e.message?e.message:e),'error'); }
   finally{ showLoading(false); if(btn){ delete btn.dataset.busy; btn.removeAttribute('disabled'); } }
 }
 
+// 导出：浏览器直接下载服务端流式输出
+function exportData(){
+  const kind=$('#transfer-kind')?.value||'codes';
+  const format=$('#transfer-format')?.value||'csv';
+  const p=new URLSearchParams({ kind, format });
+  const t=__getToken(); if(t) p.set('token', t);
+  const a=document.createElement('a');
+  a.href=`/member_renewal/export?${p.toString()}`;
+  document.body.appendChild(a); a.click(); a.remove();
+}
+
+// 导入：文件原样作为请求体上传，由服务端边读边写入
+async function importData(file){
+  if(!file) return;
+  const kind=$('#transfer-kind')?.value||'codes';
+  const format=/\.(ndjson|jsonl|json)$/i.test(file.name) ? 'ndjson' : ($('#transfer-format')?.value||'csv');
+  try{
+    showLoading(true);
+    const r=await apiCall(`/import?kind=${encodeURIComponent(kind)}&format=${encodeURIComponent(format)}`,{
+      method:'POST', body:file, headers:{'Content-Type': format==='csv' ? 'text/csv' : 'application/x-ndjson'}
+    });
+    showToast(`导入完成：${r.imported} 条，跳过 ${r.skipped} 条`, r.skipped ? 'warning' : 'success');
+    if(r.errors && r.errors.length) console.warn('导入跳过的记录', r.errors);
+    await loadRenewalData();
+  }catch(e){ showToast('导入失败: '+(e&&e.message?e.message:e),'error'); }
+  finally{ showLoading(false); }
+}
+
 // 权限JSON弹窗
 function openPermJsonModal(){
   const modal=document.getElementById('perm-json-modal');
@@ -2115,6 +2445,63 @@ async function savePermJson(){
   finally{ showLoading(false); }
 }
 
+// ===== 行级变更推送（/events，SSE）：按增量更新当前视图 =====
+let __changeStream = null, __changeRetryMs = 2000;
+function connectChangeStream(){
+  if(__changeStream) return;
+  const t = __getToken();
+  const es = new EventSource(`/member_renewal/events?token=${encodeURIComponent(t)}`);
+  __changeStream = es;
+  let reconnected = false;
+  es.onopen = ()=>{
+    // 断线期间可能错过事件：重连后整体刷新一次当前页
+    if(__changeRetryMs > 2000) reconnected = true;
+    __changeRetryMs = 2000;
+    if(reconnected) reloadActiveView();
+  };
+  es.onmessage = (ev)=>{ let evt; try{ evt = JSON.parse(ev.data); }catch{ return; } applyChange(evt); };
+  es.onerror = ()=>{
+    es.close(); __changeStream = null;
+    setTimeout(connectChangeStream, __changeRetryMs);
+    __changeRetryMs = Math.min(__changeRetryMs*2, 60000);
+  };
+}
+function reloadActiveView(){
+  const active = $('.nav-item.active');
+  const tab = active ? active.dataset.tab : 'dashboard';
+  if(tab==='dashboard') scheduleSummaryRefresh();
+  else if(tab==='renewal') fetchGroupsPage().catch(()=>{});
+  else if(tab==='ai-sessions') fetchAISessionsPage().catch(()=>{});
+}
+function applyChange(evt){
+  if(!evt || !evt.op) return;
+  if(evt.op==='resync'){ reloadActiveView(); return; }
+  if(evt.kind==='membership'){
+    const gid = String(evt.key);
+    scheduleSummaryRefresh();
+    const idx = (state.groups||[]).findIndex(g=>String(g.gid)===gid);
+    if(idx >= 0){
+      if(evt.op==='delete'){
+        state.groups.splice(idx,1);
+        state.pagination.totalItems = Math.max(0, state.pagination.totalItems-1);
+      } else {
+        state.groups[idx] = decorateGroup(gid, evt.data||{});
+      }
+      renderGroupsTable();
+    }
+  } else if(evt.kind==='code'){
+    if(!state.codes) return;
+    const meta = evt.data||{};
+    if(evt.op==='delete' || (meta.max_use && (meta.used_count||0) >= meta.max_use)) delete state.codes[evt.key];
+    else state.codes[evt.key] = meta;
+    renderCodes(state.codes);
+  } else if(evt.kind==='session'){
+    const list = state.aiSessions||[];
+    const idx = list.findIndex(x=>x.session_id===evt.key);
+    if(idx >= 0 && evt.data){ list[idx] = { ...list[idx], ...evt.data }; renderAISessionsTable(); }
+  }
+}
+
 // 初始化
 async function init(){
   document.body.setAttribute('data-theme', state.theme);
@@ -2123,6 +2510,11 @@ async function init(){
   // 先加载系统配置的"临近到期阈值(天)"
   await loadSoonThreshold();
   await loadDashboard();
+  await loadDbStatus();
+  loadDbBackups();
+  loadDbQueries();
+  loadJobs();
+  connectChangeStream();
 }
 
 // 增强主题切换
@@ -2142,13 +2534,11 @@ function toggleTheme(){
 // 事件绑定
 window.runScheduledTask = async function(){
   try{
-    showLoading(true);
     const r=await apiCall('/job/run',{method:'POST'});
-    showToast(`检查完成！提醒 ${r.reminded} 个群，退出 ${r.left} 个群`,'success');
+    showToast('已开始会员检查，完成后将提示结果','info');
+    trackJob(r.job_id);
   } catch(e){
     showToast('执行失败: '+(e&&e.message?e.message:e),'error');
-  } finally{
-    showLoading(false);
   }
 };
 
@@ -2170,18 +2560,31 @@ window.addEventListener('DOMContentLoaded', ()=>{
 window.switchTab = switchTab;
 
 // ===== AI 会话事件绑定 =====
+document.addEventListener('keydown', (e)=>{
+  const t=e.target; if(!(t instanceof Element)) return;
+  if(t.matches('#ai-search-input') && e.key==='Enter'){ runAISearch(); }
+});
 document.addEventListener('input', (e)=>{
   const t=e.target; if(!(t instanceof Element)) return;
-  if(t.matches('#ai-sessions-search')){ state.aiSessionsKeyword = t.value.trim(); renderAISessionsTable(); }
+  if(t.matches('#ai-sessions-search')){
+    state.aiSessionsKeyword = t.value.trim();
+    clearTimeout(state.aiSessionsSearchTimer); state.aiSessionsSearchTimer = setTimeout(reloadAISessionsFromFirstPage, 300);
+  }
 });
 document.addEventListener('change', (e)=>{
   const t=e.target; if(!(t instanceof Element)) return;
-  if(t.matches('#ai-sessions-type')){ state.aiSessionsType = t.value; renderAISessionsTable(); }
-  else if(t.matches('#ai-sessions-active')){ state.aiSessionsActive = t.value; renderAISessionsTable(); }
+  if(t.matches('#ai-sessions-type')){ state.aiSessionsType = t.value; reloadAISessionsFromFirstPage(); }
+  else if(t.matches('#ai-sessions-active')){ state.aiSessionsActive = t.value; reloadAISessionsFromFirstPage(); }
+  else if(t.matches('#ai-sessions-provider')){ state.aiSessionsProvider = t.value; reloadAISessionsFromFirstPage(); }
+  else if(t.matches('#ai-sessions-persona')){ state.aiSessionsPersona = t.value; reloadAISessionsFromFirstPage(); }
 });
 document.addEventListener('click', async (e)=>{
   const t=e.target; if(!(t instanceof Element)) return;
   if(t.matches('#ai-sessions-refresh')){ await loadAISessions(); }
+  else if(t.matches('#ai-search-btn')){ await runAISearch(); }
+  else if(t.matches('#ai-search-rebuild')){ await rebuildAISearchIndex(); }
+  else if(t.matches('#ai-sessions-prev')){ await goToAISessionsPage(state.aiSessionsPage-1); }
+  else if(t.matches('#ai-sessions-next')){ await goToAISessionsPage(state.aiSessionsPage+1); }
   else if(t.matches('.ai-session-edit')){
     const sid = t.getAttribute('data-sid')||''; const s = (state.aiSessions||[]).find(x=>encodeURIComponent(x.session_id)===sid || x.session_id===sid);
     if(s) openAISessionEditModal(s);
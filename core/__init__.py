@@ -6,6 +6,12 @@ from nonebot.log import logger
 # Mount the web console on startup and close shared HTTP client on shutdown
 driver = get_driver()
 
+# Group roster cache (registers bot connect hooks and member-change notices)
+try:
+    from . import roster as roster  # noqa: F401
+except Exception as e:
+    logger.debug(f"group roster 加载失败: {e}")
+
 
 @driver.on_startup
 async def _mount_web_console() -> None:
@@ -24,6 +30,29 @@ async def _mount_web_console() -> None:
         logger.warning(f"membership Web 控制台挂载失败: {e}")
 
 
+@driver.on_shutdown
+async def _stop_dispatcher() -> None:
+    """Interrupt console jobs, stop the dashboard counters, cancel queued outbound actions and stop the per-bot workers."""
+    try:
+        from ..console.jobs import job_manager
+
+        await job_manager.shutdown()
+    except Exception:
+        pass
+    try:
+        from ..console.membership_summary import get_membership_summary
+
+        await get_membership_summary().stop()
+    except Exception:
+        pass
+    try:
+        from .dispatcher import get_dispatcher
+
+        await get_dispatcher().shutdown()
+    except Exception:
+        pass
+
+
 @driver.on_shutdown
 async def _close_http_client() -> None:
     """Close shared HTTP client on bot shutdown."""
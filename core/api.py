@@ -43,6 +43,7 @@ from .framework.utils import (
     plugin_resource_dir,
 )
 from .framework.cache import KeyValueCache as KeyValueCache
+from .dispatcher import DeliveryReceipt, Priority, get_dispatcher
 
 __all__ = [
     # class
@@ -82,4 +83,8 @@ __all__ = [
     "config_dir",
     "plugin_data_dir",
     "plugin_resource_dir",
+    # outbound dispatcher
+    "get_dispatcher",
+    "Priority",
+    "DeliveryReceipt",
 ]
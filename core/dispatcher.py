@@ -0,0 +1,441 @@
+"""Outbound message dispatcher shared by all senders.
+
+Every group send or group leave that should respect risk-control limits goes
+through :func:`get_dispatcher`. Each bot has its own lane (a priority heap
+drained by one worker task), so different bots send concurrently while a single
+bot never bursts. Unless callers pin candidate bots, actions are routed to the
+bots the group roster (:mod:`.roster`) lists as members of the group. Before an
+action runs, the bot's token bucket and the target group's token bucket must
+both have a token; a job whose group is not ready is deferred without blocking
+the lane. Failed actions are retried with exponential
+backoff and then handed to the next candidate bot. Callers await a
+:class:`DeliveryReceipt`.
+
+Rates come from the system config (``outbound_*`` keys) and are re-read on
+config reload.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from nonebot import get_bots
+from nonebot.log import logger
+
+
+class Priority(IntEnum):
+    """Lower values are dispatched first within a bot lane."""
+
+    INTERACTIVE = 0  # replies to a user action (welcome, poke, ...)
+    NORMAL = 5  # single admin actions from the console
+    BULK = 10  # sweeps and broadcasts
+
+
+@dataclass
+class DeliveryReceipt:
+    ok: bool
+    api: str
+    group_id: int
+    bot_id: Optional[str] = None
+    message_id: Optional[int] = None
+    attempts: int = 0
+    error: Optional[str] = None
+    queued_ms: float = 0.0
+    total_ms: float = 0.0
+
+
+class TokenBucket:
+    """Classic token bucket; ``rate <= 0`` means unlimited."""
+
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = float(rate)
+        self.burst = max(1.0, float(burst))
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        if self.rate > 0:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self) -> float:
+        """Seconds until a token is available (0 when one is available now)."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(time.monotonic())
+        if self.tokens >= 1.0:
+            return 0.0
+        return (1.0 - self.tokens) / self.rate
+
+    def consume(self) -> None:
+        if self.rate <= 0:
+            return
+        self._refill(time.monotonic())
+        self.tokens -= 1.0
+
+    def is_full(self) -> bool:
+        self._refill(time.monotonic())
+        return self.rate <= 0 or self.tokens >= self.burst
+
+
+@dataclass(order=True)
+class _Job:
+    priority: int
+    seq: int
+    api: str = field(compare=False)
+    group_id: int = field(compare=False)
+    params: Dict[str, Any] = field(compare=False)
+    candidates: List[str] = field(compare=False)
+    future: "asyncio.Future[DeliveryReceipt]" = field(compare=False)
+    created: float = field(compare=False, default_factory=time.monotonic)
+    started: Optional[float] = field(compare=False, default=None)
+    attempts: int = field(compare=False, default=0)
+    bot_attempts: int = field(compare=False, default=0)
+    last_error: Optional[str] = field(compare=False, default=None)
+
+
+class _BotLane:
+    def __init__(self, owner: "OutboundDispatcher", bot_id: str) -> None:
+        self.owner = owner
+        self.bot_id = bot_id
+        self.heap: List[_Job] = []
+        # Jobs waiting on a timer (group bucket or retry backoff), keyed by seq
+        self.deferred: Dict[int, Tuple[asyncio.TimerHandle, _Job]] = {}
+        self.current: Optional[_Job] = None
+        self.wakeup = asyncio.Event()
+        self.bucket = TokenBucket(owner.bot_rate, owner.bot_burst)
+        self.last_bulk_at = 0.0
+        self.sent = 0
+        self.failed = 0
+        self.task: Optional[asyncio.Task] = None
+
+    def push(self, job: _Job) -> None:
+        heapq.heappush(self.heap, job)
+        self.wakeup.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+
+    def push_later(self, job: _Job, delay: float) -> None:
+        handle = asyncio.get_running_loop().call_later(max(0.0, delay), self._push_deferred, job)
+        self.deferred[job.seq] = (handle, job)
+
+    def _push_deferred(self, job: _Job) -> None:
+        self.deferred.pop(job.seq, None)
+        self.push(job)
+
+    async def _run(self) -> None:
+        while True:
+            if not self.heap:
+                self.wakeup.clear()
+                await self.wakeup.wait()
+                continue
+            wait = self.bucket.wait_time()
+            if wait > 0:
+                # Sleep then re-check the heap top, so a newly queued
+                # interactive reply overtakes the bulk job we were about to send
+                await asyncio.sleep(wait)
+                continue
+            job = heapq.heappop(self.heap)
+            if job.future.done():
+                continue
+            group_wait = self.owner._group_bucket(job.group_id).wait_time()
+            if job.priority >= Priority.BULK and self.owner.bulk_interval > 0:
+                group_wait = max(group_wait, self.last_bulk_at + self.owner.bulk_interval - time.monotonic())
+            if group_wait > 0:
+                self.push_later(job, group_wait)
+                continue
+            self.bucket.consume()
+            self.owner._group_bucket(job.group_id).consume()
+            if job.priority >= Priority.BULK:
+                self.last_bulk_at = time.monotonic()
+            self.current = job
+            try:
+                await self._execute(job)
+            finally:
+                self.current = None
+
+    async def _execute(self, job: _Job) -> None:
+        bot = get_bots().get(self.bot_id)
+        if job.started is None:
+            job.started = time.monotonic()
+        if bot is None:
+            job.last_error = f"bot {self.bot_id} 不在线"
+            self.owner._failover(job)
+            return
+        job.attempts += 1
+        job.bot_attempts += 1
+        try:
+            result = await bot.call_api(job.api, **job.params)
+        except Exception as e:
+            job.last_error = str(e) or type(e).__name__
+            self.failed += 1
+            if job.bot_attempts <= self.owner.max_retries:
+                backoff = self.owner.retry_base * (2 ** (job.bot_attempts - 1))
+                backoff *= 1.0 + random.random() * 0.25
+                logger.debug(f"[dispatch] {job.api} -> {job.group_id} 失败，{backoff:.1f}s 后重试: {e}")
+                self.push_later(job, backoff)
+            else:
+                self.owner._failover(job)
+            return
+        self.sent += 1
+        if job.api == "set_group_leave":
+            try:
+                from .roster import get_roster
+
+                get_roster().remove(self.bot_id, job.group_id)
+            except Exception:
+                pass
+        msg_id = None
+        if isinstance(result, dict):
+            try:
+                msg_id = int(result.get("message_id")) if result.get("message_id") is not None else None
+            except Exception:
+                msg_id = None
+        self.owner._resolve(job, ok=True, bot_id=self.bot_id, message_id=msg_id)
+
+
+class OutboundDispatcher:
+    """Per-bot lanes with token buckets, priorities, retries and receipts."""
+
+    _MAX_GROUP_BUCKETS = 5000
+
+    def __init__(self) -> None:
+        self._lanes: Dict[str, _BotLane] = {}
+        self._groups: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        self._seq = itertools.count()
+        self.bot_rate = 1.0
+        self.bot_burst = 3.0
+        self.group_rate = 20.0 / 60.0
+        self.group_burst = 3.0
+        self.max_retries = 2
+        self.retry_base = 2.0
+        self.bulk_interval = 0.0
+        self.reload()
+
+    # ---- configuration ----
+
+    def reload(self) -> None:
+        try:
+            from .system_config import load_cfg
+
+            cfg = load_cfg()
+        except Exception:
+            return
+        try:
+            self.bot_rate = float(cfg.get("outbound_bot_rate_per_second", 1.0) or 0.0)
+            self.bot_burst = float(cfg.get("outbound_bot_burst", 3) or 1)
+            self.group_rate = float(cfg.get("outbound_group_rate_per_minute", 20) or 0.0) / 60.0
+            self.group_burst = float(cfg.get("outbound_group_burst", 3) or 1)
+            self.max_retries = max(0, int(cfg.get("outbound_max_retries", 2) or 0))
+            self.retry_base = max(0.1, float(cfg.get("outbound_retry_base_seconds", 2.0) or 2.0))
+            # 兼容旧配置：批量操作之间的最小间隔
+            self.bulk_interval = max(0.0, float(cfg.get("member_renewal_batch_delay_seconds", 0) or 0.0))
+        except Exception as e:
+            logger.debug(f"[dispatch] 读取限速配置失败: {e}")
+            return
+        for lane in self._lanes.values():
+            lane.bucket = TokenBucket(self.bot_rate, self.bot_burst)
+        self._groups.clear()
+
+    # ---- internals ----
+
+    def _group_bucket(self, group_id: int) -> TokenBucket:
+        b = self._groups.get(group_id)
+        if b is None:
+            if len(self._groups) >= self._MAX_GROUP_BUCKETS:
+                # Drop idle (full) buckets first; they carry no state worth keeping
+                for gid in [g for g, bk in self._groups.items() if bk.is_full()][: self._MAX_GROUP_BUCKETS // 10 or 1]:
+                    self._groups.pop(gid, None)
+                while len(self._groups) >= self._MAX_GROUP_BUCKETS:
+                    self._groups.popitem(last=False)
+            b = self._groups[group_id] = TokenBucket(self.group_rate, self.group_burst)
+        else:
+            self._groups.move_to_end(group_id)
+        return b
+
+    def _lane(self, bot_id: str) -> _BotLane:
+        lane = self._lanes.get(bot_id)
+        if lane is None:
+            lane = self._lanes[bot_id] = _BotLane(self, bot_id)
+        return lane
+
+    def _failover(self, job: _Job) -> None:
+        if job.candidates:
+            nxt = job.candidates.pop(0)
+            job.bot_attempts = 0
+            self._lane(nxt).push(job)
+            return
+        self._resolve(job, ok=False)
+
+    def _resolve(self, job: _Job, *, ok: bool, bot_id: Optional[str] = None, message_id: Optional[int] = None) -> None:
+        if job.future.done():
+            return
+        now = time.monotonic()
+        job.future.set_result(
+            DeliveryReceipt(
+                ok=ok,
+                api=job.api,
+                group_id=job.group_id,
+                bot_id=bot_id,
+                message_id=message_id,
+                attempts=job.attempts,
+                error=None if ok else (job.last_error or "无可用 Bot"),
+                queued_ms=round(((job.started or now) - job.created) * 1000.0, 1),
+                total_ms=round((now - job.created) * 1000.0, 1),
+            )
+        )
+
+    @staticmethod
+    def _candidates(bot_id: Optional[str], bot_ids: Optional[Sequence[str]], group_id: int) -> List[str]:
+        live = list(get_bots().keys())
+        if not bot_ids:
+            # Route to bots the roster says are in the group; unknown groups try every bot
+            try:
+                from .roster import get_roster
+
+                known = get_roster().bots_for(group_id)
+            except Exception:
+                known = []
+            if known:
+                # A live preferred bot goes first even if the roster does not list it
+                # yet (e.g. the join notice was missed); it usually received the event
+                order = [str(bot_id)] if bot_id and (str(bot_id) in known or str(bot_id) in live) else []
+                order.extend(sid for sid in sorted(known) if sid not in order)
+                return order
+        order: List[str] = []
+        for sid in ([str(bot_id)] if bot_id else []) + [str(x) for x in (bot_ids or [])]:
+            if sid in live and sid not in order:
+                order.append(sid)
+        # Explicit candidates restrict routing; a preferred bot alone falls back to any live bot
+        if not bot_ids:
+            order.extend(sid for sid in live if sid not in order)
+        return order
+
+    # ---- public API ----
+
+    def submit(
+        self,
+        api: str,
+        group_id: int,
+        *,
+        priority: Priority = Priority.BULK,
+        bot_id: Optional[str] = None,
+        bot_ids: Optional[Sequence[str]] = None,
+        **params: Any,
+    ) -> "asyncio.Future[DeliveryReceipt]":
+        """Queue an OneBot action against a group and return its receipt future.
+
+        ``bot_id`` is tried first; ``bot_ids`` restricts the candidate bots.
+        """
+        loop = asyncio.get_running_loop()
+        fut: "asyncio.Future[DeliveryReceipt]" = loop.create_future()
+        gid = int(group_id)
+        candidates = self._candidates(bot_id, bot_ids, gid)
+        job = _Job(
+            priority=int(priority),
+            seq=next(self._seq),
+            api=api,
+            group_id=gid,
+            params={"group_id": gid, **params},
+            candidates=candidates,
+            future=fut,
+        )
+        if not candidates:
+            job.last_error = "无可用 Bot"
+            self._resolve(job, ok=False)
+            return fut
+        self._lane(candidates.pop(0)).push(job)
+        return fut
+
+    async def send_group(
+        self,
+        group_id: int,
+        message: Any,
+        *,
+        priority: Priority = Priority.BULK,
+        bot_id: Optional[str] = None,
+        bot_ids: Optional[Sequence[str]] = None,
+    ) -> DeliveryReceipt:
+        return await self.submit(
+            "send_group_msg", group_id, priority=priority, bot_id=bot_id, bot_ids=bot_ids, message=message
+        )
+
+    async def leave_group(
+        self,
+        group_id: int,
+        *,
+        priority: Priority = Priority.BULK,
+        bot_id: Optional[str] = None,
+        bot_ids: Optional[Sequence[str]] = None,
+    ) -> DeliveryReceipt:
+        return await self.submit("set_group_leave", group_id, priority=priority, bot_id=bot_id, bot_ids=bot_ids)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "lanes": {
+                sid: {
+                    "queued": len(lane.heap),
+                    "deferred": len(lane.deferred),
+                    "sent": lane.sent,
+                    "failed": lane.failed,
+                }
+                for sid, lane in self._lanes.items()
+            },
+            "group_buckets": len(self._groups),
+        }
+
+    async def shutdown(self) -> None:
+        """Stop every lane and fail all pending work with a receipt.
+
+        Queued jobs, jobs waiting on a timer and the job each lane is
+        executing all resolve with ``ok=False`` so no caller is left waiting.
+        """
+        pending: List[_Job] = []
+        for lane in self._lanes.values():
+            pending.extend(lane.heap)
+            lane.heap.clear()
+            for handle, job in lane.deferred.values():
+                handle.cancel()
+                pending.append(job)
+            lane.deferred.clear()
+            if lane.current is not None:
+                pending.append(lane.current)
+            if lane.task is not None and not lane.task.done():
+                lane.task.cancel()
+        self._lanes.clear()
+        for job in pending:
+            job.last_error = "调度器已关闭"
+            self._resolve(job, ok=False)
+
+
+_dispatcher: Optional[OutboundDispatcher] = None
+
+
+def get_dispatcher() -> OutboundDispatcher:
+    global _dispatcher
+    if _dispatcher is None:
+        _dispatcher = OutboundDispatcher()
+    return _dispatcher
+
+
+def _reload_dispatcher() -> None:
+    if _dispatcher is not None:
+        _dispatcher.reload()
+
+
+try:
+    from .framework.config import register_reload_callback
+
+    register_reload_callback("system", _reload_dispatcher)
+except Exception:
+    pass
@@ -0,0 +1,214 @@
+"""Cached group roster: which bot is in which group.
+
+Each bot's group list is fetched once (on connect or first use), refreshed
+after ``roster_refresh_ttl_minutes`` and patched incrementally from group
+increase/decrease notices concerning the bot itself. Lookups in both
+directions are plain dict/set operations.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Any, Dict, List, Optional, Set
+
+from nonebot import get_bots, get_driver, on_notice
+from nonebot.adapters.onebot.v11 import Bot, GroupDecreaseNoticeEvent, GroupIncreaseNoticeEvent, NoticeEvent
+from nonebot.log import logger
+
+# After a failed get_group_list, background refreshes of that bot wait this long
+_FAILURE_BACKOFF = 120.0
+
+
+class GroupRoster:
+    def __init__(self) -> None:
+        self._groups: Dict[str, Set[int]] = {}
+        self._index: Dict[int, Set[str]] = {}
+        self._loaded_at: Dict[str, float] = {}
+        self._failed_at: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._bg: Set[asyncio.Task] = set()
+        self.ttl = 6 * 3600.0
+        self.reload()
+
+    def reload(self) -> None:
+        try:
+            from .system_config import load_cfg
+
+            minutes = float(load_cfg().get("roster_refresh_ttl_minutes", 360) or 360)
+            self.ttl = max(60.0, minutes * 60.0)
+        except Exception:
+            pass
+
+    # ---- patching ----
+
+    def add(self, bot_id: str, group_id: int) -> None:
+        sid, gid = str(bot_id), int(group_id)
+        self._groups.setdefault(sid, set()).add(gid)
+        self._index.setdefault(gid, set()).add(sid)
+
+    def remove(self, bot_id: str, group_id: int) -> None:
+        sid, gid = str(bot_id), int(group_id)
+        self._groups.get(sid, set()).discard(gid)
+        bots = self._index.get(gid)
+        if bots is not None:
+            bots.discard(sid)
+            if not bots:
+                self._index.pop(gid, None)
+
+    def drop_bot(self, bot_id: str) -> None:
+        sid = str(bot_id)
+        for gid in self._groups.pop(sid, set()):
+            self.remove(sid, gid)
+        self._loaded_at.pop(sid, None)
+        self._failed_at.pop(sid, None)
+
+    def _replace(self, bot_id: str, groups: Set[int]) -> None:
+        sid = str(bot_id)
+        for gid in self._groups.get(sid, set()) - groups:
+            self.remove(sid, gid)
+        for gid in groups:
+            self.add(sid, gid)
+        self._groups.setdefault(sid, set())
+        self._loaded_at[sid] = time.monotonic()
+
+    # ---- loading ----
+
+    async def refresh(self, bot: Bot) -> None:
+        sid = str(bot.self_id)
+        lock = self._locks.setdefault(sid, asyncio.Lock())
+        async with lock:
+            try:
+                gl = await bot.get_group_list()  # type: ignore[attr-defined]
+            except Exception as e:
+                self._failed_at[sid] = time.monotonic()
+                logger.debug(f"[roster] get_group_list 失败 {sid}: {e}")
+                return
+            self._failed_at.pop(sid, None)
+            groups: Set[int] = set()
+            for g in gl or []:
+                try:
+                    gid = int((g.get("group_id") if isinstance(g, dict) else getattr(g, "group_id", 0)) or 0)
+                except Exception:
+                    continue
+                if gid:
+                    groups.add(gid)
+            self._replace(sid, groups)
+            logger.debug(f"[roster] {sid} 群列表已刷新：{len(groups)} 个群")
+
+    def _stale(self, bot_id: str) -> bool:
+        at = self._loaded_at.get(str(bot_id))
+        return at is None or (time.monotonic() - at) > self.ttl
+
+    async def ensure_loaded(self) -> None:
+        """Make sure every live bot has a roster that is within the TTL."""
+        live = get_bots()
+        for sid in [s for s in self._groups if s not in live]:
+            self.drop_bot(sid)
+        stale = [b for sid, b in live.items() if self._stale(sid)]
+        if stale:
+            await asyncio.gather(*(self.refresh(b) for b in stale))  # type: ignore[arg-type]
+
+    def _refresh_in_background(self) -> None:
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return
+        live = get_bots()
+        now = time.monotonic()
+        for sid, b in live.items():
+            failed = self._failed_at.get(sid)
+            if failed is not None and now - failed < _FAILURE_BACKOFF:
+                continue
+            if self._stale(sid) and not self._locks.get(sid, asyncio.Lock()).locked():
+                t = loop.create_task(self.refresh(b))  # type: ignore[arg-type]
+                self._bg.add(t)
+                t.add_done_callback(self._bg.discard)
+
+    # ---- lookups ----
+
+    def bots_for(self, group_id: int) -> List[str]:
+        """Live bots known to be in the group (may be empty if unknown)."""
+        self._refresh_in_background()
+        live = get_bots()
+        return [sid for sid in self._index.get(int(group_id), ()) if sid in live]
+
+    def groups_of(self, bot_id: str) -> Set[int]:
+        return set(self._groups.get(str(bot_id), set()))
+
+    def group_map(self) -> Dict[int, List[str]]:
+        """group_id -> bots, for live bots only."""
+        live = get_bots()
+        out: Dict[int, List[str]] = {}
+        for gid, bots in self._index.items():
+            ids = [sid for sid in bots if sid in live]
+            if ids:
+                out[gid] = ids
+        return out
+
+    def summary(self) -> Dict[str, Any]:
+        now = time.monotonic()
+        return {
+            sid: {
+                "groups": len(groups),
+                "age_seconds": round(now - self._loaded_at[sid], 1) if sid in self._loaded_at else None,
+            }
+            for sid, groups in self._groups.items()
+        }
+
+
+_roster: Optional[GroupRoster] = None
+
+
+def get_roster() -> GroupRoster:
+    global _roster
+    if _roster is None:
+        _roster = GroupRoster()
+    return _roster
+
+
+# ---- lifecycle & notices ----
+
+driver = get_driver()
+
+
+@driver.on_bot_connect
+async def _roster_on_connect(bot: Bot) -> None:
+    await get_roster().refresh(bot)
+
+
+@driver.on_bot_disconnect
+async def _roster_on_disconnect(bot: Bot) -> None:
+    get_roster().drop_bot(str(bot.self_id))
+
+
+async def _is_self_member_change(event: NoticeEvent) -> bool:
+    return isinstance(event, (GroupIncreaseNoticeEvent, GroupDecreaseNoticeEvent)) and str(
+        getattr(event, "user_id", "")
+    ) == str(getattr(event, "self_id", ""))
+
+
+_roster_notice = on_notice(rule=_is_self_member_change, priority=1, block=False)
+
+
+@_roster_notice.handle()
+async def _(event: NoticeEvent) -> None:
+    roster = get_roster()
+    if isinstance(event, GroupIncreaseNoticeEvent):
+        roster.add(str(event.self_id), int(event.group_id))
+    else:
+        # leave / kick_me：本 Bot 已不在该群
+        roster.remove(str(event.self_id), int(event.group_id))
+
+
+def _reload_roster() -> None:
+    if _roster is not None:
+        _roster.reload()
+
+
+try:
+    from .framework.config import register_reload_callback
+
+    register_reload_callback("system", _reload_roster)
+except Exception:
+    pass
@@ -16,6 +16,9 @@ SYSTEM_DEFAULTS: Dict[str, Any] = {
     "member_renewal_schedule_hour": 12,
     "member_renewal_schedule_minute": 0,
     "member_renewal_schedule_second": 0,
+    "member_renewal_timer_enable": True,  # 进程内到期定时器（按各群到点触发）
+    "member_renewal_timer_remind_hour": 10,  # 定时器发送提醒的时刻（本地时间）
+    "member_renewal_timer_remind_minute": 0,
     # 提醒行为
     "member_renewal_reminder_days_before": 7,
     "member_renewal_daily_remind_once": True,
@@ -31,12 +34,37 @@ SYSTEM_DEFAULTS: Dict[str, Any] = {
     "member_renewal_console_token_updated_at": None,
     # 可选：统计服务 API 地址（供网页端转发）
     "member_renewal_stats_api_url": "http://127.0.0.1:8000",
+    "member_renewal_stats_cache_ttl_seconds": 30,  # 统计缓存有效期（秒）
+    "member_renewal_stats_max_stale_seconds": 600,  # 过期后仍可先返回旧数据的最长时间（秒）
     # 续费码生成
     "member_renewal_code_prefix": "ww续费",
     "member_renewal_code_random_len": 6,  # 随机码长度（十六进制字符）
     "member_renewal_code_expire_days": 0,  # 过期天数（0 表示永久）
     "member_renewal_code_max_use": 1,
-    "member_renewal_contact_suffix": 1
+    "member_renewal_contact_suffix": 1,
+    # 数据库维护（SQLite）
+    "db_maintenance_enable": True,
+    "db_checkpoint_interval_minutes": 30,
+    "db_maintenance_hour": 4,
+    "db_maintenance_minute": 30,
+    "db_incremental_vacuum_pages": 0,  # 每次回收的空闲页数（0 表示全部）
+    "db_size_history_keep": 500,
+    # 在线备份（SQLite backup API）
+    "db_backup_auto_enable": False,  # 夜间维护后自动备份
+    "db_backup_keep": 7,
+    "db_backup_step_pages": 256,  # 每步复制的页数
+    "db_backup_step_sleep_ms": 5,  # 步与步之间让出的时间
+    # SQL 统计与慢查询日志
+    "db_query_stats_enable": True,
+    "db_slow_query_ms": 200,
+    # 消息发送限速（全局出站调度器）
+    "outbound_bot_rate_per_second": 1.0,
+    "outbound_bot_burst": 3,
+    "outbound_group_rate_per_minute": 20,
+    "outbound_group_burst": 3,
+    "outbound_max_retries": 2,
+    "outbound_retry_base_seconds": 2.0,
+    "roster_refresh_ttl_minutes": 360,  # Bot 群列表缓存刷新周期
 }
 
 
@@ -101,6 +129,34 @@ SYSTEM_SCHEMA: Dict[str, Any] = {
             "x-group": "定时与时区",
             "x-order": 5
         },
+        "member_renewal_timer_enable": {
+            "type": "boolean",
+            "title": "启用到期定时器",
+            "description": "进程内按各群的下一次动作时间（提醒日/到期时刻）准时触发；每日定时任务保留为对账",
+            "default": True,
+            "x-group": "定时与时区",
+            "x-order": 6
+        },
+        "member_renewal_timer_remind_hour": {
+            "type": "integer",
+            "title": "定时器提醒小时",
+            "description": "进入提醒窗口后，每天在该时刻发送提醒（本地时区，0-23）",
+            "default": 10,
+            "minimum": 0,
+            "maximum": 23,
+            "x-group": "定时与时区",
+            "x-order": 7
+        },
+        "member_renewal_timer_remind_minute": {
+            "type": "integer",
+            "title": "定时器提醒分钟",
+            "description": "定时器发送提醒的分钟（0-59）",
+            "default": 0,
+            "minimum": 0,
+            "maximum": 59,
+            "x-group": "定时与时区",
+            "x-order": 8
+        },
 
         # 提醒行为
         "member_renewal_reminder_days_before": {
@@ -188,6 +244,24 @@ SYSTEM_SCHEMA: Dict[str, Any] = {
             "x-group": "控制台",
             "x-order": 36
         },
+        "member_renewal_stats_cache_ttl_seconds": {
+            "type": "integer",
+            "title": "统计缓存有效期(秒)",
+            "description": "有效期内直接返回缓存的统计数据，不再请求统计服务；0 表示每次都刷新",
+            "default": 30,
+            "minimum": 0,
+            "x-group": "控制台",
+            "x-order": 37
+        },
+        "member_renewal_stats_max_stale_seconds": {
+            "type": "integer",
+            "title": "统计最长陈旧时间(秒)",
+            "description": "缓存过期但未超过该时长时先返回旧数据并在后台刷新；超过后等待刷新完成",
+            "default": 600,
+            "minimum": 0,
+            "x-group": "控制台",
+            "x-order": 38
+        },
 
         # 续费码生成
         "member_renewal_code_prefix": {
@@ -234,6 +308,179 @@ SYSTEM_SCHEMA: Dict[str, Any] = {
             "x-group": "延时",
             "x-order": 44
         },
+
+        # 数据库维护
+        "db_maintenance_enable": {
+            "type": "boolean",
+            "title": "启用数据库维护",
+            "description": "定时执行 WAL checkpoint、增量 VACUUM 与 ANALYZE（需要 nonebot_plugin_apscheduler）",
+            "default": True,
+            "x-group": "数据库维护",
+            "x-order": 50
+        },
+        "db_checkpoint_interval_minutes": {
+            "type": "integer",
+            "title": "Checkpoint 间隔(分钟)",
+            "description": "每隔多少分钟执行一次 wal_checkpoint(TRUNCATE) 并记录数据库大小",
+            "default": 30,
+            "minimum": 1,
+            "x-group": "数据库维护",
+            "x-order": 51
+        },
+        "db_maintenance_hour": {
+            "type": "integer",
+            "title": "整理执行小时",
+            "description": "每日整理（增量 VACUUM + ANALYZE/optimize）的小时，建议选在低峰期",
+            "default": 4,
+            "minimum": 0,
+            "maximum": 23,
+            "x-group": "数据库维护",
+            "x-order": 52
+        },
+        "db_maintenance_minute": {
+            "type": "integer",
+            "title": "整理执行分钟",
+            "description": "每日整理的分钟（0-59）",
+            "default": 30,
+            "minimum": 0,
+            "maximum": 59,
+            "x-group": "数据库维护",
+            "x-order": 53
+        },
+        "db_incremental_vacuum_pages": {
+            "type": "integer",
+            "title": "增量回收页数",
+            "description": "每次 incremental_vacuum 回收的空闲页数，0 表示全部回收",
+            "default": 0,
+            "minimum": 0,
+            "x-group": "数据库维护",
+            "x-order": 54
+        },
+        "db_size_history_keep": {
+            "type": "integer",
+            "title": "大小历史保留条数",
+            "description": "数据库/WAL 大小历史最多保留的记录数",
+            "default": 500,
+            "minimum": 10,
+            "x-group": "数据库维护",
+            "x-order": 55
+        },
+        "db_backup_auto_enable": {
+            "type": "boolean",
+            "title": "夜间自动备份",
+            "description": "每日整理完成后使用 SQLite 在线备份 API 备份数据库到 data/db_backups",
+            "default": False,
+            "x-group": "数据库维护",
+            "x-order": 56
+        },
+        "db_backup_keep": {
+            "type": "integer",
+            "title": "备份保留份数",
+            "description": "超出份数的旧备份会被自动删除；0 表示不自动删除",
+            "default": 7,
+            "minimum": 0,
+            "x-group": "数据库维护",
+            "x-order": 57
+        },
+        "db_backup_step_pages": {
+            "type": "integer",
+            "title": "备份每步页数",
+            "description": "在线备份每一步复制的页数；越小对写入的影响越小，但总耗时越长",
+            "default": 256,
+            "minimum": 1,
+            "x-group": "数据库维护",
+            "x-order": 58
+        },
+        "db_backup_step_sleep_ms": {
+            "type": "integer",
+            "title": "备份步间隔(毫秒)",
+            "description": "两步之间暂停的毫秒数，让写入方有机会获得数据库",
+            "default": 5,
+            "minimum": 0,
+            "x-group": "数据库维护",
+            "x-order": 59
+        },
+        "db_query_stats_enable": {
+            "type": "boolean",
+            "title": "启用 SQL 统计",
+            "description": "按语句指纹统计执行次数与 p50/p95/p99 耗时，可在控制台查看",
+            "default": True,
+            "x-group": "数据库维护",
+            "x-order": 60
+        },
+        "db_slow_query_ms": {
+            "type": "integer",
+            "title": "慢查询阈值(毫秒)",
+            "description": "耗时超过该值的语句会连同调用方（模型方法）记录到慢查询日志，0 表示关闭",
+            "default": 200,
+            "minimum": 0,
+            "x-group": "数据库维护",
+            "x-order": 61
+        },
+        # 消息发送限速
+        "outbound_bot_rate_per_second": {
+            "type": "number",
+            "title": "单 Bot 发送速率(条/秒)",
+            "description": "每个 Bot 平均每秒最多发送/执行的群操作数，0 表示不限制；不同 Bot 之间并行",
+            "default": 1.0,
+            "minimum": 0,
+            "x-group": "消息发送",
+            "x-order": 70
+        },
+        "outbound_bot_burst": {
+            "type": "integer",
+            "title": "单 Bot 突发上限",
+            "description": "每个 Bot 允许连续发送的条数（令牌桶容量）",
+            "default": 3,
+            "minimum": 1,
+            "x-group": "消息发送",
+            "x-order": 71
+        },
+        "outbound_group_rate_per_minute": {
+            "type": "number",
+            "title": "单群发送速率(条/分钟)",
+            "description": "同一群每分钟最多收到的消息/操作数，0 表示不限制",
+            "default": 20,
+            "minimum": 0,
+            "x-group": "消息发送",
+            "x-order": 72
+        },
+        "outbound_group_burst": {
+            "type": "integer",
+            "title": "单群突发上限",
+            "description": "同一群允许连续发送的条数（令牌桶容量）",
+            "default": 3,
+            "minimum": 1,
+            "x-group": "消息发送",
+            "x-order": 73
+        },
+        "outbound_max_retries": {
+            "type": "integer",
+            "title": "失败重试次数",
+            "description": "单个 Bot 发送失败后的重试次数，用尽后切换到下一个可用 Bot",
+            "default": 2,
+            "minimum": 0,
+            "x-group": "消息发送",
+            "x-order": 74
+        },
+        "outbound_retry_base_seconds": {
+            "type": "number",
+            "title": "重试基础间隔(秒)",
+            "description": "重试采用指数退避：基础间隔 × 2^(次数-1)",
+            "default": 2.0,
+            "minimum": 0.1,
+            "x-group": "消息发送",
+            "x-order": 75
+        },
+        "roster_refresh_ttl_minutes": {
+            "type": "integer",
+            "title": "群列表缓存刷新(分钟)",
+            "description": "各 Bot 群列表缓存的刷新周期；入群/退群/被踢通知会即时更新缓存",
+            "default": 360,
+            "minimum": 1,
+            "x-group": "消息发送",
+            "x-order": 76
+        },
     }
 }
 
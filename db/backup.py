@@ -0,0 +1,183 @@
+"""Online backups of entertain.db using the SQLite backup API.
+
+The copy runs in a worker thread on its own stdlib ``sqlite3`` connections and
+proceeds in page-sized steps, sleeping briefly between steps so writers get a
+chance at the database; the event loop is never blocked. Finished backups are
+written to a temporary file first and then renamed, and old files are rotated
+according to ``db_backup_keep``.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from nonebot.log import logger
+
+from .base_models import DB_PATH
+from ..core.framework.utils import data_dir
+
+
+BACKUP_PREFIX = "entertain-"
+BACKUP_SUFFIX = ".db"
+
+_backup_lock = asyncio.Lock()
+_last_report: Optional[Dict[str, Any]] = None
+
+
+class _TooManyRestarts(Exception):
+    """Raised from the progress callback to abort a stepped backup that keeps restarting."""
+
+
+def backup_dir() -> Path:
+    return data_dir("db_backups")
+
+
+def _cfg() -> Dict[str, Any]:
+    from ..core.system_config import load_cfg
+
+    return load_cfg()
+
+
+def _backup_sync(target: Path, step_pages: int, sleep_s: float, max_restarts: int) -> Dict[str, Any]:
+    """Blocking backup body; executed via ``asyncio.to_thread``."""
+    tmp = target.with_name(target.name + ".part")
+    try:
+        tmp.unlink()
+    except FileNotFoundError:
+        pass
+
+    stats: Dict[str, Any] = {"steps": 0, "restarts": 0, "total_pages": 0, "last_remaining": None}
+
+    def _progress(status: int, remaining: int, total: int) -> None:
+        stats["steps"] += 1
+        stats["total_pages"] = total
+        last = stats["last_remaining"]
+        # Writes through another connection restart the copy from page 1
+        if last is not None and remaining > last:
+            stats["restarts"] += 1
+            if stats["restarts"] > max_restarts:
+                raise _TooManyRestarts()
+        stats["last_remaining"] = remaining
+        if remaining > 0 and sleep_s > 0:
+            time.sleep(sleep_s)
+
+    started = time.perf_counter()
+    mode = "stepped"
+    try:
+        src = sqlite3.connect(str(DB_PATH), timeout=5.0)
+        try:
+            dst = sqlite3.connect(str(tmp))
+            try:
+                try:
+                    src.backup(dst, pages=max(1, step_pages), progress=_progress)
+                except _TooManyRestarts:
+                    # Under WAL a single-step copy only holds a read snapshot, so writers
+                    # are not blocked; use it when the database is too busy to converge.
+                    mode = "single"
+                    src.backup(dst, pages=-1)
+                    stats["steps"] += 1
+            finally:
+                dst.close()
+        finally:
+            src.close()
+        os.replace(tmp, target)
+    except BaseException:
+        # Do not leave a half-written copy behind
+        try:
+            tmp.unlink()
+        except OSError:
+            pass
+        raise
+    duration = time.perf_counter() - started
+
+    pages = int(stats["total_pages"] or 0)
+    if not pages:
+        try:
+            conn = sqlite3.connect(str(target))
+            try:
+                pages = int(conn.execute("PRAGMA page_count").fetchone()[0])
+            finally:
+                conn.close()
+        except Exception:
+            pages = 0
+    return {
+        "file": target.name,
+        "bytes": target.stat().st_size,
+        "pages": pages,
+        "steps": int(stats["steps"]),
+        "restarts": int(stats["restarts"]),
+        "mode": mode,
+        "duration_ms": round(duration * 1000.0, 2),
+        "pages_per_sec": round(pages / duration, 1) if duration > 0 else float(pages),
+        "finished_at": datetime.now().isoformat(timespec="seconds"),
+    }
+
+
+def list_backups() -> List[Dict[str, Any]]:
+    """Backups on disk, newest first."""
+    out: List[Dict[str, Any]] = []
+    try:
+        for p in backup_dir().glob(f"{BACKUP_PREFIX}*{BACKUP_SUFFIX}"):
+            try:
+                st = p.stat()
+            except OSError:
+                continue
+            out.append(
+                {
+                    "file": p.name,
+                    "bytes": st.st_size,
+                    "modified_at": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
+                }
+            )
+    except Exception:
+        pass
+    out.sort(key=lambda x: x["file"], reverse=True)
+    return out
+
+
+def _rotate(keep: int) -> List[str]:
+    """Delete backups beyond the newest ``keep``; ``keep <= 0`` disables rotation."""
+    removed: List[str] = []
+    if keep <= 0:
+        return removed
+    for item in list_backups()[keep:]:
+        try:
+            (backup_dir() / item["file"]).unlink()
+            removed.append(item["file"])
+        except Exception:
+            continue
+    return removed
+
+
+async def run_backup() -> Dict[str, Any]:
+    """Create one online backup and rotate old ones; returns a timing report."""
+    global _last_report
+    cfg = _cfg()
+    step_pages = int(cfg.get("db_backup_step_pages", 256) or 256)
+    sleep_ms = float(cfg.get("db_backup_step_sleep_ms", 5) or 0)
+    raw_keep = cfg.get("db_backup_keep", 7)
+    # 0 keeps every backup (rotation disabled); only a missing value falls back to 7
+    keep = 7 if raw_keep is None or raw_keep == "" else max(0, int(raw_keep))
+    if _backup_lock.locked():
+        raise RuntimeError("已有备份正在进行")
+    async with _backup_lock:
+        name = f"{BACKUP_PREFIX}{datetime.now().strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}"
+        target = backup_dir() / name
+        report = await asyncio.to_thread(_backup_sync, target, step_pages, sleep_ms / 1000.0, 8)
+        report["rotated"] = _rotate(keep)
+        _last_report = report
+    logger.info(
+        f"[DB] 在线备份完成 {report['file']}：{report['pages']} 页，用时 {report['duration_ms']}ms，"
+        f"{report['pages_per_sec']} 页/秒（{report['mode']}，重启 {report['restarts']} 次）"
+    )
+    return report
+
+
+def last_backup_report() -> Optional[Dict[str, Any]]:
+    return dict(_last_report) if _last_report else None
@@ -1,6 +1,8 @@
 from __future__ import annotations
 
 import asyncio
+import base64
+import json
 import sqlite3
 from functools import wraps
 from typing import Any, Awaitable, Callable, Dict, List, Optional, Type, TypeVar
@@ -13,6 +15,7 @@ from sqlalchemy.ext.asyncio import async_sessionmaker  # type: ignore
 from sqlmodel import Field, SQLModel, and_, select
 
 from ..core.framework.utils import data_dir
+from .query_stats import current_caller, install_query_listeners
 
 
 # ---- Type vars ----
@@ -31,6 +34,16 @@ async_maker: async_sessionmaker[AsyncSession] = None  # type: ignore[assignment]
 _db_init_lock = asyncio.Lock()
 _db_initialized = False
 sqlite_semaphore: Optional[asyncio.Semaphore] = None
+_sql_functions: Dict[str, Any] = {}
+
+
+def register_sql_function(name: str, nargs: int, fn: Callable[..., Any]) -> None:
+    """Register a deterministic SQL function on every pooled connection.
+
+    Must be called before ``init_database`` (i.e. at import time) so that
+    triggers referencing the function work on all connections.
+    """
+    _sql_functions[name] = (nargs, fn)
 
 
 async def init_database() -> None:
@@ -59,6 +72,9 @@ async def init_database() -> None:
             def _set_pragmas(dbapi_connection: sqlite3.Connection, connection_record):  # type: ignore[override]
                 try:
                     cur = dbapi_connection.cursor()
+                    # Only takes effect on a fresh database (before the first table
+                    # is created); lets the maintenance job reclaim free pages.
+                    cur.execute("PRAGMA auto_vacuum=INCREMENTAL")
                     cur.execute("PRAGMA journal_mode=WAL")
                     cur.execute("PRAGMA synchronous=NORMAL")
                     cur.execute("PRAGMA busy_timeout=5000")
@@ -71,6 +87,14 @@ async def init_database() -> None:
                 except Exception:
                     # Best effort; keep running even if PRAGMA fails
                     pass
+                for fname, (nargs, fn) in _sql_functions.items():
+                    try:
+                        dbapi_connection.create_function(fname, nargs, fn, deterministic=True)
+                    except Exception as e:
+                        logger.warning(f"[DB] Failed to register SQL function {fname}: {e}")
+
+            # Per-statement timing and slow-query log (see db/query_stats.py)
+            install_query_listeners(eng.sync_engine)
 
             # Assign globals only after successful creation
             global engine  # noqa: PLW0603 (explicit global assignment)
@@ -81,6 +105,7 @@ async def init_database() -> None:
             # Create all tables declared with SQLModel
             async with engine.begin() as conn:  # type: ignore[arg-type]
                 await conn.run_sync(SQLModel.metadata.create_all)
+                await conn.run_sync(_create_missing_indexes)
 
             _db_initialized = True
             logger.info("[DB] SQLite initialized successfully")
@@ -89,6 +114,39 @@ async def init_database() -> None:
             raise ValueError("[DB] Initialization failed, please check environment and dependencies")
 
 
+def _create_missing_indexes(sync_conn: Any) -> None:
+    """Create declared indexes that are missing on pre-existing tables.
+
+    ``create_all`` only emits indexes together with newly created tables, so an
+    ``index=True`` added to a model later would otherwise never reach old
+    databases.
+    """
+    for table in SQLModel.metadata.sorted_tables:
+        for idx in table.indexes:
+            try:
+                idx.create(sync_conn, checkfirst=True)
+            except Exception as e:
+                logger.warning(f"[DB] Failed to create index {idx.name}: {e}")
+
+
+def encode_cursor(key: List[Any]) -> str:
+    """Encode a keyset pagination position as an opaque URL-safe token."""
+    raw = json.dumps(key, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: Optional[str]) -> Optional[List[Any]]:
+    """Inverse of encode_cursor(); returns None for empty or malformed tokens."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        key = json.loads(raw.decode("utf-8"))
+    except Exception:
+        return None
+    return key if isinstance(key, list) else None
+
+
 def with_session(
     func: Callable[Concatenate[Any, AsyncSession, P], Awaitable[R]]
 ) -> Callable[Concatenate[Any, P], Awaitable[R]]:
@@ -109,14 +167,23 @@ def with_session(
         if not _db_initialized:
             raise RuntimeError("数据库尚未初始化，请先调用 init_database()")
 
-        session = kwargs.pop("session", None)
-        if session is not None:
-            return await func(self, session, *args, **kwargs)
-
-        async with async_maker() as new_session:  # type: ignore[operator]
-            result = await func(self, new_session, *args, **kwargs)
-            await new_session.commit()
-            return result
+        # Attribute queries to the outermost model method for the slow-query log
+        token = None
+        if current_caller.get() is None:
+            owner = self.__name__ if isinstance(self, type) else type(self).__name__
+            token = current_caller.set(f"{owner}.{func.__name__}")
+        try:
+            session = kwargs.pop("session", None)
+            if session is not None:
+                return await func(self, session, *args, **kwargs)
+
+            async with async_maker() as new_session:  # type: ignore[operator]
+                result = await func(self, new_session, *args, **kwargs)
+                await new_session.commit()
+                return result
+        finally:
+            if token is not None:
+                current_caller.reset(token)
 
     return wrapper
 
@@ -150,6 +217,21 @@ class BaseIDModel(SQLModel):
         result = await session.execute(stmt)
         return result.scalars().all()
 
+    @classmethod
+    @with_session
+    async def select_after_id(
+        cls: Type[T_BaseIDModel], session: AsyncSession, after_id: int = 0, limit: int = 500
+    ) -> List[T_BaseIDModel]:
+        """Rows with ``id > after_id`` in id order (keyset chunks for streaming)."""
+        stmt = (
+            select(cls)
+            .where(cls.id > int(after_id))  # type: ignore[operator]
+            .order_by(cls.id.asc())  # type: ignore[union-attr,attr-defined]
+            .limit(max(1, int(limit)))
+        )
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
     @classmethod
     @with_session
     async def _batch_insert_or_update(
@@ -0,0 +1,90 @@
+"""Row-level change events emitted by the model layer.
+
+Model methods call :func:`record_change` with their session; the events are
+held on the session and only published once the transaction commits (they
+are dropped on rollback). Subscribers (the console's ``/events`` stream) get
+an ``asyncio.Queue`` each. A subscriber that falls behind receives a single
+``{"op": "resync"}`` event instead of an unbounded backlog.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+_PENDING_KEY = "entertain_pending_changes"
+_QUEUE_SIZE = 1000
+
+
+class ChangeFeed:
+    def __init__(self) -> None:
+        self._subs: Set[asyncio.Queue] = set()
+        self._seq = itertools.count(1)
+
+    def subscribe(self) -> asyncio.Queue:
+        q: asyncio.Queue = asyncio.Queue(maxsize=_QUEUE_SIZE)
+        self._subs.add(q)
+        return q
+
+    def unsubscribe(self, q: asyncio.Queue) -> None:
+        self._subs.discard(q)
+
+    @property
+    def subscribers(self) -> int:
+        return len(self._subs)
+
+    def publish(self, evt: Dict[str, Any]) -> None:
+        if not self._subs:
+            return
+        evt = dict(evt, seq=next(self._seq))
+        for q in list(self._subs):
+            try:
+                q.put_nowait(evt)
+            except asyncio.QueueFull:
+                # Slow consumer: replace the backlog with one resync marker
+                while not q.empty():
+                    q.get_nowait()
+                q.put_nowait({"kind": "*", "op": "resync", "seq": evt["seq"]})
+
+
+feed = ChangeFeed()
+
+
+def record_change(
+    session: Any,
+    kind: str,
+    op: str,
+    key: Any,
+    data: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Queue a change on ``session``; it is published after a successful commit."""
+    if not feed.subscribers:
+        return
+    pending: List[Dict[str, Any]] = session.info.setdefault(_PENDING_KEY, [])
+    pending.append(
+        {
+            "kind": kind,
+            "op": op,
+            "key": key,
+            "data": data,
+            "at": datetime.now(timezone.utc).isoformat(),
+        }
+    )
+
+
+@event.listens_for(Session, "after_commit")
+def _publish_pending(session: Session) -> None:
+    pending = session.info.pop(_PENDING_KEY, None)
+    if pending:
+        for evt in pending:
+            feed.publish(evt)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_pending(session: Session, previous_transaction: Any) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -0,0 +1,91 @@
+from __future__ import annotations
+
+import json
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import Field, select
+
+from .base_models import BaseIDModel, with_session
+
+
+class ConsoleJob(BaseIDModel, table=True):
+    """Background job started from the web console.
+
+    ``params_json`` holds the original request, ``state_json`` the handler's
+    resume cursor. All datetime fields are stored as ISO strings in UTC.
+    """
+
+    __tablename__ = "console_jobs"
+
+    job_id: str = Field(index=True, unique=True, nullable=False, title="job_id")
+    kind: str = Field(nullable=False, title="kind")
+    status: str = Field(default="pending", index=True, nullable=False, title="status")
+    params_json: str = Field(default="{}", nullable=False, title="params_json")
+    state_json: str = Field(default="{}", nullable=False, title="state_json")
+    total: int = Field(default=0, nullable=False, title="total")
+    done: int = Field(default=0, nullable=False, title="done")
+    failed: int = Field(default=0, nullable=False, title="failed")
+    message: Optional[str] = Field(default=None, nullable=True, title="message")
+    result_json: Optional[str] = Field(default=None, nullable=True, title="result_json")
+    created_at: str = Field(nullable=False, title="created_at")
+    updated_at: str = Field(nullable=False, title="updated_at")
+
+    @classmethod
+    @with_session
+    async def get_by_job_id(cls, session: AsyncSession, job_id: str) -> Optional["ConsoleJob"]:
+        stmt = select(cls).where(cls.job_id == job_id)
+        result = await session.execute(stmt)
+        return result.scalars().first()
+
+    @classmethod
+    @with_session
+    async def create(cls, session: AsyncSession, data: Dict[str, Any]) -> "ConsoleJob":
+        row = cls(**data)
+        session.add(row)
+        await session.flush()
+        return row
+
+    @classmethod
+    @with_session
+    async def update_fields(cls, session: AsyncSession, job_id: str, **fields: Any) -> None:
+        stmt = select(cls).where(cls.job_id == job_id)
+        row = (await session.execute(stmt)).scalars().first()
+        if row is None:
+            return
+        for k, v in fields.items():
+            if hasattr(row, k):
+                setattr(row, k, v)
+        session.add(row)
+
+    @classmethod
+    @with_session
+    async def recent(cls, session: AsyncSession, limit: int = 20) -> List["ConsoleJob"]:
+        stmt = select(cls).order_by(cls.id.desc()).limit(max(1, int(limit)))  # type: ignore[attr-defined]
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    @classmethod
+    @with_session
+    async def list_by_status(cls, session: AsyncSession, statuses: List[str]) -> List["ConsoleJob"]:
+        stmt = select(cls).where(cls.status.in_(statuses))  # type: ignore[attr-defined]
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+    def to_dict(self) -> Dict[str, Any]:
+        try:
+            result = json.loads(self.result_json) if self.result_json else None
+        except Exception:
+            result = None
+        return {
+            "job_id": self.job_id,
+            "kind": self.kind,
+            "status": self.status,
+            "total": self.total,
+            "done": self.done,
+            "failed": self.failed,
+            "message": self.message,
+            "result": result,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
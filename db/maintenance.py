@@ -0,0 +1,279 @@
+"""SQLite maintenance: WAL checkpoints, incremental vacuum, ANALYZE and size history.
+
+Maintenance statements run on a short-lived stdlib ``sqlite3`` connection in a
+worker thread, so PRAGMAs that must be stepped to completion (such as
+``incremental_vacuum``) behave as documented and the event loop stays free.
+Size samples are persisted in ``db_size_history`` for the web console.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import os
+import sqlite3
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from nonebot.log import logger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlmodel import Field, delete, select
+
+from .base_models import DB_PATH, BaseIDModel, with_session
+
+
+class DbSizeSample(BaseIDModel, table=True):
+    """Point-in-time size sample of the database and its WAL file."""
+
+    __tablename__ = "db_size_history"
+
+    sampled_at: str = Field(index=True, nullable=False, title="sampled_at")
+    action: str = Field(default="sample", nullable=False, title="action")
+    db_bytes: int = Field(default=0, nullable=False, title="db_bytes")
+    wal_bytes: int = Field(default=0, nullable=False, title="wal_bytes")
+    page_size: int = Field(default=0, nullable=False, title="page_size")
+    page_count: int = Field(default=0, nullable=False, title="page_count")
+    freelist_count: int = Field(default=0, nullable=False, title="freelist_count")
+    duration_ms: float = Field(default=0.0, nullable=False, title="duration_ms")
+
+    @classmethod
+    @with_session
+    async def add_sample(
+        cls,
+        session: AsyncSession,
+        data: Dict[str, Any],
+        keep: int = 500,
+    ) -> None:
+        """Insert one sample and drop the oldest rows beyond ``keep``."""
+        session.add(cls(**data))
+        await session.flush()
+        if keep > 0:
+            sub = select(cls.id).order_by(cls.id.desc()).offset(keep).limit(1)  # type: ignore[attr-defined]
+            edge = (await session.execute(sub)).scalar_one_or_none()
+            if edge is not None:
+                await session.execute(delete(cls).where(cls.id <= edge))  # type: ignore[operator]
+
+    @classmethod
+    @with_session
+    async def recent(cls, session: AsyncSession, limit: int = 100) -> List["DbSizeSample"]:
+        """Return the newest samples first."""
+        stmt = select(cls).order_by(cls.id.desc()).limit(max(1, int(limit)))  # type: ignore[attr-defined]
+        result = await session.execute(stmt)
+        return result.scalars().all()
+
+
+# Serialize maintenance runs (interval checkpoint vs. nightly job vs. console)
+_maintenance_lock = asyncio.Lock()
+
+
+def _wal_path() -> str:
+    return f"{DB_PATH}-wal"
+
+
+def _file_size(path: str) -> int:
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return 0
+
+
+def _connect() -> sqlite3.Connection:
+    # Autocommit connection; checkpoints and vacuum must not run inside a transaction
+    conn = sqlite3.connect(str(DB_PATH), timeout=5.0, isolation_level=None)
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def _pragma_int(conn: sqlite3.Connection, name: str) -> int:
+    try:
+        row = conn.execute(f"PRAGMA {name}").fetchone()
+        return int(row[0]) if row else 0
+    except Exception:
+        return 0
+
+
+def _size_info(conn: sqlite3.Connection) -> Dict[str, Any]:
+    return {
+        "db_bytes": _file_size(str(DB_PATH)),
+        "wal_bytes": _file_size(_wal_path()),
+        "page_size": _pragma_int(conn, "page_size"),
+        "page_count": _pragma_int(conn, "page_count"),
+        "freelist_count": _pragma_int(conn, "freelist_count"),
+    }
+
+
+def _run_sync(full: bool, vacuum_pages: int) -> Dict[str, Any]:
+    """Blocking maintenance body; executed via ``asyncio.to_thread``."""
+    started = time.perf_counter()
+    report: Dict[str, Any] = {"action": "full" if full else "checkpoint"}
+    conn = _connect()
+    try:
+        report["before"] = _size_info(conn)
+        if full:
+            mode = _pragma_int(conn, "auto_vacuum")
+            report["auto_vacuum"] = {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode))
+            if mode == 2:
+                n = max(0, int(vacuum_pages or 0))
+                stmt = f"PRAGMA incremental_vacuum({n})" if n > 0 else "PRAGMA incremental_vacuum"
+                # Each step frees pages; fetchall() drives the statement to completion
+                conn.execute(stmt).fetchall()
+            conn.execute("ANALYZE")
+            conn.execute("PRAGMA optimize")
+        # Checkpoint last so pages touched by vacuum/analyze are folded back too
+        row = conn.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+        if row:
+            report["checkpoint"] = {"busy": int(row[0]), "log": int(row[1]), "checkpointed": int(row[2])}
+        report["after"] = _size_info(conn)
+    finally:
+        conn.close()
+    report["duration_ms"] = round((time.perf_counter() - started) * 1000.0, 2)
+    return report
+
+
+def _sample_from_report(report: Dict[str, Any]) -> Dict[str, Any]:
+    after = dict(report.get("after") or {})
+    return {
+        "sampled_at": datetime.now(timezone.utc).isoformat(),
+        "action": str(report.get("action") or "sample"),
+        "db_bytes": int(after.get("db_bytes") or 0),
+        "wal_bytes": int(after.get("wal_bytes") or 0),
+        "page_size": int(after.get("page_size") or 0),
+        "page_count": int(after.get("page_count") or 0),
+        "freelist_count": int(after.get("freelist_count") or 0),
+        "duration_ms": float(report.get("duration_ms") or 0.0),
+    }
+
+
+def _cfg() -> Dict[str, Any]:
+    from ..core.system_config import load_cfg
+
+    return load_cfg()
+
+
+async def run_maintenance(full: bool = True) -> Dict[str, Any]:
+    """Run a checkpoint (``full=False``) or the full nightly pass and record a sample."""
+    cfg = _cfg()
+    vacuum_pages = int(cfg.get("db_incremental_vacuum_pages", 0) or 0)
+    keep = int(cfg.get("db_size_history_keep", 500) or 500)
+    async with _maintenance_lock:
+        report = await asyncio.to_thread(_run_sync, full, vacuum_pages)
+    try:
+        await DbSizeSample.add_sample(_sample_from_report(report), keep=keep)
+    except Exception as e:
+        logger.debug(f"[DB] 记录数据库大小失败: {e}")
+    return report
+
+
+async def current_status() -> Dict[str, Any]:
+    """Current file sizes and page stats, without modifying the database."""
+
+    def _read() -> Dict[str, Any]:
+        conn = _connect()
+        try:
+            info = _size_info(conn)
+            mode = _pragma_int(conn, "auto_vacuum")
+            info["auto_vacuum"] = {0: "none", 1: "full", 2: "incremental"}.get(mode, str(mode))
+            info["journal_mode"] = str((conn.execute("PRAGMA journal_mode").fetchone() or [""])[0])
+            return info
+        finally:
+            conn.close()
+
+    return await asyncio.to_thread(_read)
+
+
+async def size_history(limit: int = 100) -> List[Dict[str, Any]]:
+    rows = await DbSizeSample.recent(limit=limit)
+    return [
+        {
+            "sampled_at": r.sampled_at,
+            "action": r.action,
+            "db_bytes": r.db_bytes,
+            "wal_bytes": r.wal_bytes,
+            "page_size": r.page_size,
+            "page_count": r.page_count,
+            "freelist_count": r.freelist_count,
+            "duration_ms": r.duration_ms,
+        }
+        for r in rows
+    ]
+
+
+# ---- Scheduling (nonebot_plugin_apscheduler, optional) ----
+
+
+async def _checkpoint_job() -> None:
+    try:
+        rep = await run_maintenance(full=False)
+        logger.debug(f"[DB] WAL checkpoint 完成: {rep.get('checkpoint')} 用时 {rep.get('duration_ms')}ms")
+    except Exception as e:
+        logger.warning(f"[DB] WAL checkpoint 失败: {e}")
+
+
+async def _maintenance_job() -> None:
+    try:
+        rep = await run_maintenance(full=True)
+        before = rep.get("before") or {}
+        after = rep.get("after") or {}
+        logger.info(
+            f"[DB] 夜间维护完成：db {before.get('db_bytes')}→{after.get('db_bytes')} 字节，"
+            f"空闲页 {before.get('freelist_count')}→{after.get('freelist_count')}，用时 {rep.get('duration_ms')}ms"
+        )
+    except Exception as e:
+        logger.warning(f"[DB] 夜间维护失败: {e}")
+    # 维护后顺带做一次在线备份（可选）
+    if bool(_cfg().get("db_backup_auto_enable", False)):
+        try:
+            from .backup import run_backup
+
+            await run_backup()
+        except Exception as e:
+            logger.warning(f"[DB] 自动备份失败: {e}")
+
+
+def schedule_db_maintenance() -> None:
+    """Register (or refresh) the checkpoint and nightly maintenance jobs."""
+    try:
+        from nonebot_plugin_apscheduler import scheduler  # type: ignore
+    except Exception:
+        logger.debug("[DB] 未安装 nonebot_plugin_apscheduler，跳过数据库维护任务")
+        return
+
+    cfg = _cfg()
+    if not bool(cfg.get("db_maintenance_enable", True)):
+        for job_id in ("db_checkpoint", "db_maintenance"):
+            try:
+                scheduler.remove_job(job_id)  # type: ignore
+            except Exception:
+                pass
+        return
+
+    interval = max(1, int(cfg.get("db_checkpoint_interval_minutes", 30) or 30))
+    hour = int(cfg.get("db_maintenance_hour", 4) or 0)
+    minute = int(cfg.get("db_maintenance_minute", 30) or 0)
+    try:
+        scheduler.add_job(  # type: ignore
+            _checkpoint_job,
+            trigger="interval",
+            minutes=interval,
+            id="db_checkpoint",
+            replace_existing=True,
+        )
+        scheduler.add_job(  # type: ignore
+            _maintenance_job,
+            trigger="cron",
+            hour=hour,
+            minute=minute,
+            id="db_maintenance",
+            replace_existing=True,
+        )
+        logger.debug(f"[DB] 维护任务已调度：每 {interval} 分钟 checkpoint，每日 {hour:02d}:{minute:02d} 整理")
+    except Exception as e:
+        logger.debug(f"[DB] 调度数据库维护任务失败: {e}")
+
+
+try:
+    from ..core.framework.config import register_reload_callback
+
+    register_reload_callback("system", schedule_db_maintenance)
+except Exception:
+    pass
@@ -1,14 +1,42 @@
 from __future__ import annotations
 
-from typing import Any, Dict, List, Optional
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple
 
+from sqlalchemy import func, or_
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlmodel import Field, SQLModel, delete
+from sqlmodel import Field, SQLModel, and_, delete, select
 
-from .base_models import BaseIDModel, with_session
+from .base_models import BaseIDModel, decode_cursor, encode_cursor, with_session
+from .change_feed import record_change
 from nonebot.log import logger
 
 
+def utc_iso(value: Any) -> Optional[str]:
+    """Normalize an ISO datetime string to UTC so that text order equals time order.
+
+    Naive values are taken as UTC; unparsable values are returned unchanged.
+    """
+    if value is None:
+        return None
+    s = str(value)
+    try:
+        dt = datetime.fromisoformat(s)
+    except Exception:
+        return s
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.astimezone(timezone.utc).isoformat()
+
+
+# Rows written before expiry normalization are fixed once per process
+_expiry_normalized = False
+# Rows per multi-row INSERT (7 columns each, well under SQLite's variable limit)
+_BULK_BATCH = 100
+# Above this many new codes a single resync event replaces per-code events
+_EVENT_LIMIT = 100
+
+
 class Membership(BaseIDModel, table=True):
     """Group membership record.
 
@@ -17,7 +45,7 @@ class Membership(BaseIDModel, table=True):
     """
 
     group_id: str = Field(index=True, unique=True, nullable=False, title="group_id")
-    expiry: Optional[str] = Field(default=None, nullable=True, title="expiry")
+    expiry: Optional[str] = Field(default=None, index=True, nullable=True, title="expiry")
     last_renewed_by: Optional[str] = Field(default=None, nullable=True, title="last_renewed_by")
     renewal_code_used: Optional[str] = Field(default=None, nullable=True, title="renewal_code_used")
     managed_by_bot: Optional[str] = Field(default=None, nullable=True, title="managed_by_bot")
@@ -34,18 +62,252 @@ class Membership(BaseIDModel, table=True):
 
     @classmethod
     @with_session
-    async def replace_all(
+    async def get_by_group_id(cls, session: AsyncSession, group_id: str) -> Optional["Membership"]:
+        """Fetch a single membership row by group id."""
+        stmt = select(cls).where(cls.group_id == str(group_id))
+        result = await session.execute(stmt)
+        return result.scalars().first()
+
+    @classmethod
+    @with_session
+    async def update_by_group_id(cls, session: AsyncSession, group_id: str, **fields: Any) -> bool:
+        """Update selected columns of one row; returns False if the row is gone."""
+        stmt = select(cls).where(cls.group_id == str(group_id))
+        row = (await session.execute(stmt)).scalars().first()
+        if row is None:
+            return False
+        if "expiry" in fields:
+            fields["expiry"] = utc_iso(fields["expiry"])
+        for k, v in fields.items():
+            if hasattr(row, k):
+                setattr(row, k, v)
+        session.add(row)
+        record_change(session, "membership", "upsert", row.group_id, row.to_record())
+        return True
+
+    @classmethod
+    @with_session
+    async def rename_group(
+        cls, session: AsyncSession, old_group_id: str, new_group_id: str, **fields: Any
+    ) -> Optional[Dict[str, Any]]:
+        """Move one row to another group id (keeping its id) and update ``fields``.
+
+        Returns the stored record, or None if the row is gone.
+        """
+        row = (await session.execute(select(cls).where(cls.group_id == str(old_group_id)))).scalars().first()
+        if row is None:
+            return None
+        if "expiry" in fields:
+            fields["expiry"] = utc_iso(fields["expiry"])
+        for k, v in fields.items():
+            if hasattr(row, k) and k not in ("id", "group_id"):
+                setattr(row, k, v)
+        row.group_id = str(new_group_id)
+        session.add(row)
+        await session.flush()
+        rec = row.to_record()
+        record_change(session, "membership", "delete", str(old_group_id))
+        record_change(session, "membership", "upsert", row.group_id, rec)
+        return rec
+
+    @classmethod
+    @with_session
+    async def upsert_by_group_id(cls, session: AsyncSession, group_id: str, **fields: Any) -> Dict[str, Any]:
+        """Insert or update the row of one group; returns the stored record."""
+        gid = str(group_id)
+        row = (await session.execute(select(cls).where(cls.group_id == gid))).scalars().first()
+        if row is None:
+            row = cls(group_id=gid)
+        if "expiry" in fields:
+            fields["expiry"] = utc_iso(fields["expiry"])
+        for k, v in fields.items():
+            if hasattr(row, k) and k not in ("id", "group_id"):
+                setattr(row, k, v)
+        session.add(row)
+        await session.flush()
+        rec = row.to_record()
+        record_change(session, "membership", "upsert", gid, rec)
+        return rec
+
+    @classmethod
+    @with_session
+    async def redeem(
         cls,
         session: AsyncSession,
-        rows: List[Dict[str, Any]],
-    ) -> None:
-        """Replace all membership rows with provided dictionaries.
+        group_id: str,
+        code: str,
+        length: int,
+        unit: str,
+        renew: Callable[[Optional[Dict[str, Any]]], Dict[str, Any]],
+    ) -> Optional[Dict[str, Any]]:
+        """Consume a renewal code and apply it to one group in a single transaction.
 
-        Each dict should contain fields matching the Membership model.
+        ``renew`` receives the current record (None for a new group) and returns
+        the columns to write. Returns the stored record, or None when the code
+        was already used or does not match ``length``/``unit``.
         """
-        await session.execute(delete(cls))
-        for r in rows:
-            session.add(cls(**r))
+        if not await GeneratedCode.consume(code, length, unit, session=session):
+            return None
+        row = (await session.execute(select(cls).where(cls.group_id == str(group_id)))).scalars().first()
+        fields = renew(row.to_record() if row is not None else None)
+        return await cls.upsert_by_group_id(group_id, session=session, **fields)
+
+    @classmethod
+    @with_session
+    async def delete_by_group_id(cls, session: AsyncSession, group_id: str) -> None:
+        """Delete the membership row of one group."""
+        await session.execute(delete(cls).where(cls.group_id == str(group_id)))
+        record_change(session, "membership", "delete", str(group_id))
+
+    # ---- Console listing (keyset pagination) ----
+    @classmethod
+    def _list_filters(
+        cls,
+        expiry_from: Optional[str],
+        expiry_before: Optional[str],
+        include_no_expiry: bool,
+        keyword: Optional[str],
+    ) -> List[Any]:
+        conds: List[Any] = []
+        rng: List[Any] = []
+        if expiry_from:
+            rng.append(cls.expiry >= expiry_from)  # type: ignore[operator]
+        if expiry_before:
+            rng.append(cls.expiry < expiry_before)  # type: ignore[operator]
+        if rng:
+            cond = and_(*rng)
+            conds.append(or_(cond, cls.expiry.is_(None)) if include_no_expiry else cond)  # type: ignore[union-attr]
+        kw = (keyword or "").strip()
+        if kw:
+            conds.append(cls.group_id.like(f"%{kw}%"))  # type: ignore[attr-defined]
+        return conds
+
+    @classmethod
+    @with_session
+    async def _normalize_expiry(cls, session: AsyncSession) -> int:
+        rows = (await session.execute(select(cls).where(cls.expiry.isnot(None)))).scalars().all()  # type: ignore[union-attr]
+        changed = 0
+        for row in rows:
+            norm = utc_iso(row.expiry)
+            if norm != row.expiry:
+                row.expiry = norm
+                session.add(row)
+                changed += 1
+        return changed
+
+    @classmethod
+    async def ensure_expiry_normalized(cls) -> None:
+        """Rewrite legacy non-UTC expiry values once so range filters are exact."""
+        global _expiry_normalized
+        if _expiry_normalized:
+            return
+        changed = await cls._normalize_expiry()
+        _expiry_normalized = True
+        if changed:
+            logger.info(f"[membership] normalized {changed} expiry values to UTC")
+
+    @classmethod
+    @with_session
+    async def page(
+        cls,
+        session: AsyncSession,
+        *,
+        expiry_from: Optional[str] = None,
+        expiry_before: Optional[str] = None,
+        include_no_expiry: bool = False,
+        keyword: Optional[str] = None,
+        sort: str = "expiry",
+        order: str = "asc",
+        limit: int = 20,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List["Membership"], Optional[str], int]:
+        """One page of memberships ordered by (expiry | group_id, id).
+
+        ``expiry_from``/``expiry_before`` bound the UTC expiry as a half-open
+        range served by the expiry index; rows without an expiry are only kept
+        when ``include_no_expiry``. Returns (rows, next_cursor, total).
+        """
+        conds = cls._list_filters(expiry_from, expiry_before, include_no_expiry, keyword)
+        total_stmt = select(func.count()).select_from(cls)
+        if conds:
+            total_stmt = total_stmt.where(*conds)
+        total = int((await session.execute(total_stmt)).scalar() or 0)
+
+        col = cls.group_id if sort == "group" else cls.expiry
+        desc = str(order).lower() == "desc"
+        stmt = select(cls)
+        if conds:
+            stmt = stmt.where(*conds)
+        key = decode_cursor(cursor)
+        if key and len(key) == 2:
+            kval, kid = key[0], int(key[1])
+            # SQLite sorts NULL first ascending and last descending
+            if desc:
+                if kval is None:
+                    after = and_(col.is_(None), cls.id < kid)  # type: ignore[union-attr,operator]
+                else:
+                    after = or_(col < kval, and_(col == kval, cls.id < kid), col.is_(None))  # type: ignore[union-attr,operator]
+            else:
+                if kval is None:
+                    after = or_(and_(col.is_(None), cls.id > kid), col.isnot(None))  # type: ignore[union-attr,operator]
+                else:
+                    after = or_(col > kval, and_(col == kval, cls.id > kid))  # type: ignore[operator]
+            stmt = stmt.where(after)
+        if desc:
+            stmt = stmt.order_by(col.desc(), cls.id.desc())  # type: ignore[union-attr,attr-defined]
+        else:
+            stmt = stmt.order_by(col.asc(), cls.id.asc())  # type: ignore[union-attr,attr-defined]
+        size = max(1, min(int(limit), 500))
+        rows = (await session.execute(stmt.limit(size + 1))).scalars().all()
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            next_cursor = encode_cursor([last.group_id if sort == "group" else last.expiry, last.id])
+        return list(rows), next_cursor, total
+
+    @classmethod
+    @with_session
+    async def list_group_ids(
+        cls,
+        session: AsyncSession,
+        *,
+        expiry_from: Optional[str] = None,
+        expiry_before: Optional[str] = None,
+        include_no_expiry: bool = False,
+        keyword: Optional[str] = None,
+    ) -> List[str]:
+        """All group ids matching the same filters as page() (for select-all)."""
+        conds = cls._list_filters(expiry_from, expiry_before, include_no_expiry, keyword)
+        stmt = select(cls.group_id)
+        if conds:
+            stmt = stmt.where(*conds)
+        result = await session.execute(stmt)
+        return [str(x) for x in result.scalars().all()]
+
+    @classmethod
+    @with_session
+    async def upsert_rows(cls, session: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Insert or update memberships by ``group_id`` (used by streaming import)."""
+        if not rows:
+            return
+        keys = [k for k in rows[0].keys() if k != "group_id"]
+        await cls._batch_insert_or_update(rows, keys, ["group_id"], session=session)
+        record_change(session, "*", "resync", None)
+
+    def to_record(self) -> Dict[str, Any]:
+        """Same dict shape as the entries produced by read_snapshot()."""
+        return {
+            "id": self.id,
+            "group_id": self.group_id,
+            "expiry": self.expiry,
+            "last_renewed_by": self.last_renewed_by,
+            "renewal_code_used": self.renewal_code_used,
+            "managed_by_bot": self.managed_by_bot,
+            "status": self.status,
+            "last_reminder_on": self.last_reminder_on,
+            "expired_at": self.expired_at,
+        }
 
 
 class GeneratedCode(BaseIDModel, table=True):
@@ -70,15 +332,97 @@ class GeneratedCode(BaseIDModel, table=True):
 
     @classmethod
     @with_session
-    async def replace_all(
+    async def get_by_code(cls, session: AsyncSession, code: str) -> Optional["GeneratedCode"]:
+        """Fetch a single code."""
+        result = await session.execute(select(cls).where(cls.code == str(code)))
+        return result.scalars().first()
+
+    @classmethod
+    @with_session
+    async def consume(cls, session: AsyncSession, code: str, length: int, unit: str) -> bool:
+        """Delete a code if it still exists with the given length/unit.
+
+        A single conditional DELETE, so two concurrent redeems cannot both
+        succeed; returns False when nothing was deleted.
+        """
+        stmt = delete(cls).where(cls.code == str(code), cls.length == int(length), cls.unit == str(unit))
+        result = await session.execute(stmt)
+        if not result.rowcount:
+            return False
+        record_change(session, "code", "delete", str(code))
+        return True
+
+    @classmethod
+    @with_session
+    async def bulk_create(
         cls,
         session: AsyncSession,
-        rows: List[Dict[str, Any]],
-    ) -> None:
-        """Replace all codes with provided dictionaries."""
-        await session.execute(delete(cls))
-        for r in rows:
-            session.add(cls(**r))
+        make_code: Callable[[], str],
+        count: int,
+        fields: Dict[str, Any],
+    ) -> List[str]:
+        """Insert ``count`` new codes sharing ``fields`` in one transaction.
+
+        Candidates come from ``make_code``. Uniqueness is enforced by the
+        unique index on ``code``: colliding candidates are ignored by the
+        insert and replaced by fresh ones in the next round.
+        """
+        from sqlalchemy.dialects.sqlite import insert
+
+        stamp = fields["generated_time"]
+        created: List[str] = []
+        taken: Set[str] = set()
+        while len(created) < count:
+            need = min(count - len(created), _BULK_BATCH)
+            cands: Set[str] = set()
+            for _ in range(need * 4):
+                c = make_code()
+                if c not in taken:
+                    cands.add(c)
+                    if len(cands) >= need:
+                        break
+            if not cands:
+                raise RuntimeError("续费码随机空间不足，请增大随机码长度")
+            stmt = insert(cls).values([dict(fields, code=c) for c in cands])
+            await session.execute(stmt.on_conflict_do_nothing(index_elements=["code"]))
+            # Rows that already existed keep their own generated_time
+            got = (
+                await session.execute(
+                    select(cls.code).where(cls.code.in_(cands), cls.generated_time == stamp)  # type: ignore[attr-defined]
+                )
+            ).scalars().all()
+            if not got:
+                raise RuntimeError("续费码随机空间不足，请增大随机码长度")
+            taken.update(cands)
+            created.extend(got)
+        if len(created) <= _EVENT_LIMIT:
+            rec = {k: fields.get(k) for k in ("length", "unit", "generated_time", "max_use", "used_count", "expire_at")}
+            for c in created:
+                record_change(session, "code", "upsert", c, rec)
+        else:
+            record_change(session, "*", "resync", None)
+        return created
+
+    @classmethod
+    @with_session
+    async def upsert_rows(cls, session: AsyncSession, rows: List[Dict[str, Any]]) -> None:
+        """Insert or update codes by ``code`` (used by streaming import)."""
+        if not rows:
+            return
+        keys = [k for k in rows[0].keys() if k != "code"]
+        await cls._batch_insert_or_update(rows, keys, ["code"], session=session)
+        record_change(session, "*", "resync", None)
+
+    def to_record(self) -> Dict[str, Any]:
+        """Same dict shape as the ``generatedCodes`` entries of read_snapshot()."""
+        return {
+            "length": self.length,
+            "unit": self.unit,
+            "generated_time": self.generated_time,
+            "max_use": self.max_use,
+            "used_count": self.used_count,
+            "expire_at": self.expire_at,
+        }
 
 
 # ---- Snapshot helpers combining both models ----
@@ -96,99 +440,68 @@ async def read_snapshot() -> Dict[str, Any]:
 
     mem_rows = await Membership.all()
     for m in mem_rows:
-        data[m.group_id] = {
-            "id": m.id,
-            "group_id": m.group_id,
-            "expiry": m.expiry,
-            "last_renewed_by": m.last_renewed_by,
-            "renewal_code_used": m.renewal_code_used,
-            "managed_by_bot": m.managed_by_bot,
-            "status": m.status,
-            "last_reminder_on": m.last_reminder_on,
-            "expired_at": m.expired_at,
-        }
+        data[m.group_id] = m.to_record()
 
     codes = await GeneratedCode.all()
     gen_map: Dict[str, Any] = {}
     for c in codes:
-        gen_map[c.code] = {
-            "length": c.length,
-            "unit": c.unit,
-            "generated_time": c.generated_time,
-            "max_use": c.max_use,
-            "used_count": c.used_count,
-            "expire_at": c.expire_at,
-        }
+        gen_map[c.code] = c.to_record()
     data["generatedCodes"] = gen_map
 
     return data
 
 
-async def write_snapshot(obj: Dict[str, Any]) -> None:
-    """Persist the given data snapshot into database by replacing rows."""
-    # Build membership rows
-    mem_rows: List[Dict[str, Any]] = []
-    for k, v in obj.items():
-        if k == "generatedCodes" or not isinstance(v, dict):
-            continue
-        # Normalize types to match model schema (strings in DB for these fields)
-        def _s(val: Any) -> Optional[str]:
-            if val is None:
-                return None
-            try:
-                return str(val)
-            except Exception:
-                return None
-
-        mem_rows.append(
-            {
-                "group_id": str(v.get("group_id") or k),
-                "expiry": _s(v.get("expiry")),
-                "last_renewed_by": _s(v.get("last_renewed_by")),
-                "renewal_code_used": _s(v.get("renewal_code_used")),
-                "managed_by_bot": _s(v.get("managed_by_bot")),
-                "status": str(v.get("status") or "active"),
-                "last_reminder_on": _s(v.get("last_reminder_on")),
-                "expired_at": _s(v.get("expired_at")),
-            }
-        )
+def _s(val: Any) -> Optional[str]:
+    if val is None:
+        return None
+    try:
+        return str(val)
+    except Exception:
+        return None
 
-    # Build code rows
-    code_rows: List[Dict[str, Any]] = []
-    gen_map = obj.get("generatedCodes") or {}
-    if isinstance(gen_map, dict):
-        for code, rec in gen_map.items():
-            try:
-                # Convert and validate integers to fit SQLite 64-bit range
-                SQLITE_INT64_MIN = -9223372036854775808
-                SQLITE_INT64_MAX = 9223372036854775807
-
-                length_val = int(rec.get("length"))
-                max_use_val = int(rec.get("max_use", 1) or 1)
-                used_count_val = int(rec.get("used_count", 0) or 0)
-
-                def _in_sqlite_range(v: int) -> bool:
-                    return SQLITE_INT64_MIN <= v <= SQLITE_INT64_MAX
-
-                if not (_in_sqlite_range(length_val) and _in_sqlite_range(max_use_val) and _in_sqlite_range(used_count_val)):
-                    logger.warning(
-                        f"[membership] 跳过无效兑换码记录（整数超出SQLite范围）: code={code}, length={length_val}, max_use={max_use_val}, used_count={used_count_val}"
-                    )
-                    continue
-
-                code_rows.append(
-                    {
-                        "code": str(code),
-                        "length": length_val,
-                        "unit": str(rec.get("unit")),
-                        "generated_time": str(rec.get("generated_time")),
-                        "max_use": max_use_val,
-                        "used_count": used_count_val,
-                        "expire_at": str(rec.get("expire_at")) if rec.get("expire_at") else None,
-                    }
-                )
-            except Exception:
-                continue
 
-    await Membership.replace_all(mem_rows)
-    await GeneratedCode.replace_all(code_rows)
+# Integers must fit SQLite's 64-bit range
+SQLITE_INT64_MIN = -9223372036854775808
+SQLITE_INT64_MAX = 9223372036854775807
+
+
+def membership_row(key: Any, v: Dict[str, Any]) -> Dict[str, Any]:
+    """Normalize one membership record (snapshot entry or import row) to model columns."""
+    return {
+        "group_id": str(v.get("group_id") or key),
+        "expiry": utc_iso(v.get("expiry")),
+        "last_renewed_by": _s(v.get("last_renewed_by")),
+        "renewal_code_used": _s(v.get("renewal_code_used")),
+        "managed_by_bot": _s(v.get("managed_by_bot")),
+        "status": str(v.get("status") or "active"),
+        "last_reminder_on": _s(v.get("last_reminder_on")),
+        "expired_at": _s(v.get("expired_at")),
+    }
+
+
+def code_row(code: Any, rec: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Normalize one code record to model columns; None when it cannot be stored."""
+    try:
+        length_val = int(rec.get("length"))
+        max_use_val = int(rec.get("max_use", 1) or 1)
+        used_count_val = int(rec.get("used_count", 0) or 0)
+    except Exception:
+        return None
+
+    def _in_sqlite_range(v: int) -> bool:
+        return SQLITE_INT64_MIN <= v <= SQLITE_INT64_MAX
+
+    if not (_in_sqlite_range(length_val) and _in_sqlite_range(max_use_val) and _in_sqlite_range(used_count_val)):
+        logger.warning(
+            f"[membership] 跳过无效兑换码记录（整数超出SQLite范围）: code={code}, length={length_val}, max_use={max_use_val}, used_count={used_count_val}"
+        )
+        return None
+    return {
+        "code": str(code),
+        "length": length_val,
+        "unit": str(rec.get("unit")),
+        "generated_time": str(rec.get("generated_time")),
+        "max_use": max_use_val,
+        "used_count": used_count_val,
+        "expire_at": str(rec.get("expire_at")) if rec.get("expire_at") else None,
+    }
@@ -0,0 +1,195 @@
+"""SQL statement timing for the shared engine.
+
+``install_query_listeners`` hooks ``before_cursor_execute`` /
+``after_cursor_execute`` on the engine built in ``init_database``. Durations are
+aggregated per statement fingerprint (whitespace collapsed, literals and
+expanded ``IN`` lists folded) with a bounded window of recent samples for
+p50/p95/p99. Statements slower than ``db_slow_query_ms`` are logged together with
+the model method that issued them; the caller is tracked through a context
+variable set by ``with_session``.
+"""
+
+from __future__ import annotations
+
+import re
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional
+
+from nonebot.log import logger
+
+
+# Outermost ``Model.method`` currently running a session (set by with_session)
+current_caller: ContextVar[Optional[str]] = ContextVar("entertain_db_caller", default=None)
+
+_SAMPLE_WINDOW = 512
+_MAX_FINGERPRINTS = 500
+_SLOW_LOG_SIZE = 100
+_MAX_SQL_LEN = 1000
+
+_settings: Dict[str, Any] = {"enable": True, "slow_ms": 200.0}
+_lock = threading.Lock()
+_stats: Dict[str, "_FingerprintStats"] = {}
+_slow_log: Deque[Dict[str, Any]] = deque(maxlen=_SLOW_LOG_SIZE)
+_since = datetime.now().isoformat(timespec="seconds")
+
+_RE_STRING = re.compile(r"'(?:[^']|'')*'")
+_RE_NUMBER = re.compile(r"\b\d+(?:\.\d+)?\b")
+_RE_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_RE_VALUES = re.compile(r"(VALUES\s*\(\?\+?\))(?:\s*,\s*\(\?\+?\))+", re.IGNORECASE)
+_RE_SPACE = re.compile(r"\s+")
+
+
+def fingerprint(statement: str) -> str:
+    """Normalize a SQL statement so executions with different literals group together."""
+    s = _RE_SPACE.sub(" ", str(statement or "")).strip()
+    s = _RE_STRING.sub("?", s)
+    s = _RE_NUMBER.sub("?", s)
+    s = _RE_IN_LIST.sub("(?+)", s)
+    s = _RE_VALUES.sub(r"\1, ...", s)
+    return s[:_MAX_SQL_LEN]
+
+
+def _percentile(sorted_vals: List[float], q: float) -> float:
+    if not sorted_vals:
+        return 0.0
+    idx = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[idx]
+
+
+class _FingerprintStats:
+    __slots__ = ("count", "total_ms", "max_ms", "samples", "callers", "last_at")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.samples: Deque[float] = deque(maxlen=_SAMPLE_WINDOW)
+        self.callers: Dict[str, int] = {}
+        self.last_at = 0.0
+
+    def add(self, ms: float, caller: Optional[str]) -> None:
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+        self.samples.append(ms)
+        self.last_at = time.time()
+        key = caller or "-"
+        self.callers[key] = self.callers.get(key, 0) + 1
+
+    def to_dict(self, sql: str) -> Dict[str, Any]:
+        vals = sorted(self.samples)
+        top_callers = sorted(self.callers.items(), key=lambda kv: kv[1], reverse=True)[:5]
+        return {
+            "sql": sql,
+            "count": self.count,
+            "total_ms": round(self.total_ms, 2),
+            "avg_ms": round(self.total_ms / self.count, 3) if self.count else 0.0,
+            "p50_ms": round(_percentile(vals, 0.50), 3),
+            "p95_ms": round(_percentile(vals, 0.95), 3),
+            "p99_ms": round(_percentile(vals, 0.99), 3),
+            "max_ms": round(self.max_ms, 3),
+            "callers": [{"caller": c, "count": n} for c, n in top_callers],
+            "last_at": datetime.fromtimestamp(self.last_at).isoformat(timespec="seconds") if self.last_at else None,
+        }
+
+
+def _record(statement: str, ms: float) -> None:
+    caller = current_caller.get()
+    fp = fingerprint(statement)
+    with _lock:
+        st = _stats.get(fp)
+        if st is None:
+            if len(_stats) >= _MAX_FINGERPRINTS:
+                fp = "<other>"
+                st = _stats.get(fp)
+            if st is None:
+                st = _stats[fp] = _FingerprintStats()
+        st.add(ms, caller)
+        slow = ms >= float(_settings.get("slow_ms") or 0) > 0
+        if slow:
+            _slow_log.append(
+                {
+                    "at": datetime.now().isoformat(timespec="seconds"),
+                    "ms": round(ms, 2),
+                    "caller": caller,
+                    "sql": fp,
+                }
+            )
+    if slow:
+        logger.warning(f"[DB] 慢查询 {ms:.1f}ms caller={caller or '-'}: {fp[:300]}")
+
+
+def install_query_listeners(sync_engine: Any) -> None:
+    """Attach timing listeners to a (sync) SQLAlchemy engine."""
+    from sqlalchemy import event
+
+    reload_settings()
+
+    # The start time lives on the execution context, so a statement that fails
+    # (no after_cursor_execute) cannot leave a stale entry behind.
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-redef]
+        if context is not None and _settings.get("enable"):
+            context._entertain_start = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):  # type: ignore[no-redef]
+        start = getattr(context, "_entertain_start", None)
+        if start is None:
+            return
+        context._entertain_start = None
+        ms = (time.perf_counter() - start) * 1000.0
+        try:
+            _record(statement, ms)
+        except Exception:
+            pass
+
+
+def reload_settings() -> None:
+    """Re-read the enable flag and slow threshold from the system config."""
+    try:
+        from ..core.system_config import load_cfg
+
+        cfg = load_cfg()
+        _settings["enable"] = bool(cfg.get("db_query_stats_enable", True))
+        _settings["slow_ms"] = float(cfg.get("db_slow_query_ms", 200) or 0)
+    except Exception:
+        pass
+
+
+def snapshot(sort: str = "total_ms", limit: int = 50) -> Dict[str, Any]:
+    """Aggregates for the console, heaviest fingerprints first."""
+    with _lock:
+        rows = [st.to_dict(sql) for sql, st in _stats.items()]
+        slow = list(_slow_log)
+    key = sort if sort in {"total_ms", "count", "avg_ms", "p95_ms", "p99_ms", "max_ms"} else "total_ms"
+    rows.sort(key=lambda r: r.get(key) or 0, reverse=True)
+    return {
+        "since": _since,
+        "enabled": bool(_settings.get("enable")),
+        "slow_ms": _settings.get("slow_ms"),
+        "fingerprints": len(rows),
+        "queries": rows[: max(1, int(limit))],
+        "slow": list(reversed(slow)),
+    }
+
+
+def reset() -> None:
+    global _since
+    with _lock:
+        _stats.clear()
+        _slow_log.clear()
+        _since = datetime.now().isoformat(timespec="seconds")
+
+
+try:
+    from ..core.framework.config import register_reload_callback
+
+    register_reload_callback("system", reload_settings)
+except Exception:
+    pass
@@ -12,10 +12,12 @@ from __future__ import annotations
 
 import re
 import base64
+import random
 import mimetypes
 from typing import List
 
 from nonebot import Bot
+from nonebot.permission import Permission
 from nonebot.adapters.onebot.v11 import (
     GroupMessageEvent,
     PrivateMessageEvent,
@@ -55,35 +57,71 @@ def get_user_name(event: MessageEvent) -> str:
 
 
 def _is_at_bot_robust(bot: Bot, event: MessageEvent) -> bool:
+    """消息是否 @ 了机器人（to_me 或消息中任意位置的 at 段）"""
     if not isinstance(event, GroupMessageEvent):
         return False
+    if getattr(event, "to_me", False):
+        return True
     try:
+        self_id = bot.self_id
         for seg in event.message:
-            if seg.type == "at" and seg.data.get("qq") == bot.self_id:
+            if seg.type == "at" and str(seg.data.get("qq")) == self_id:
                 return True
-        raw = str(event.message)
-        if f"[CQ:at,qq={bot.self_id}]" in raw or f"[at:qq={bot.self_id}]" in raw:
-            return True
+    except Exception:
+        pass
+    return False
+
+
+# 预筛结果
+_TARGET_SKIP = 0
+_TARGET_REPLY = 1
+_TARGET_CAPTURE = 2
 
-        # 主动回复能力（根据配置随机触发）
+
+def _ai_chat_target(bot: Bot, event: MessageEvent) -> int:
+    """对话入口的廉价预筛（只读内存，不拼接消息串、不访问数据库）
+
+    - 私聊：处理；
+    - 群聊：已缓存且关闭 AI 的群跳过；@ 机器人则处理；
+      否则按主动回复概率掷骰（命中时在事件上标记主动回复），未命中时视旁听配置记录或跳过。
+    """
+    if not isinstance(event, GroupMessageEvent):
+        return _TARGET_REPLY
+    entry = chat_manager.cache.peek(f"group_{event.group_id}")
+    if entry is not None and not entry.row.is_active:
+        return _TARGET_SKIP
+    if _is_at_bot_robust(bot, event):
+        return _TARGET_REPLY
+    sess = get_config().session
+    if sess.active_reply_enable and sess.active_reply_probability > 0.0 and random.random() <= sess.active_reply_probability:
         try:
-            cfg = get_config()
-            sess = getattr(cfg, "session", None)
-            if sess and getattr(sess, "active_reply_enable", False):
-                import random as _rnd
-                prob = float(getattr(sess, "active_reply_probability", 0.0) or 0.0)
-                if prob > 0.0 and _rnd.random() <= prob:
-                    try:
-                        setattr(event, "_ai_active_reply", True)
-                        setattr(event, "_ai_active_reply_suffix", getattr(sess, "active_reply_prompt_suffix", None))
-                    except Exception:
-                        pass
-                    return True
+            setattr(event, "_ai_active_reply", True)
+            setattr(event, "_ai_active_reply_suffix", sess.active_reply_prompt_suffix)
         except Exception:
             pass
-    except Exception:
-        pass
-    return False
+        return _TARGET_REPLY
+    return _TARGET_CAPTURE if sess.chatroom_passive_capture else _TARGET_SKIP
+
+
+_at_cmd_perm = P.permission_cmd("ai_chat_at")
+
+
+async def _at_cmd_permission(bot: Bot, event: MessageEvent) -> bool:
+    """对话入口的权限：NoneBot 先检查权限再检查规则，预筛放在命令权限之前，
+    未指向机器人的群消息不进入权限检查与处理流程。"""
+    target = _ai_chat_target(bot, event)
+    if target == _TARGET_SKIP:
+        return False
+    if not await _at_cmd_perm(bot, event):
+        return False
+    if target == _TARGET_CAPTURE:
+        # 旁听：只记录到聊天室上下文，不触发 AI
+        try:
+            chat_manager.capture_passive(get_session_id(event), get_user_name(event), extract_plain_text(event.message))
+        except Exception:
+            pass
+        return False
+    return True
 
 
 def extract_plain_text(message: Message) -> str:
@@ -164,21 +202,17 @@ at_cmd = P.on_regex(
     display_name="@机器人对话",
     priority=100,
     block=False,
+    permission=Permission(_at_cmd_permission),
 )
 
 
 @at_cmd.handle()
 async def handle_chat_auto(bot: Bot, event: MessageEvent):
-    """统一处理消息。
+    """统一处理消息（群聊是否 @ 或命中主动回复已由入口权限预筛）。
     - 群聊：仅在 @ 或命中主动回复时处理
     - 私聊：只要有文本/图片就处理
     """
 
-    if isinstance(event, GroupMessageEvent) and not (
-        _is_at_bot_robust(bot, event) or getattr(event, "to_me", False)
-    ):
-        return
-
     message = extract_plain_text(event.message)
     # 不回复前缀（数组）检查：命中任一前缀则不触发 AI
     try:
@@ -202,6 +236,12 @@ async def handle_chat_auto(bot: Bot, event: MessageEvent):
     user_name = get_user_name(event)
     group_id = str(getattr(event, "group_id", "")) if isinstance(event, GroupMessageEvent) else None
 
+    async def _send_text(text: str) -> None:
+        await at_cmd.send(MessageSegment.text(text))
+
+    async def _send_voice(path: str) -> None:
+        await at_cmd.send(MessageSegment.record(file=path))
+
     try:
         response = await chat_manager.process_message(
             session_id=session_id,
@@ -219,6 +259,9 @@ async def handle_chat_auto(bot: Bot, event: MessageEvent):
                 )
             ),
             images=images or None,
+            # 开启流式输出时按句/段边生成边发送
+            on_text=_send_text,
+            on_voice=_send_voice,
         )
 
         if response:
@@ -402,12 +445,31 @@ async def handle_api_list(event: MessageEvent):
         if name == (active_session if active_session != "(默认)" else active_default):
             marks.append("本会话")
         mark = f"（{'，'.join(marks)}）" if marks else ""
-        lines.append(f"- {name}{mark} | 模型: {model}")
+        stat = chat_manager.providers.health(name).to_dict()
+        health = ""
+        if stat["latency_ms"] is not None:
+            health = f" | 延迟: {stat['latency_ms']:.0f}ms 错误率: {stat['error_rate'] * 100:.0f}%"
+            if stat["cooldown_seconds"]:
+                health += " 冷却中"
+        lines.append(f"- {name}{mark} | 模型: {model}{health}")
+    for gname, members in (getattr(cfg, "provider_groups", {}) or {}).items():
+        marks = []
+        if gname == active_default:
+            marks.append("默认")
+        if gname == (active_session if active_session != "(默认)" else active_default):
+            marks.append("本会话")
+        mark = f"（{'，'.join(marks)}）" if marks else ""
+        lines.append(f"- [组] {gname}{mark} | 成员: {', '.join(members)}")
 
     info_text = "\n".join(["🧰 服务商列表", *lines])
     await api_list_cmd.finish(info_text)
 
 
+def _provider_target_names(cfg) -> list:
+    """可作为会话服务商的名称：服务商与服务商组"""
+    return list((getattr(cfg, "api", {}) or {}).keys()) + list((getattr(cfg, "provider_groups", {}) or {}).keys())
+
+
 # 切换服务商（超管）
 switch_api_cmd = P.on_regex(
     r"^#切换服务商\s*(.+)$",
@@ -428,7 +490,7 @@ async def handle_switch_api(event: MessageEvent):
         return
     target = m.group(1).strip()
     cfg = get_config()
-    names = list((getattr(cfg, "api", {}) or {}).keys())
+    names = _provider_target_names(cfg)
     if target not in names:
         available = ", ".join(names) if names else ""
         await switch_api_cmd.finish(f"服务商不存在\n可用: {available}")
@@ -461,7 +523,7 @@ async def handle_switch_api_global(event: MessageEvent):
         return
     target = m.group(1).strip()
     cfg = get_config()
-    names = list((getattr(cfg, "api", {}) or {}).keys())
+    names = _provider_target_names(cfg)
     if target not in names:
         available = ", ".join(names) if names else ""
         await switch_api_global_cmd.finish(f"服务商不存在\n可用: {available}")
@@ -494,7 +556,7 @@ async def handle_switch_api_group(event: MessageEvent):
     gid = m.group(1)
     target = m.group(2)
     cfg = get_config()
-    names = list((getattr(cfg, "api", {}) or {}).keys())
+    names = _provider_target_names(cfg)
     if target not in names:
         available = ", ".join(names) if names else ""
         await switch_api_group_cmd.finish(f"服务商不存在\n可用: {available}")
@@ -523,7 +585,7 @@ async def handle_switch_api_private(event: MessageEvent):
     uid = m.group(1)
     target = m.group(2)
     cfg = get_config()
-    names = list((getattr(cfg, "api", {}) or {}).keys())
+    names = _provider_target_names(cfg)
     if target not in names:
         available = ", ".join(names) if names else ""
         await switch_api_private_cmd.finish(f"服务商不存在\n可用: {available}")
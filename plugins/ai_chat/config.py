@@ -27,16 +27,32 @@ class APIItem(BaseModel):
     api_key: str = Field(default="", description="API Key")
     model: str = Field(default="gpt-4o-mini", description="默认模型")
     timeout: int = Field(default=60, description="超时（秒）")
+    context_tokens: int = Field(default=0, description="上下文 token 预算（0 表示使用会话默认值）")
+    max_concurrency: int = Field(default=4, description="同时进行的请求数上限（0 表示不限）")
 
 
 class SessionConfig(BaseModel):
     default_provider: str = Field(default="", description="默认服务商（名称）")
     default_temperature: float = Field(default=0.7, description="默认温度")
-    max_rounds: int = Field(default=8, description="最大轮数（user+assistant 计一轮）")
+    max_rounds: int = Field(default=8, description="最多保留的历史轮数（user+assistant 计一轮；实际发送量另受 token 预算限制）")
     chatroom_history_max_lines: int = Field(default=200, description="聊天室历史行数上限（内存）")
+    chatroom_memory_max_bytes: int = Field(default=8 * 1024 * 1024, description="所有群聊天室记录的内存上限（字节，0 表示不限）")
+    chatroom_passive_capture: bool = Field(default=False, description="未 @ 机器人的群消息也写入聊天室记录（不触发 AI）")
     active_reply_enable: bool = Field(default=False, description="是否开启主动回复（群聊）")
     active_reply_probability: float = Field(default=0.1, description="主动回复概率 0~1")
     ignore_prefixes: List[str] = Field(default_factory=list, description="消息以这些前缀之一开头时不触发AI回复（忽略前导空白）")
+    cache_size: int = Field(default=256, description="内存中缓存的热点会话数量（LRU）")
+    flush_interval_seconds: float = Field(default=2.0, description="对话历史延迟写入数据库的间隔（秒）")
+    context_budget_tokens: int = Field(default=6000, description="默认上下文 token 预算（人格/摘要/聊天记录/历史对话合计）")
+    stable_prefix: bool = Field(default=True, description="稳定前缀布局：人格与输出约束在前且不变，摘要/聊天记录放在其后（利于服务商前缀缓存）")
+    queue_max_per_session: int = Field(default=3, description="单个会话排队等待处理的消息数上限（0 表示不限）")
+    queue_max_waiting: int = Field(default=32, description="单个服务商排队等待的请求数上限（0 表示不限）")
+    queue_timeout_seconds: float = Field(default=30.0, description="等待服务商空闲的最长时间（秒，0 表示不限）")
+    queue_private_weight: float = Field(default=1.0, description="私聊在服务商排队中的权重（群聊为 1）")
+    busy_reply: str = Field(default="当前请求较多，请稍后再试~", description="排队已满时的回复（为空则不回复）")
+    coalesce_enable: bool = Field(default=True, description="合并同一会话短时间内的多条消息为一轮回复")
+    coalesce_window_seconds: float = Field(default=1.0, description="会话正在回复时的合并防抖窗口（秒，0 表示只合并等待中的消息）")
+    coalesce_max_messages: int = Field(default=8, description="单轮最多合并的消息数")
     active_reply_prompt_suffix: str = Field(
         default=(
             "请根据以下消息进行自然回复：`{message}`，并保持简洁清晰。\n"
@@ -77,6 +93,10 @@ class OutputConfig(BaseModel):
     tts_http_base64_field: str = Field(default="audio", description="当响应 JSON+base64 时的字段名")
     # 命令行 TTS：在本地执行命令把音频写入指定输出路径；占位符：{text}/{voice}/{format}/{out}
     tts_command: str = Field(default="", description="命令行 TTS 模板（需包含 {out} 输出路径占位符）")
+    # 流式输出：边生成边按句/段发送
+    stream_enable: bool = Field(default=False, description="是否流式输出（边生成边分段发送）")
+    stream_min_chunk_chars: int = Field(default=60, description="流式分段的最少字数（不足时与下一句合并）")
+    stream_tts_first_chunk: bool = Field(default=False, description="流式输出时用第一段文本提前生成 TTS")
 
 
 class InputConfig(BaseModel):
@@ -88,11 +108,17 @@ class MemoryConfig(BaseModel):
     enable_summarize: bool = Field(default=False, description="开启长期记忆摘要")
     summarize_min_rounds: int = Field(default=12, description="达到多少轮后开始摘要")
     summarize_interval_rounds: int = Field(default=8, description="每隔多少轮更新一次摘要")
+    summarize_debounce_seconds: float = Field(default=10.0, description="回复后延迟多久生成摘要（期间有新消息则顺延）")
+    summarize_concurrency: int = Field(default=2, description="同时进行的摘要任务数上限")
+    summarize_provider: str = Field(default="", description="摘要使用的服务商或服务商组（为空则使用会话服务商）")
+    summarize_model: str = Field(default="", description="摘要使用的模型（为空则使用服务商默认模型）")
 
 
 class AIChatConfig(BaseModel):
     # api 使用字典：{ name: { base_url, api_key, model, timeout } }
     api: Dict[str, APIItem] = Field(default_factory=dict)
+    # 服务商组：{ 组名: [服务商名, ...] }；会话可指定组名，按健康度与延迟在组内选路/故障转移
+    provider_groups: Dict[str, List[str]] = Field(default_factory=dict)
     session: SessionConfig = Field(default_factory=SessionConfig)
     tools: ToolsConfig = Field(default_factory=ToolsConfig)
     output: OutputConfig = Field(default_factory=OutputConfig)
@@ -110,11 +136,14 @@ class PersonaConfig(BaseModel):
 
 DEFAULTS: Dict[str, Any] = {
     "api": {},
+    "provider_groups": {},
     "session": {
         "default_provider": "",
         "default_temperature": 0.7,
         "max_rounds": 8,
         "chatroom_history_max_lines": 200,
+        "chatroom_memory_max_bytes": 8 * 1024 * 1024,
+        "chatroom_passive_capture": False,
         "active_reply_enable": False,
         "active_reply_prompt_suffix": (
             "请根据以下消息进行自然回复：`{message}`，并保持简洁清晰。\n"
@@ -122,6 +151,18 @@ DEFAULTS: Dict[str, Any] = {
         ),
         "active_reply_probability": 0.1,
         "ignore_prefixes": [],
+        "cache_size": 256,
+        "flush_interval_seconds": 2.0,
+        "context_budget_tokens": 6000,
+        "stable_prefix": True,
+        "queue_max_per_session": 3,
+        "queue_max_waiting": 32,
+        "queue_timeout_seconds": 30.0,
+        "queue_private_weight": 1.0,
+        "busy_reply": "当前请求较多，请稍后再试~",
+        "coalesce_enable": True,
+        "coalesce_window_seconds": 1.0,
+        "coalesce_max_messages": 8,
     },
     "tools": {
         "enabled": False,
@@ -141,6 +182,9 @@ DEFAULTS: Dict[str, Any] = {
         "tts_http_response_type": "bytes",
         "tts_http_base64_field": "audio",
         "tts_command": "",
+        "stream_enable": False,
+        "stream_min_chunk_chars": 60,
+        "stream_tts_first_chunk": False,
     },
     "input": {
         "image_max_side": 1280,
@@ -150,6 +194,10 @@ DEFAULTS: Dict[str, Any] = {
         "enable_summarize": False,
         "summarize_min_rounds": 12,
         "summarize_interval_rounds": 8,
+        "summarize_debounce_seconds": 10.0,
+        "summarize_concurrency": 2,
+        "summarize_provider": "",
+        "summarize_model": "",
     },
 }
 
@@ -174,9 +222,18 @@ AI_CHAT_SCHEMA: Dict[str, Any] = {
                     "api_key": {"type": "string", "title": "API Key", "x-order": 2},
                     "model": {"type": "string", "title": "模型", "x-order": 3},
                     "timeout": {"type": "integer", "title": "超时（秒）", "x-order": 4},
+                    "context_tokens": {"type": "integer", "title": "上下文预算（token）", "description": "0 表示使用会话默认预算", "minimum": 0, "x-order": 5},
+                    "max_concurrency": {"type": "integer", "title": "最大并发请求", "description": "同时进行的请求数上限，超出的请求按会话公平排队；0 表示不限", "minimum": 0, "maximum": 1000, "x-order": 7},
                 },
             },
         },
+        "provider_groups": {
+            "type": "object",
+            "title": "服务商组",
+            "description": "键为组名，值为服务商名称列表；会话或默认服务商设为组名时，按错误率与延迟选择成员，出错或超时自动切换到下一个",
+            "x-order": 2,
+            "additionalProperties": {"type": "array", "items": {"type": "string"}},
+        },
         "session": {
             "type": "object",
             "title": "会话",
@@ -185,12 +242,26 @@ AI_CHAT_SCHEMA: Dict[str, Any] = {
             "properties": {
                 "default_provider": {"type": "string", "title": "默认服务商", "x-order": 1},
                 "default_temperature": {"type": "number", "title": "默认温度", "minimum": 0, "maximum": 2, "x-order": 2},
-                "max_rounds": {"type": "integer", "title": "最大轮数", "minimum": 1, "maximum": 50, "x-order": 3},
+                "max_rounds": {"type": "integer", "title": "最大轮数", "description": "最多保留的历史轮数；实际发送的历史还受上下文 token 预算限制", "minimum": 1, "maximum": 50, "x-order": 3},
                 "chatroom_history_max_lines": {"type": "integer", "title": "聊天室历史行数", "minimum": 1, "maximum": 5000, "x-order": 4},
                 "active_reply_enable": {"type": "boolean", "title": "开启主动回复（群聊）", "x-order": 5},
                 "active_reply_probability": {"type": "number", "title": "主动回复概率（0~1）", "minimum": 0, "maximum": 1, "x-order": 6},
                 "active_reply_prompt_suffix": {"type": "string", "title": "主动回复提示后缀", "x-order": 7},
                 "ignore_prefixes": {"type": "array", "title": "不回复前缀（全局）", "description": "消息以这些前缀之一开头时不触发AI；忽略前导空白。", "items": {"type": "string"}, "x-order": 8},
+                "cache_size": {"type": "integer", "title": "会话缓存数量", "description": "内存中缓存的热点会话数量（LRU），命中时处理消息不读数据库", "minimum": 1, "maximum": 100000, "x-order": 9},
+                "flush_interval_seconds": {"type": "number", "title": "历史写入间隔（秒）", "description": "对话历史先写入内存，按该间隔批量写入数据库", "minimum": 0.1, "maximum": 60, "x-order": 10},
+                "context_budget_tokens": {"type": "integer", "title": "上下文预算（token）", "description": "按本地估算的 token 数装配人格、摘要、聊天记录与最近对话，超出预算时丢弃最旧的对话；服务商可单独设置", "minimum": 500, "maximum": 1000000, "x-order": 11},
+                "stable_prefix": {"type": "boolean", "title": "稳定前缀布局", "description": "开启时人格与输出约束组成逐字节不变的前缀，摘要、聊天室记录作为后续消息，便于服务商的提示词缓存命中；关闭则沿用旧布局（并入人格提示词），可在 /ai_chat/stats 中对比命中率", "x-order": 12},
+                "queue_max_per_session": {"type": "integer", "title": "会话排队上限", "description": "同一会话正在处理时最多再排队的消息数，超出时回复繁忙提示；0 表示不限", "minimum": 0, "maximum": 100, "x-order": 13},
+                "queue_max_waiting": {"type": "integer", "title": "服务商排队上限", "description": "服务商并发已满时最多排队的请求数，超出时尝试组内其它成员，仍无空位则回复繁忙提示；0 表示不限", "minimum": 0, "maximum": 10000, "x-order": 14},
+                "queue_timeout_seconds": {"type": "number", "title": "排队超时（秒）", "description": "等待服务商空闲超过该时间则放弃并回复繁忙提示；0 表示不限", "minimum": 0, "maximum": 600, "x-order": 15},
+                "queue_private_weight": {"type": "number", "title": "私聊排队权重", "description": "服务商繁忙时按会话加权轮流处理，群聊权重为 1；大于 1 时私聊获得更多份额", "minimum": 0.1, "maximum": 10, "x-order": 16},
+                "chatroom_memory_max_bytes": {"type": "integer", "title": "聊天室记录内存上限（字节）", "description": "所有群的聊天室记录合计超出时，淘汰最久未活动的群；0 表示不限", "minimum": 0, "x-order": 18},
+                "chatroom_passive_capture": {"type": "boolean", "title": "旁听群消息", "description": "未 @ 机器人的群消息也写入聊天室记录，@ 时模型能看到此前的群聊上下文；只写内存，不调用 AI", "x-order": 19},
+                "busy_reply": {"type": "string", "title": "繁忙提示", "description": "排队已满或超时时的回复；为空则不回复（主动回复始终静默）", "x-order": 17},
+                "coalesce_enable": {"type": "boolean", "title": "合并突发消息", "description": "同一会话在等待回复期间收到的多条消息（多人 @、连续追问、主动回复）合并为一轮多发言人消息，只调用一次模型", "x-order": 20},
+                "coalesce_window_seconds": {"type": "number", "title": "合并窗口（秒）", "description": "会话正在回复时，最后一条消息后静默该时间再排队（最多等待 3 个窗口）；会话空闲时消息立即处理；0 表示不额外等待，只合并前一次回复期间到达的消息", "minimum": 0, "maximum": 30, "x-order": 21},
+                "coalesce_max_messages": {"type": "integer", "title": "单轮最多合并条数", "minimum": 1, "maximum": 50, "x-order": 22},
             },
         },
         "tools": {
@@ -235,6 +306,9 @@ AI_CHAT_SCHEMA: Dict[str, Any] = {
                 "tts_http_response_type": {"type": "string", "title": "HTTP 响应类型（bytes/base64）", "x-order": 9},
                 "tts_http_base64_field": {"type": "string", "title": "base64 字段名（JSON 响应）", "x-order": 10},
                 "tts_command": {"type": "string", "title": "命令行模板（含 {out}）", "x-order": 11},
+                "stream_enable": {"type": "boolean", "title": "流式输出", "description": "边生成边按完整句子/段落分段发送，缩短首条回复的等待时间", "x-order": 12},
+                "stream_min_chunk_chars": {"type": "integer", "title": "流式分段最少字数", "description": "不足该字数的句子与后续内容合并发送，避免刷屏", "minimum": 1, "maximum": 2000, "x-order": 13},
+                "stream_tts_first_chunk": {"type": "boolean", "title": "首段提前生成语音", "description": "流式输出时用第一段文本立即生成 TTS，而不是等待完整回复", "x-order": 14},
             },
         },
         "input": {
@@ -256,6 +330,10 @@ AI_CHAT_SCHEMA: Dict[str, Any] = {
                 "enable_summarize": {"type": "boolean", "title": "开启摘要", "x-order": 1},
                 "summarize_min_rounds": {"type": "integer", "title": "开始摘要的轮数阈值", "minimum": 2, "maximum": 100, "x-order": 2},
                 "summarize_interval_rounds": {"type": "integer", "title": "摘要间隔轮数", "minimum": 2, "maximum": 100, "x-order": 3},
+                "summarize_debounce_seconds": {"type": "number", "title": "摘要延迟（秒）", "description": "摘要在回复发出后于后台生成；该时间内同一会话有新消息则顺延，连续聊天时只生成一次", "minimum": 0, "maximum": 3600, "x-order": 4},
+                "summarize_concurrency": {"type": "integer", "title": "摘要并发数", "description": "同时进行的后台摘要任务数上限", "minimum": 1, "maximum": 32, "x-order": 5},
+                "summarize_provider": {"type": "string", "title": "摘要服务商", "description": "服务商或服务商组名；为空则使用会话服务商", "x-order": 6},
+                "summarize_model": {"type": "string", "title": "摘要模型", "description": "可填更便宜的模型；为空则使用服务商默认模型", "x-order": 7},
             },
         },
     },
@@ -477,8 +555,23 @@ def get_active_api() -> APIItem:
     return apis[first_key]
 
 
+def get_provider_members(name: Optional[str]) -> List[str]:
+    """服务商或服务商组名展开为服务商名称列表（按配置顺序；名称为空或不存在时取第一个服务商）。"""
+    cfg = get_config()
+    apis: Dict[str, APIItem] = dict(getattr(cfg, "api", {}) or {})
+    groups: Dict[str, List[str]] = dict(getattr(cfg, "provider_groups", {}) or {})
+    key = (name or "").strip()
+    if key in groups:
+        names = [n for n in dict.fromkeys(groups.get(key) or []) if n in apis]
+        if names:
+            return names
+    if key in apis:
+        return [key]
+    return [next(iter(apis))] if apis else []
+
+
 def get_api_by_name(name: Optional[str]) -> APIItem:
-    """按名称获取服务商配置；名称为空或不存在时返回第一个可用服务商。"""
+    """按名称获取服务商配置（组名取第一个成员）；名称为空或不存在时返回第一个可用服务商。"""
     cfg = get_config()
     apis: Dict[str, APIItem] = dict(getattr(cfg, "api", {}) or {})
     if not apis:
@@ -486,8 +579,9 @@ def get_api_by_name(name: Optional[str]) -> APIItem:
     key = (name or "").strip()
     if key and key in apis:
         return apis[key]
-    first_key = next(iter(apis.keys()))
-    return apis[first_key]
+    # 组名：取组内第一个成员
+    members = get_provider_members(key)
+    return apis[members[0]] if members else apis[next(iter(apis.keys()))]
 
 
 # ==================== 人格：目录化实现 ====================
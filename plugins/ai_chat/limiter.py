@@ -0,0 +1,122 @@
+"""服务商并发限制与公平排队
+
+- 每个服务商一个 FairLimiter：同时进行的请求数不超过 capacity，其余请求排队；
+- 排队按会话加权公平（start-time fair queueing）：每个会话的请求依次获得虚拟时间标签，
+  标签 = max(当前虚拟时间, 该会话上一个请求的结束标签)，结束标签 = 标签 + 1/权重，
+  空位总是交给标签最小的请求——连续发起请求（如工具调用多轮）的会话排到其它会话之后；
+- 排队数达到 max_waiting 或等待超过 timeout 时抛出 QueueFull，由调用方降级（换服务商或回复繁忙）。
+"""
+from __future__ import annotations
+
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+
+class QueueFull(Exception):
+    """排队已满或等待超时"""
+
+
+class FairLimiter:
+    def __init__(self, capacity: int = 4, *, max_waiting: int = 0, timeout: float = 0.0) -> None:
+        self.capacity = max(0, int(capacity))
+        self.max_waiting = max(0, int(max_waiting))
+        self.timeout = max(0.0, float(timeout))
+        self.active = 0
+        self.shed = 0
+        self.wait_ewma: Optional[float] = None
+        self._heap: List[List[Any]] = []
+        self._waiting = 0
+        self._seq = itertools.count()
+        self._vtime = 0.0
+        self._finish: Dict[str, float] = {}
+
+    def configure(self, capacity: int, max_waiting: int, timeout: float) -> None:
+        """热更新参数；扩容后立即放行排队中的请求"""
+        self.capacity = max(0, int(capacity))
+        self.max_waiting = max(0, int(max_waiting))
+        self.timeout = max(0.0, float(timeout))
+        self._wake()
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def _tag(self, key: str, weight: float) -> float:
+        start = max(self._vtime, self._finish.get(key, 0.0))
+        self._finish[key] = start + 1.0 / max(weight, 1e-3)
+        return start
+
+    def _has_room(self) -> bool:
+        return self.capacity <= 0 or self.active < self.capacity
+
+    def _wake(self) -> None:
+        while self._heap and self._has_room():
+            start, _, fut, _key = heapq.heappop(self._heap)
+            if fut.done():
+                continue
+            self.active += 1
+            self._vtime = max(self._vtime, start)
+            fut.set_result(None)
+        # 结束标签落后于虚拟时间的会话不再影响排序，清理以免字典无限增长
+        if len(self._finish) > 4 * (len(self._heap) + self.capacity) + 64:
+            self._finish = {k: v for k, v in self._finish.items() if v > self._vtime}
+
+    async def acquire(self, key: str, weight: float = 1.0) -> None:
+        start = self._tag(key, weight)
+        if not self._heap and self._has_room():
+            self.active += 1
+            self._vtime = max(self._vtime, start)
+            return
+        if self.max_waiting and self._waiting >= self.max_waiting:
+            self.shed += 1
+            raise QueueFull("排队已满")
+        fut = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, [start, next(self._seq), fut, key])
+        self._waiting += 1
+        # 堆中可能只剩已放弃的请求：立即尝试放行
+        self._wake()
+        t0 = time.monotonic()
+        try:
+            if self.timeout > 0:
+                await asyncio.wait_for(fut, self.timeout)
+            else:
+                await fut
+        except BaseException as e:
+            if fut.done() and not fut.cancelled():
+                # 放行与放弃同时发生：归还名额
+                self.release()
+            else:
+                fut.cancel()
+            if isinstance(e, asyncio.TimeoutError):
+                self.shed += 1
+                raise QueueFull("排队超时") from None
+            raise
+        finally:
+            self._waiting -= 1
+        waited = time.monotonic() - t0
+        self.wait_ewma = waited if self.wait_ewma is None else 0.7 * self.wait_ewma + 0.3 * waited
+
+    def release(self) -> None:
+        self.active = max(0, self.active - 1)
+        self._wake()
+
+    @asynccontextmanager
+    async def slot(self, key: str, weight: float = 1.0) -> AsyncIterator[None]:
+        await self.acquire(key, weight)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "active": self.active,
+            "waiting": self._waiting,
+            "shed": self.shed,
+            "wait_ms": round(self.wait_ewma * 1000, 1) if self.wait_ewma is not None else None,
+        }
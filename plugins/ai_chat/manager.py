@@ -8,12 +8,14 @@ from __future__ import annotations
 import asyncio
 import json
 import re
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime
-from typing import Any, Dict, List, Optional
-from collections import defaultdict
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Set, Tuple
+from collections import OrderedDict, deque
 
 from nonebot.log import logger
-from openai import AsyncOpenAI
+from openai import AsyncOpenAI, BadRequestError
 
 # Track background tasks to prevent unbounded growth
 _BG_TASKS: set[asyncio.Task] = set()
@@ -23,8 +25,12 @@ def _track_bg(task: asyncio.Task) -> None:
     _BG_TASKS.add(task)
     task.add_done_callback(lambda t: _BG_TASKS.discard(t))
 
-from .config import get_config, get_personas, CFG
-from .models import ChatSession
+from .config import get_config, get_personas, get_provider_members, CFG
+from .models import ChatSession, add_invalidate_listener
+from .tokens import MESSAGE_OVERHEAD, estimate_tokens, item_tokens, message_tokens, messages_tokens
+from .streaming import ChunkStreamer
+from .providers import ProviderPool
+from .limiter import QueueFull
 from .tools import get_enabled_tools, execute_tool
 from .hooks import run_pre_ai_hooks, run_post_ai_hooks
 
@@ -32,17 +38,71 @@ from .hooks import run_pre_ai_hooks, run_post_ai_hooks
 # ==================== Chatroom Memory (in-memory) ====================
 
 
+_CHATROOM_SEP = "\n---\n"
+
+
+class _Room:
+    """单个群的聊天室记录：定长 deque + 增量维护的拼接串"""
+
+    __slots__ = ("lines", "nbytes", "_text")
+
+    def __init__(self) -> None:
+        self.lines: Deque[Tuple[str, int]] = deque()
+        self.nbytes = 0
+        self._text: Optional[str] = None
+
+    def append(self, line: str, max_cnt: int) -> int:
+        """追加一行并按行数裁剪，返回字节数变化"""
+        size = len(line.encode("utf-8"))
+        self.lines.append((line, size))
+        delta = size
+        if self._text is not None:
+            self._text = f"{self._text}{_CHATROOM_SEP}{line}" if len(self.lines) > 1 else line
+        while len(self.lines) > max_cnt:
+            delta -= self.pop_oldest()
+        self.nbytes += delta
+        return delta
+
+    def pop_oldest(self) -> int:
+        """移除最旧一行（不更新 nbytes），返回其字节数"""
+        line, size = self.lines.popleft()
+        if self._text is not None:
+            self._text = self._text[len(line) + len(_CHATROOM_SEP):] if self.lines else ""
+        return size
+
+    def text(self) -> str:
+        if self._text is None:
+            self._text = _CHATROOM_SEP.join(line for line, _ in self.lines)
+        return self._text
+
+
 class ChatroomMemory:
-    """聊天室历史（轻量内存环形缓冲）
+    """聊天室历史（内存，按群 LRU）
 
     仅用于群聊上下文提示，不做持久化：
     - 记录格式：[昵称/HH:MM:SS]: 文本
+    - 每个群最多 max_cnt 行（deque，追加与淘汰均为 O(1)），拼接串随追加增量更新；
+    - 所有群合计不超过 max_bytes 字节，超出时淘汰最久未活动的群；
     - get_history_str() 返回以 "\n---\n" 连接的历史串
     """
 
-    def __init__(self, max_cnt: int = 200):
-        self.max_cnt = max_cnt
-        self.session_chats: Dict[str, List[str]] = defaultdict(list)
+    def __init__(self, max_cnt: int = 200, max_bytes: int = 0):
+        self.max_cnt = max(1, int(max_cnt))
+        self.max_bytes = max(0, int(max_bytes))
+        self.session_chats: "OrderedDict[str, _Room]" = OrderedDict()
+        self.total_bytes = 0
+        self.evicted = 0
+
+    def configure(self, max_cnt: int, max_bytes: int) -> None:
+        """热更新上限；缩小时立即裁剪"""
+        self.max_cnt = max(1, int(max_cnt))
+        self.max_bytes = max(0, int(max_bytes))
+        for room in self.session_chats.values():
+            while len(room.lines) > self.max_cnt:
+                n = room.pop_oldest()
+                room.nbytes -= n
+                self.total_bytes -= n
+        self._enforce_budget()
 
     def record_user(self, session_id: str, user_name: str, text: str) -> None:
         ts = datetime.now().strftime("%H:%M:%S")
@@ -53,20 +113,247 @@ class ChatroomMemory:
         self._append(session_id, f"[You/{ts}]: {text}")
 
     def get_history_str(self, session_id: str) -> str:
-        chats = self.session_chats.get(session_id, [])
-        return "\n---\n".join(chats)
+        room = self.session_chats.get(session_id)
+        if room is None:
+            return ""
+        self.session_chats.move_to_end(session_id)
+        return room.text()
 
     def clear(self, session_id: str) -> int:
-        cnt = len(self.session_chats.get(session_id, []))
-        if session_id in self.session_chats:
-            del self.session_chats[session_id]
-        return cnt
+        room = self.session_chats.pop(session_id, None)
+        if room is None:
+            return 0
+        self.total_bytes -= room.nbytes
+        return len(room.lines)
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "groups": len(self.session_chats),
+            "lines": sum(len(r.lines) for r in self.session_chats.values()),
+            "bytes": self.total_bytes,
+            "max_bytes": self.max_bytes,
+            "evicted_groups": self.evicted,
+        }
 
     def _append(self, session_id: str, line: str) -> None:
-        arr = self.session_chats[session_id]
-        arr.append(line)
-        if len(arr) > self.max_cnt:
-            arr.pop(0)
+        room = self.session_chats.get(session_id)
+        if room is None:
+            room = self.session_chats[session_id] = _Room()
+        else:
+            self.session_chats.move_to_end(session_id)
+        self.total_bytes += room.append(line, self.max_cnt)
+        self._enforce_budget()
+
+    def _enforce_budget(self) -> None:
+        if self.max_bytes <= 0:
+            return
+        # 先淘汰冷门群；只剩最近活动的群仍超出时裁剪它的最旧行
+        while self.total_bytes > self.max_bytes and len(self.session_chats) > 1:
+            _, room = self.session_chats.popitem(last=False)
+            self.total_bytes -= room.nbytes
+            self.evicted += 1
+        if self.total_bytes > self.max_bytes and self.session_chats:
+            room = next(reversed(self.session_chats.values()))
+            while self.total_bytes > self.max_bytes and len(room.lines) > 1:
+                n = room.pop_oldest()
+                room.nbytes -= n
+                self.total_bytes -= n
+
+
+def _cached_tokens(u: Any) -> Optional[int]:
+    """各服务商 usage 中命中前缀缓存的 prompt token 数（字段名不统一）"""
+    details = getattr(u, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        v = details.get("cached_tokens")
+    else:
+        v = getattr(details, "cached_tokens", None)
+    if isinstance(v, int):
+        return v
+    extra = getattr(u, "model_extra", None) or {}
+    # DeepSeek: prompt_cache_hit_tokens；Anthropic 兼容接口: cache_read_input_tokens
+    for key in ("prompt_cache_hit_tokens", "cache_read_input_tokens"):
+        v = getattr(u, key, None)
+        if v is None and isinstance(extra, dict):
+            v = extra.get(key)
+        if isinstance(v, int):
+            return v
+    return None
+
+
+def _add_usage(usage: Optional[Dict[str, int]], response: Any) -> None:
+    """把接口返回的 usage 累加到 usage 字典（工具往返会有多次请求）"""
+    if usage is None:
+        return
+    u = getattr(response, "usage", None)
+    if u is None:
+        return
+    for key in ("prompt_tokens", "completion_tokens"):
+        v = getattr(u, key, None)
+        if isinstance(v, int):
+            usage[key] = usage.get(key, 0) + v
+    cached = _cached_tokens(u)
+    if cached is not None:
+        usage["cached_tokens"] = usage.get("cached_tokens", 0) + cached
+
+
+# ==================== 会话缓存（LRU + 延迟写入） ====================
+
+
+class _CachedSession:
+    """缓存的会话：行字段、解析后的历史与配置，以及尚未写入数据库的新条目"""
+
+    __slots__ = ("session_id", "row", "history", "config", "pending", "max_history")
+
+    def __init__(self, row: ChatSession, history: List[Dict[str, Any]], config: Dict[str, Any]):
+        self.session_id = row.session_id
+        self.row = row
+        self.history = history
+        self.config = config
+        self.pending: List[Dict[str, Any]] = []
+        self.max_history = 0
+
+
+class SessionCache:
+    """热点会话 LRU 缓存（写回式）
+
+    - 命中时处理消息不读数据库；
+    - 新的对话条目先追加到内存历史，由后台任务按间隔批量写入（同一会话的多轮合并为一次写入）；
+    - 控制台/命令修改会话后，在事务提交时收到失效通知并丢弃缓存；
+    - 被淘汰或失效的条目若仍有未写入内容，照常由写入任务落库；
+    - 缓存未命中时先落库同一会话的未写入内容，再从数据库加载。
+    """
+
+    def __init__(self, capacity: int = 256):
+        self.capacity = max(1, int(capacity))
+        self._entries: "OrderedDict[str, _CachedSession]" = OrderedDict()
+        self._dirty: Set[_CachedSession] = set()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._task: Optional[asyncio.Task] = None
+        # 失效代数：加载期间发生失效则不放入缓存，避免缓存旧数据
+        self._gen = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def generation(self) -> int:
+        return self._gen
+
+    def peek(self, session_id: str) -> Optional[_CachedSession]:
+        """查看缓存条目（不计入命中、不调整 LRU 顺序）"""
+        return self._entries.get(session_id)
+
+    def get(self, session_id: str) -> Optional[_CachedSession]:
+        entry = self._entries.get(session_id)
+        if entry is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(session_id)
+        self.hits += 1
+        return entry
+
+    def put(self, entry: _CachedSession, generation: int) -> None:
+        if generation != self._gen:
+            return
+        self._entries[entry.session_id] = entry
+        self._entries.move_to_end(entry.session_id)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, session_id: Optional[str]) -> None:
+        """丢弃缓存（None 表示全部）；未写入的条目仍会落库。"""
+        self._gen += 1
+        if session_id is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(session_id, None)
+
+    def drop(self, session_id: str) -> None:
+        """丢弃缓存及其未写入的条目（用于清空历史）。"""
+        self.invalidate(session_id)
+        for entry in [e for e in self._dirty if e.session_id == session_id]:
+            entry.pending = []
+            self._dirty.discard(entry)
+
+    def append(self, entry: _CachedSession, items: List[Dict[str, Any]], max_history: int) -> None:
+        entry.history.extend(items)
+        if max_history > 0 and len(entry.history) > max_history:
+            del entry.history[: len(entry.history) - max_history]
+        entry.pending.extend(items)
+        entry.max_history = max_history
+        self._dirty.add(entry)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+
+    async def _flush_entry(self, entry: _CachedSession) -> None:
+        lock = self._locks.setdefault(entry.session_id, asyncio.Lock())
+        async with lock:
+            items, entry.pending = entry.pending, []
+            if items:
+                try:
+                    await ChatSession.append_history_items(
+                        session_id=entry.session_id, items=items, max_history=entry.max_history
+                    )
+                except Exception as e:
+                    entry.pending[:0] = items
+                    logger.error(f"[AI Chat] 保存对话失败: {e}")
+                    return
+            if not entry.pending:
+                self._dirty.discard(entry)
+
+    async def flush_session(self, session_id: str) -> None:
+        for entry in [e for e in self._dirty if e.session_id == session_id]:
+            await self._flush_entry(entry)
+
+    async def flush_all(self) -> None:
+        for entry in list(self._dirty):
+            await self._flush_entry(entry)
+
+    async def _run(self) -> None:
+        while self._dirty:
+            try:
+                interval = float(get_config().session.flush_interval_seconds)
+            except Exception:
+                interval = 2.0
+            await asyncio.sleep(max(0.1, interval))
+            await self.flush_all()
+
+    async def close(self) -> None:
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except BaseException:
+                pass
+        await self.flush_all()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "capacity": self.capacity,
+            "dirty": len(self._dirty),
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+# ==================== 突发消息合并 ====================
+
+
+class _Burst:
+    """同一会话短时间内的多条消息：由第一条（leader）合并为一轮处理"""
+
+    __slots__ = ("items", "open", "first_at", "last_at")
+
+    def __init__(self) -> None:
+        self.items: List[Dict[str, Any]] = []
+        self.open = True
+        self.first_at = self.last_at = time.monotonic()
+
+    def add(self, user_name: str, message: str, images: Optional[List[str]], active_reply: bool) -> None:
+        self.items.append(
+            {"user_name": user_name, "message": message, "images": list(images or []), "active_reply": active_reply}
+        )
+        self.last_at = time.monotonic()
 
 
 # ==================== ChatManager ====================
@@ -79,11 +366,32 @@ class ChatManager:
         # 多服务商客户端缓存：{ provider_name: AsyncOpenAI }
         self.client: Optional[AsyncOpenAI] = None
         self.clients: Dict[str, AsyncOpenAI] = {}
+        # 会话锁按使用者计数，空闲（无人持有或等待）时移除
         self._session_locks: Dict[str, asyncio.Lock] = {}
-        self._history_locks: Dict[str, asyncio.Lock] = {}
+        self._session_users: Dict[str, int] = {}
+        try:
+            self.cache = SessionCache(capacity=int(get_config().session.cache_size))
+        except Exception:
+            self.cache = SessionCache()
+        add_invalidate_listener(self.cache.invalidate)
+        # 按提示词布局（stable/legacy）累计 prompt 与缓存命中 token，便于对比命中率
+        self.prompt_stats: Dict[str, Dict[str, int]] = {}
+        # 各服务商的延迟/错误率 EWMA，用于组内选路与故障转移（配置重载后保留）
+        self.providers = ProviderPool()
+        # 后台摘要：每个会话至多一个任务，到期时间随新消息顺延
+        self._summary_tasks: Dict[str, asyncio.Task] = {}
+        self._summary_due: Dict[str, Tuple[float, _CachedSession]] = {}
+        self._summary_sem: Optional[asyncio.Semaphore] = None
+        self._summary_sem_size = 0
+        # 突发消息合并：{ session_id: 等待处理的 _Burst }
+        self._bursts: Dict[str, _Burst] = {}
+        self.coalesce_stats: Dict[str, int] = {"bursts": 0, "merged": 0}
         self.reset_client()
         try:
-            self.ltm = ChatroomMemory(max_cnt=max(1, int(get_config().session.chatroom_history_max_lines)))
+            self.ltm = ChatroomMemory(
+                max_cnt=max(1, int(get_config().session.chatroom_history_max_lines)),
+                max_bytes=int(get_config().session.chatroom_memory_max_bytes),
+            )
         except Exception:
             self.ltm = ChatroomMemory(max_cnt=200)
 
@@ -97,7 +405,11 @@ class ChatManager:
             logger.debug("[AI Chat] 已清空 OpenAI 客户端缓存")
             try:
                 if hasattr(self, "ltm") and self.ltm:
-                    self.ltm.max_cnt = max(1, int(cfg.session.chatroom_history_max_lines))
+                    self.ltm.configure(cfg.session.chatroom_history_max_lines, cfg.session.chatroom_memory_max_bytes)
+            except Exception:
+                pass
+            try:
+                self.cache.capacity = max(1, int(cfg.session.cache_size))
             except Exception:
                 pass
         except Exception as e:
@@ -120,10 +432,58 @@ class ChatManager:
         except Exception:
             return None
 
-    def _get_session_lock(self, session_id: str) -> asyncio.Lock:
-        if session_id not in self._session_locks:
-            self._session_locks[session_id] = asyncio.Lock()
-        return self._session_locks[session_id]
+    def _provider_candidates(self, session: Any) -> List[str]:
+        """会话服务商（或服务商组）展开后按健康度排序的候选列表"""
+        target = getattr(session, "provider_name", None) or getattr(get_config().session, "default_provider", "")
+        return self.providers.rank(get_provider_members(target))
+
+    @asynccontextmanager
+    async def _session_turn(self, session_id: str) -> AsyncIterator[bool]:
+        """按会话串行处理；排队数超过 queue_max_per_session 时不等待，产出 False"""
+        users = self._session_users.get(session_id, 0)
+        try:
+            limit = int(get_config().session.queue_max_per_session)
+        except Exception:
+            limit = 0
+        # users 含正在处理的一条，其余为排队中的
+        if limit > 0 and users > limit:
+            yield False
+            return
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        self._session_users[session_id] = users + 1
+        try:
+            async with lock:
+                yield True
+        finally:
+            left = self._session_users.get(session_id, 1) - 1
+            if left <= 0:
+                self._session_users.pop(session_id, None)
+                self._session_locks.pop(session_id, None)
+            else:
+                self._session_users[session_id] = left
+
+    def _provider_slot(self, provider: Optional[str], session: Any):
+        """服务商并发名额（按会话公平排队），参数每次从配置热更新"""
+        from .config import get_api_by_name
+        cfg = get_config().session
+        lim = self.providers.limiter(provider or "")
+        lim.configure(
+            int(getattr(get_api_by_name(provider), "max_concurrency", 0) or 0),
+            int(cfg.queue_max_waiting),
+            float(cfg.queue_timeout_seconds),
+        )
+        weight = float(cfg.queue_private_weight) if getattr(session, "session_type", "") == "private" else 1.0
+        return lim.slot(str(getattr(session, "session_id", "") or ""), weight)
+
+    def _busy_reply(self, active_reply: bool) -> str:
+        if active_reply:
+            return ""
+        try:
+            return get_config().session.busy_reply or ""
+        except Exception:
+            return ""
 
     def _get_active_api_flags(self, provider_name: Optional[str]) -> tuple[bool, bool]:
         """Return (support_tools, support_vision) for given provider.
@@ -172,44 +532,45 @@ class ChatManager:
     async def _get_history(
         self,
         session_id: str,
-        session: Optional[ChatSession] = None,
+        limit: int = 0,
     ) -> List[Dict[str, Any]]:
-        """获取历史消息（优先读会话 JSON）。返回元素为 dict"""
+        """获取最近 limit 条历史消息（limit<=0 表示全部）。返回元素为 dict"""
 
-        if session is None:
-            session = await self._get_session(session_id, session_type="group")
+        try:
+            return await ChatSession.get_history_list(session_id=session_id, limit=limit)
+        except Exception as e:
+            logger.debug(f"[AI Chat] 读取历史失败: {e}")
+            return []
 
-        history_list: List[Dict[str, Any]] = []
+    async def _get_cached(
+        self,
+        session_id: str,
+        session_type: str,
+        group_id: Optional[str] = None,
+        user_id: Optional[str] = None,
+    ) -> _CachedSession:
+        """从缓存获取会话；未命中时落库同会话未写入的条目后从数据库加载"""
+
+        entry = self.cache.get(session_id)
+        if entry is not None:
+            return entry
+        generation = self.cache.generation
+        await self.cache.flush_session(session_id)
+        session = await self._get_session(session_id, session_type, group_id, user_id)
         try:
-            history_list = json.loads(session.history_json or "[]") if session and session.history_json else []
-            if not isinstance(history_list, list):
-                history_list = []
+            limit = max(0, 2 * int(get_config().session.max_rounds))
         except Exception:
-            history_list = []
-
-        return history_list
-
-    def _trim_history_rounds(self, history: List[Dict[str, Any]], max_pairs: int) -> List[Dict[str, Any]]:
-        """按轮（user+assistant）裁剪历史，确保从第一个 user 开始"""
-
+            limit = 0
+        history = await self._get_history(session_id, limit=limit)
         try:
-            if not history:
-                return []
-            if max_pairs <= 0:
-                return []
-            keep = max_pairs * 2
-            trimmed = history[-keep:] if len(history) > keep else list(history)
-            idx = next(
-                (i for i, m in enumerate(trimmed) if (isinstance(m, dict) and m.get("role") == "user") or getattr(m, "role", None) == "user"),
-                0,
-            )
-            if idx > 0:
-                trimmed = trimmed[idx:]
-            if len(trimmed) > keep:
-                trimmed = trimmed[-keep:]
-            return trimmed
+            config = json.loads(session.config_json or "{}")
+            if not isinstance(config, dict):
+                config = {}
         except Exception:
-            return history
+            config = {}
+        entry = _CachedSession(session, history, config)
+        self.cache.put(entry, generation)
+        return entry
 
     # ==================== 核心处理 ====================
 
@@ -248,13 +609,21 @@ class ChatManager:
         active_reply: bool = False,
         active_reply_suffix: Optional[str] = None,
         images: Optional[List[str]] = None,
+        on_text: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_voice: Optional[Callable[[str], Awaitable[None]]] = None,
     ) -> Any:
         """处理用户消息（串行同会话，支持工具与前后钩子，多模态输出）。
 
-        返回优先为 dict：{"text": str, "images": [str], "tts_path": Optional[str]}。
+        返回优先为 dict：{"text": str, "images": [str], "tts_path": Optional[str], ...}。
         兼容纯文本返回 str。
+
+        开启流式输出且传入 on_text 时，回复按句/段经 on_text 边生成边发送，返回的 text 为空、
+        streamed 为 True；首段提前生成的语音经 on_voice 发送。后置钩子仍作用于完整回复
+        （影响保存的历史），但无法修改已发出的分段。
         """
 
+        t0 = time.monotonic()
+
         # 选择本会话服务商（若未设置则使用默认）
         cfg_for_provider = get_config()
         current_provider = None
@@ -264,42 +633,63 @@ class ChatManager:
         except Exception:
             pass
 
-        lock = self._get_session_lock(session_id)
-        async with lock:
+        # 突发合并：该会话已有等待处理的消息时并入其中，由第一条消息统一回复
+        burst: Optional[_Burst] = None
+        sess_cfg = cfg_for_provider.session
+        if sess_cfg.coalesce_enable:
+            pending = self._bursts.get(session_id)
+            max_items = max(1, int(sess_cfg.coalesce_max_messages))
+            if pending is not None and pending.open and len(pending.items) < max_items:
+                pending.add(user_name, message, images, active_reply)
+                self.coalesce_stats["merged"] += 1
+                return ""
+            burst = self._bursts[session_id] = _Burst()
+            burst.add(user_name, message, images, active_reply)
+
+        async with self._burst_scope(session_id, burst), self._session_turn(session_id) as admitted:
+            speakers = [(user_name, message)]
+            if burst is not None:
+                # 取得会话锁（或被拒绝）后不再接收新消息
+                self._close_burst(session_id, burst)
+                if len(burst.items) > 1:
+                    self.coalesce_stats["bursts"] += 1
+                    message, images, active_reply = self._merge_burst(burst, session_type)
+                    speakers = [(it["user_name"], it["message"]) for it in burst.items]
+                    logger.info(f"[AI Chat] {session_id} 合并 {len(burst.items)} 条消息为一轮")
+            if not admitted:
+                logger.info(f"[AI Chat] {session_id} 排队消息过多，已丢弃")
+                if session_type == "group":
+                    # 不回复，但保留到聊天室记录，后续轮次仍能看到这些发言
+                    for name, text in speakers:
+                        self.ltm.record_user(session_id, name, text)
+                return self._busy_reply(active_reply)
             try:
-                session = await self._get_session(session_id, session_type, group_id, user_id)
-                history = await self._get_history(session_id, session=session)
+                cached = await self._get_cached(session_id, session_type, group_id, user_id)
+                session = cached.row
+                history = list(cached.history)
 
                 if not session or not session.is_active:
                     return ""
 
-                try:
-                    pairs_limit = max(1, int(get_config().session.max_rounds))
-                    history = self._trim_history_rounds(history, pairs_limit)
-                except Exception:
-                    pass
-
                 chatroom_history = ""
                 if session_type == "group":
-                    self.ltm.record_user(session_id, user_name, message)
+                    for name, text in speakers:
+                        self.ltm.record_user(session_id, name, text)
                     chatroom_history = self.ltm.get_history_str(session_id)
 
                 if active_reply:
                     history = []
 
-                try:
-                    await self._maybe_update_summary(session, history)
-                except Exception:
-                    pass
-                # 计算会话服务商与能力
-                current_provider = getattr(session, "provider_name", None) or getattr(get_config().session, "default_provider", "")
-                client = self._get_client_for(current_provider)
-                if not client:
+                # 计算会话服务商与能力（服务商组按健康度排序，首选成员决定能力与预算）
+                candidates = [n for n in self._provider_candidates(session) if self._get_client_for(n)]
+                if not candidates:
                     return "AI 未配置或暂不可用"
+                current_provider = candidates[0]
                 # Capability-based input gating
                 support_tools, support_vision = self._get_active_api_flags(current_provider)
                 if (images and not support_vision) and (not message or not str(message).strip()):
                     return "当前模型不支持识别图片"
+                stable_prefix = bool(getattr(get_config().session, "stable_prefix", True))
                 messages = self._build_messages(
                     session,
                     history,
@@ -310,6 +700,9 @@ class ChatManager:
                     active_reply=active_reply,
                     active_reply_suffix=active_reply_suffix,
                     images=(images if (images and support_vision) else None),
+                    session_config=cached.config,
+                    budget=self._context_budget(current_provider),
+                    stable_prefix=stable_prefix,
                 )
 
                 cfg = get_config()
@@ -338,13 +731,39 @@ class ChatManager:
                 tools = overrides.get("tools", default_tools)
                 messages = overrides.get("messages", messages)
 
-                response = await self._call_ai(
+                # 发送前按最终消息（含钩子修改）估算 prompt token，与接口返回的用量一并记录
+                usage: Dict[str, int] = {"prompt_tokens_est": messages_tokens(messages)}
+                out_cfg = getattr(cfg, "output", None)
+                streamer: Optional[ChunkStreamer] = None
+                voice_task: Optional[asyncio.Task] = None
+                if on_text is not None and out_cfg is not None and out_cfg.stream_enable:
+
+                    def _clean_chunk(text: str) -> str:
+                        # 图片随完整回复统一发送，这里只去掉其链接
+                        return self._extract_output_media(self._sanitize_response_v2(text))[0]
+
+                    def _first_chunk(text: str) -> None:
+                        nonlocal voice_task
+                        if out_cfg.tts_enable and out_cfg.stream_tts_first_chunk:
+                            voice_task = asyncio.create_task(self._stream_tts(session_id, text, on_voice))
+
+                    streamer = ChunkStreamer(
+                        on_text,
+                        min_chars=int(out_cfg.stream_min_chunk_chars),
+                        clean=_clean_chunk,
+                        on_first=_first_chunk,
+                        started_at=t0,
+                    )
+                response, current_provider = await self._call_with_failover(
                     session,
                     messages,
-                    model=model,
+                    candidates,
+                    # 钩子未改模型时，各成员使用自己的默认模型
+                    model=(None if model == default_model else model),
                     temperature=temperature,
                     tools=tools,
-                    client=client,
+                    usage=usage,
+                    streamer=streamer,
                 )
 
                 response = await run_post_ai_hooks(
@@ -364,19 +783,36 @@ class ChatManager:
                 response = self._sanitize_response_v2(response)
 
                 clean_text, out_images = self._extract_output_media(response)
+                streamed = streamer is not None and streamer.sent
                 tts_path: Optional[str] = None
-                try:
-                    cfg2 = get_config()
-                    if getattr(cfg2, "output", None) and cfg2.output.tts_enable and clean_text:
-                        from .tts import run_tts
-                        tts_path = await run_tts(session_id=session_id, text=clean_text, manager=self)
-                except Exception:
-                    tts_path = None
+                if voice_task is not None:
+                    # 首段语音已提前生成；未能经 on_voice 发出时随结果返回
+                    try:
+                        tts_path, voice_sent = await voice_task
+                        if voice_sent:
+                            tts_path = None
+                    except Exception:
+                        tts_path = None
+                else:
+                    try:
+                        cfg2 = get_config()
+                        if getattr(cfg2, "output", None) and cfg2.output.tts_enable and clean_text:
+                            from .tts import run_tts
+                            tts_path = await run_tts(session_id=session_id, text=clean_text, manager=self)
+                    except Exception:
+                        tts_path = None
 
                 max_msgs = max(0, 2 * int(get_config().session.max_rounds))
-                _track_bg(asyncio.create_task(
-                    self._save_conversation(session_id, user_name, message, clean_text, max_msgs)
-                ))
+                now = datetime.now().isoformat()
+                new_items = [
+                    {"role": "user", "content": message, "user_name": user_name, "created_at": now},
+                    {"role": "assistant", "content": clean_text, "created_at": now},
+                ]
+                for it in new_items:
+                    item_tokens(it)
+                self.cache.append(cached, new_items, max_msgs)
+                # 摘要在回复发出后由后台任务生成，下一次请求读取缓存配置中的新摘要
+                self._schedule_summary(cached)
 
                 if session_type == "group" and clean_text:
                     try:
@@ -384,12 +820,106 @@ class ChatManager:
                     except Exception:
                         pass
 
-                return {"text": clean_text, "images": out_images, "tts_path": tts_path}
+                self._record_prompt_usage("stable" if stable_prefix else "legacy", usage)
+                timing = {
+                    "first_message_ms": (
+                        streamer.first_chunk_ms
+                        if streamed and streamer is not None
+                        else round((time.monotonic() - t0) * 1000, 1)
+                    ),
+                    "total_ms": round((time.monotonic() - t0) * 1000, 1),
+                }
+                logger.info(
+                    f"[AI Chat] {session_id} prompt tokens: 估算 {usage['prompt_tokens_est']}"
+                    + (f"，实际 {usage['prompt_tokens']}" if "prompt_tokens" in usage else "")
+                    + ("（含本地估算）" if usage.get("estimated") else "")
+                    + (f"，补全 {usage['completion_tokens']}" if "completion_tokens" in usage else "")
+                    + (f"，缓存命中 {usage['cached_tokens']}" if "cached_tokens" in usage else "")
+                    + f"；服务商 {current_provider}；首条消息 {timing['first_message_ms']} ms，总耗时 {timing['total_ms']} ms"
+                    + (f"（流式 {len(streamer.chunks)} 段）" if streamed and streamer is not None else "")
+                )
+
+                return {
+                    "text": "" if streamed else clean_text,
+                    "images": out_images,
+                    "tts_path": tts_path,
+                    "usage": usage,
+                    "timing": timing,
+                    "streamed": streamed,
+                }
 
+            except QueueFull as e:
+                logger.warning(f"[AI Chat] {session_id} 服务商繁忙: {e}")
+                return self._busy_reply(active_reply)
             except Exception as e:
                 logger.exception(f"[AI Chat] 处理消息失败: {e}")
                 return "抱歉，我遇到了一点问题。"
 
+    @asynccontextmanager
+    async def _burst_scope(self, session_id: str, burst: Optional[_Burst]) -> AsyncIterator[None]:
+        """会话正在回复时先防抖再排队；会话空闲则立即处理，不额外等待。
+
+        无论正常结束还是在防抖/排队时被取消，退出时都关闭并移除该 burst。
+        """
+        if burst is None:
+            yield
+            return
+        try:
+            if self._session_users.get(session_id, 0) > 0:
+                sess_cfg = get_config().session
+                await self._debounce_burst(
+                    burst,
+                    float(sess_cfg.coalesce_window_seconds),
+                    max(1, int(sess_cfg.coalesce_max_messages)),
+                )
+            yield
+        finally:
+            self._close_burst(session_id, burst)
+
+    def _close_burst(self, session_id: str, burst: _Burst) -> None:
+        burst.open = False
+        if self._bursts.get(session_id) is burst:
+            del self._bursts[session_id]
+
+    async def _debounce_burst(self, burst: _Burst, window: float, max_items: int) -> None:
+        """防抖：最后一条消息后静默 window 秒再处理（最多等待 3 个窗口或凑满 max_items 条）"""
+        if window <= 0:
+            return
+        deadline = burst.first_at + 3 * window
+        while len(burst.items) < max_items:
+            wait = min(burst.last_at + window, deadline) - time.monotonic()
+            if wait <= 0:
+                return
+            await asyncio.sleep(wait)
+
+    def _merge_burst(self, burst: _Burst, session_type: str) -> Tuple[str, Optional[List[str]], bool]:
+        """合并为一轮多发言人消息，返回 (message, images, active_reply)
+
+        首条消息的发言人作为本轮 user_name（群聊由 _build_messages 加上前缀），
+        其后各条按 "昵称: 文本" 逐行附加；任一条为 @ 消息时按普通回复处理。
+        """
+        first, rest = burst.items[0], burst.items[1:]
+        lines = [first["message"] or "[图片]"]
+        images: List[str] = list(first["images"])
+        for it in rest:
+            if it["message"]:
+                lines.append(f"{it['user_name']}: {it['message']}" if session_type == "group" else it["message"])
+            images.extend(it["images"])
+        message = "\n".join(lines)
+        active_reply = all(it["active_reply"] for it in burst.items)
+        return message, (images or None), active_reply
+
+    def _context_budget(self, provider_name: Optional[str]) -> int:
+        """本次请求的上下文 token 预算：服务商单独设置优先，否则用会话默认值"""
+        from .config import get_api_by_name
+        try:
+            n = int(getattr(get_api_by_name(provider_name), "context_tokens", 0) or 0)
+            if n <= 0:
+                n = int(get_config().session.context_budget_tokens)
+            return max(0, n)
+        except Exception:
+            return 0
+
     def _build_messages(
         self,
         session: ChatSession,
@@ -402,48 +932,33 @@ class ChatManager:
         active_reply: bool = False,
         active_reply_suffix: Optional[str] = None,
         images: Optional[List[str]] = None,
+        session_config: Optional[Dict[str, Any]] = None,
+        budget: int = 0,
+        stable_prefix: bool = True,
     ) -> List[Dict[str, Any]]:
-        """构建发送给 AI 的消息列表"""
+        """构建发送给 AI 的消息列表（session_config 为已解析的会话配置，缺省时解析 config_json）
 
-        messages: List[Dict[str, Any]] = []
+        按 token 预算装配（budget<=0 表示不限）：人格、输出约束与当前消息必定发送，
+        其余依次放入长期记忆摘要、聊天室记录（保留最新的若干行）、最近对话（从新到旧），
+        放不下的部分丢弃。stable_prefix 决定各部分的排列（见末尾）。
+        """
 
         personas = get_personas()
         persona = personas.get(session.persona_name) or personas.get("default") or next(iter(personas.values()))
         system_prompt = persona.details
 
-        if active_reply and chatroom_history:
-            system_prompt += (
-                "\nYou are now in a chatroom. The chat history is as follows:\n" + chatroom_history
-            )
-
-        try:
-            import json as _json
-            cfg_json = _json.loads(getattr(session, "config_json", "{}") or "{}")
-            summary = cfg_json.get("memory_summary")
-            if summary:
-                system_prompt += "\n\n[长期记忆摘要]\n" + str(summary)
-        except Exception:
-            pass
-        messages.append({"role": "system", "content": system_prompt})
         # 附加严格的输出约束，减少提示词/思考过程外泄
         output_policy = (
             "输出要求：只输出用户可见的最终回复。不要包含你的思考过程、提示词、"
             "人设/系统设定、策略、约束清单、工具调用细节或任何诸如 THOUGHT/Analysis/Plan/CoT/Reasoning 等元标签。"
             "如需使用工具，请直接调用；不要解释调用过程。若无有效内容，尽量简洁回复。"
         )
-        messages.append({"role": "system", "content": output_policy})
 
         _active_reply = bool(active_reply)
         _ar_suffix = (active_reply_suffix or "")
 
-        for msg in history:
-            role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", None)
-            content = msg.get("content") if isinstance(msg, dict) else getattr(msg, "content", "")
-            uname = msg.get("user_name") if isinstance(msg, dict) else getattr(msg, "user_name", None)
-            if session_type == "group" and role == "user" and uname:
-                content = f"{uname}: {content}"
-            messages.append({"role": role, "content": content})
-
+        # 当前消息（必定发送）
+        tail: List[Dict[str, Any]] = []
         current_text = f"{user_name}: {message}" if session_type == "group" else message
         if images:
             parts: List[Dict[str, Any]] = []
@@ -454,17 +969,101 @@ class ChatManager:
                     parts.append({"type": "image_url", "image_url": {"url": uri}})
                 except Exception:
                     pass
-            messages.append({"role": "user", "content": parts})
+            tail.append({"role": "user", "content": parts})
         else:
-            messages.append({"role": "user", "content": current_text})
+            tail.append({"role": "user", "content": current_text})
         if _active_reply and _ar_suffix:
             try:
                 suffix_use = _ar_suffix.replace("{message}", message).replace("{prompt}", message)
             except Exception:
                 suffix_use = _ar_suffix
-            messages.append({"role": "user", "content": suffix_use})
+            tail.append({"role": "user", "content": suffix_use})
+
+        limit = budget if budget > 0 else None
+        used = (
+            message_tokens({"content": system_prompt})
+            + message_tokens({"content": output_policy})
+            + messages_tokens(tail)
+        )
+
+        def _fits(n: int) -> bool:
+            return limit is None or used + n <= limit
 
-        return messages
+        summary_block = ""
+        chatroom_block = ""
+        try:
+            cfg_json = session_config
+            if cfg_json is None:
+                cfg_json = json.loads(getattr(session, "config_json", "{}") or "{}")
+            summary = cfg_json.get("memory_summary")
+            if summary:
+                block = "\n\n[长期记忆摘要]\n" + str(summary)
+                n = estimate_tokens(block) + MESSAGE_OVERHEAD
+                if _fits(n):
+                    summary_block = block
+                    used += n
+        except Exception:
+            pass
+
+        if _active_reply and chatroom_history:
+            head = "\nYou are now in a chatroom. The chat history is as follows:\n"
+            lines: List[str] = []
+            room = used + estimate_tokens(head) + MESSAGE_OVERHEAD
+            for line in reversed(chatroom_history.split(_CHATROOM_SEP)):
+                n = estimate_tokens(line) + 2
+                if limit is not None and room + n > limit:
+                    break
+                lines.append(line)
+                room += n
+            if lines:
+                chatroom_block = head + _CHATROOM_SEP.join(reversed(lines))
+                used = room
+
+        # 最近对话：从新到旧放入，第一条须为 user
+        kept: List[Dict[str, Any]] = []
+        for msg in reversed(history):
+            n = item_tokens(msg)
+            if not _fits(n):
+                break
+            kept.append(msg)
+            used += n
+        kept.reverse()
+        while kept and (kept[0].get("role") if isinstance(kept[0], dict) else getattr(kept[0], "role", None)) != "user":
+            used -= item_tokens(kept.pop(0))
+        if len(kept) < len(history):
+            logger.debug(
+                f"[AI Chat] {session.session_id} 上下文预算 {budget}：历史 {len(kept)}/{len(history)} 条，约 {used} tokens"
+            )
+
+        turns: List[Dict[str, Any]] = []
+        for msg in kept:
+            role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", None)
+            content = msg.get("content") if isinstance(msg, dict) else getattr(msg, "content", "")
+            uname = msg.get("user_name") if isinstance(msg, dict) else getattr(msg, "user_name", None)
+            if session_type == "group" and role == "user" and uname:
+                content = f"{uname}: {content}"
+            turns.append({"role": role, "content": content})
+
+        if not stable_prefix:
+            # 旧布局：摘要与聊天室记录并入人格提示词（首条消息每次都变）
+            messages = [
+                {"role": "system", "content": system_prompt + chatroom_block + summary_block},
+                {"role": "system", "content": output_policy},
+            ]
+            return messages + turns + tail
+
+        # 稳定前缀：人格与输出约束逐字节不变，其后是变化较少的摘要与只追加的历史，
+        # 每次都变的聊天室记录放在当前消息之前，便于服务商的前缀缓存命中
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "system", "content": output_policy},
+        ]
+        if summary_block:
+            messages.append({"role": "system", "content": summary_block.strip()})
+        messages.extend(turns)
+        if chatroom_block:
+            messages.append({"role": "system", "content": chatroom_block.strip()})
+        return messages + tail
 
     # ==================== 长期记忆摘要 ====================
 
@@ -473,47 +1072,127 @@ class ChatManager:
         a = sum(1 for h in history if (h.get("role") if isinstance(h, dict) else getattr(h, "role", "")) == "assistant")
         return min(u, a)
 
-    async def _maybe_update_summary(self, session: ChatSession, history: List[Dict[str, Any]]) -> None:
-        cfg = get_config()
-        mem = getattr(cfg, "memory", None)
+    def _summary_rounds_due(self, history: List[Dict[str, Any]], session_config: Dict[str, Any]) -> int:
+        """需要更新摘要时返回当前轮数，否则返回 0"""
+        mem = getattr(get_config(), "memory", None)
         if not mem or not mem.enable_summarize:
-            return
+            return 0
         rounds = self._count_rounds(history)
         if rounds < int(mem.summarize_min_rounds):
-            return
+            return 0
+        last_rounds = int(session_config.get("summary_rounds", 0) or 0)
+        if rounds - last_rounds < int(mem.summarize_interval_rounds):
+            return 0
+        return rounds
+
+    def _schedule_summary(self, entry: _CachedSession) -> None:
+        """摘要到期时安排（或顺延）该会话的后台摘要任务"""
         try:
-            import json as _json
-            cfg_json = _json.loads(getattr(session, "config_json", "{}") or "{}")
+            if not self._summary_rounds_due(entry.history, entry.config):
+                return
+            delay = max(0.0, float(get_config().memory.summarize_debounce_seconds))
         except Exception:
-            cfg_json = {}
-        last_rounds = int(cfg_json.get("summary_rounds", 0) or 0)
-        if rounds - last_rounds < int(mem.summarize_interval_rounds):
             return
+        sid = entry.session_id
+        self._summary_due[sid] = (time.monotonic() + delay, entry)
+        task = self._summary_tasks.get(sid)
+        if task is None or task.done():
+            task = asyncio.create_task(self._summary_worker(sid))
+            self._summary_tasks[sid] = task
+            _track_bg(task)
+
+    def _summary_semaphore(self) -> asyncio.Semaphore:
         try:
-            max_pairs = max(8, int(get_config().session.max_rounds) * 2)
-            context = []
-            for msg in history[-max_pairs * 2:]:
-                role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", "")
-                content = msg.get("content") if isinstance(msg, dict) else getattr(msg, "content", "")
-                context.append({"role": role, "content": content})
-            sys_prompt = "请用中文将以下对话要点进行简洁摘要，50-150 字，突出人物、事件、事实，不要赘述。"
-            msgs = [{"role": "system", "content": sys_prompt}] + context
-            # 使用该会话服务商进行摘要
-            from .config import get_api_by_name
-            provider_for_session = getattr(session, "provider_name", None)
-            model_s = get_api_by_name(provider_for_session).model or "gpt-4o-mini"
-            temp_s = get_config().session.default_temperature
-            client_s = self._get_client_for(provider_for_session)
-            if not client_s:
-                return
-            resp = await client_s.chat.completions.create(model=model_s, messages=msgs, temperature=temp_s)
-            summary = resp.choices[0].message.content or ""
-            import json as _json2
-            cfg_json["memory_summary"] = summary
-            cfg_json["summary_rounds"] = rounds
-            _track_bg(asyncio.create_task(ChatSession.set_config_json(session_id=session.session_id, data=cfg_json)))
+            size = max(1, int(get_config().memory.summarize_concurrency))
         except Exception:
-            pass
+            size = 2
+        if self._summary_sem is None or size != self._summary_sem_size:
+            self._summary_sem = asyncio.Semaphore(size)
+            self._summary_sem_size = size
+        return self._summary_sem
+
+    async def _summary_worker(self, session_id: str) -> None:
+        try:
+            # 防抖：等待期间有新消息则到期时间顺延
+            while True:
+                due_at, entry = self._summary_due[session_id]
+                delay = due_at - time.monotonic()
+                if delay <= 0:
+                    break
+                await asyncio.sleep(delay)
+            self._summary_due.pop(session_id, None)
+            async with self._summary_semaphore():
+                await self._update_summary(entry)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.debug(f"[AI Chat] {session_id} 生成摘要失败: {e}")
+        finally:
+            self._summary_tasks.pop(session_id, None)
+            # 生成期间又有新的到期请求：重新安排
+            if session_id in self._summary_due and self._summary_tasks.get(session_id) is None:
+                try:
+                    task = asyncio.create_task(self._summary_worker(session_id))
+                    self._summary_tasks[session_id] = task
+                    _track_bg(task)
+                except RuntimeError:
+                    pass
+
+    async def _update_summary(self, entry: _CachedSession) -> None:
+        """为缓存中的会话生成摘要，写入缓存配置并回写数据库
+
+        会话已被淘汰或失效（控制台修改、清空历史等）时放弃，避免覆盖新的配置；
+        下一次回复时若仍到期会重新安排。
+        """
+        if self.cache.peek(entry.session_id) is not entry:
+            return
+        history = list(entry.history)
+        rounds = self._summary_rounds_due(history, entry.config)
+        if not rounds:
+            return
+        mem = get_config().memory
+        max_pairs = max(8, int(get_config().session.max_rounds) * 2)
+        context = []
+        for msg in history[-max_pairs * 2:]:
+            role = msg.get("role") if isinstance(msg, dict) else getattr(msg, "role", "")
+            content = msg.get("content") if isinstance(msg, dict) else getattr(msg, "content", "")
+            context.append({"role": role, "content": content})
+        sys_prompt = "请用中文将以下对话要点进行简洁摘要，50-150 字，突出人物、事件、事实，不要赘述。"
+        msgs = [{"role": "system", "content": sys_prompt}] + context
+        # 摘要服务商：单独配置优先，否则为会话服务商（组内当前最优成员）
+        from .config import get_api_by_name
+        if (mem.summarize_provider or "").strip():
+            provider = (self.providers.rank(get_provider_members(mem.summarize_provider)) or [None])[0]
+        else:
+            provider = (self._provider_candidates(entry.row) or [None])[0]
+        model_s = (mem.summarize_model or "").strip() or get_api_by_name(provider).model or "gpt-4o-mini"
+        temp_s = get_config().session.default_temperature
+        client_s = self._get_client_for(provider)
+        if not client_s:
+            return
+        t0 = time.monotonic()
+        async with self._provider_slot(provider, entry.row):
+            resp = await client_s.chat.completions.create(model=model_s, messages=msgs, temperature=temp_s)
+        summary = resp.choices[0].message.content or ""
+        if self.cache.peek(entry.session_id) is not entry:
+            return
+        # 缓存中的配置原地更新，回写数据库时无需使缓存失效
+        entry.config["memory_summary"] = summary
+        entry.config["summary_rounds"] = rounds
+        await ChatSession.set_config_json(session_id=entry.session_id, data=dict(entry.config), notify=False)
+        logger.debug(f"[AI Chat] {entry.session_id} 摘要已更新（{rounds} 轮，{model_s}，{(time.monotonic() - t0) * 1000:.0f} ms）")
+
+    async def close_summaries(self) -> None:
+        """取消尚未完成的后台摘要（关闭时调用）"""
+        self._summary_due.clear()
+        tasks = list(self._summary_tasks.values())
+        for t in tasks:
+            t.cancel()
+        for t in tasks:
+            try:
+                await t
+            except BaseException:
+                pass
 
     async def _call_ai(
         self,
@@ -524,15 +1203,25 @@ class ChatManager:
         temperature: Optional[float] = None,
         tools: Optional[List[Dict[str, Any]]] = None,
         client: Optional[AsyncOpenAI] = None,
+        usage: Optional[Dict[str, int]] = None,
+        streamer: Optional[ChunkStreamer] = None,
+        provider: Optional[str] = None,
     ) -> str:
-        """调用 OpenAI 聊天接口，包含工具调用处理"""
+        """调用 OpenAI 聊天接口，包含工具调用处理
+
+        usage 不为空时累加接口返回的 token 用量；传入 streamer 时每次请求都以 stream=True
+        发起，文本增量交给 streamer 分段发送。provider 为实际使用的服务商（缺省取会话设置），
+        其请求延迟与失败计入服务商健康度。
+        """
 
         if not client:
             return "AI 未配置或暂不可用"
 
         cfg = get_config()
+        if provider is None:
+            provider = getattr(session, "provider_name", None)
         # Determine capability gating
-        support_tools, _ = self._get_active_api_flags(getattr(session, "provider_name", None))
+        support_tools, _ = self._get_active_api_flags(provider)
         if tools is None:
             if getattr(cfg, "tools", None) and cfg.tools.enabled and support_tools:
                 tools = get_enabled_tools(cfg.tools.builtin_tools)
@@ -540,7 +1229,7 @@ class ChatManager:
                 tools = None
         if model is None:
             from .config import get_api_by_name
-            model = get_api_by_name(getattr(session, "provider_name", None)).model or "gpt-4o-mini"
+            model = get_api_by_name(provider).model or "gpt-4o-mini"
         if temperature is None:
             temperature = cfg.session.default_temperature
 
@@ -548,7 +1237,7 @@ class ChatManager:
         _kwargs: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
         if tools and getattr(cfg, "tools", None) and cfg.tools.enabled and support_tools:
             _kwargs["tools"] = tools
-        current_response = await client.chat.completions.create(**_kwargs)
+        content, tool_calls = await self._complete(client, _kwargs, usage, streamer, provider, session)
 
         max_iterations = (
             cfg.tools.max_iterations
@@ -557,21 +1246,22 @@ class ChatManager:
         )
         iteration = 0
         while iteration < max_iterations:
-            choice = current_response.choices[0]
-            tool_calls = choice.message.tool_calls or []
             if not tool_calls:
                 break
+            if streamer is not None:
+                # 工具调用前的文本单独成段发出，不与工具返回后的回答连在一起
+                await streamer.finish()
             messages.append(
                 {
                     "role": "assistant",
-                    "content": choice.message.content or "",
+                    "content": content or "",
                     "tool_calls": [
                         {
-                            "id": tc.id,
+                            "id": tc["id"],
                             "type": "function",
                             "function": {
-                                "name": tc.function.name,
-                                "arguments": tc.function.arguments,
+                                "name": tc["name"],
+                                "arguments": tc["arguments"],
                             },
                         }
                         for tc in tool_calls
@@ -582,25 +1272,194 @@ class ChatManager:
             tasks = []
             for tc in tool_calls:
                 try:
-                    args = json.loads(tc.function.arguments or "{}")
+                    args = json.loads(tc["arguments"] or "{}")
                 except Exception:
                     args = {}
-                tasks.append(execute_tool(tc.function.name, args))
+                tasks.append(execute_tool(tc["name"], args))
             results = []
             if tasks:
                 results = await asyncio.gather(*tasks, return_exceptions=True)
             for tc, res in zip(tool_calls, results or []):
-                content = str(res) if not isinstance(res, Exception) else f"工具执行异常: {res}"
-                messages.append({"role": "tool", "tool_call_id": tc.id, "content": content})
+                result_text = str(res) if not isinstance(res, Exception) else f"工具执行异常: {res}"
+                messages.append({"role": "tool", "tool_call_id": tc["id"], "content": result_text})
 
             _kwargs2: Dict[str, Any] = {"model": model, "messages": messages, "temperature": temperature}
             if tools and getattr(cfg, "tools", None) and cfg.tools.enabled and support_tools:
                 _kwargs2["tools"] = tools
-            current_response = await client.chat.completions.create(**_kwargs2)
+            content, tool_calls = await self._complete(client, _kwargs2, usage, streamer, provider, session)
 
             iteration += 1
 
-        return current_response.choices[0].message.content or ""
+        if streamer is not None:
+            await streamer.finish()
+        return content or ""
+
+    async def _complete(
+        self,
+        client: AsyncOpenAI,
+        kwargs: Dict[str, Any],
+        usage: Optional[Dict[str, int]],
+        streamer: Optional[ChunkStreamer],
+        provider: Optional[str] = None,
+        session: Any = None,
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        """发起一次补全请求，返回 (文本, 工具调用列表)；传入 streamer 时流式接收并分段发送文本
+
+        请求在 provider 的并发名额内进行（排队满或超时抛出 QueueFull）；延迟（流式为首个增量
+        到达的时间，不含排队）与失败计入 provider 的健康度，请求参数错误不计。
+        """
+        async with self._provider_slot(provider, session):
+            return await self._complete_now(client, kwargs, usage, streamer, provider)
+
+    async def _complete_now(
+        self,
+        client: AsyncOpenAI,
+        kwargs: Dict[str, Any],
+        usage: Optional[Dict[str, int]],
+        streamer: Optional[ChunkStreamer],
+        provider: Optional[str],
+    ) -> Tuple[str, List[Dict[str, str]]]:
+        t0 = time.monotonic()
+        first: Optional[float] = None
+        try:
+            if streamer is None:
+                resp = await client.chat.completions.create(**kwargs)
+                _add_usage(usage, resp)
+                msg = resp.choices[0].message
+                calls = [
+                    {"id": tc.id, "name": tc.function.name, "arguments": tc.function.arguments or ""}
+                    for tc in (msg.tool_calls or [])
+                ]
+                result: Tuple[str, List[Dict[str, str]]] = (msg.content or "", calls)
+            else:
+                parts: List[str] = []
+                slots: Dict[int, Dict[str, str]] = {}
+                reported = False
+                # 流式接口默认不返回 usage，需显式请求（最后一个分片携带）
+                stream = await client.chat.completions.create(
+                    **kwargs, stream=True, stream_options={"include_usage": True}
+                )
+                async for chunk in stream:
+                    if first is None:
+                        first = time.monotonic()
+                    if getattr(chunk, "usage", None) is not None:
+                        reported = True
+                        _add_usage(usage, chunk)
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta is None:
+                        continue
+                    if delta.content:
+                        parts.append(delta.content)
+                        await streamer.feed(delta.content)
+                    # 工具调用按 index 分片到达：id/名称出现一次，参数逐段拼接
+                    for tc in delta.tool_calls or []:
+                        slot = slots.setdefault(int(tc.index or 0), {"id": "", "name": "", "arguments": ""})
+                        if tc.id:
+                            slot["id"] = tc.id
+                        fn = tc.function
+                        if fn is not None:
+                            if fn.name:
+                                slot["name"] = slot["name"] or fn.name
+                            if fn.arguments:
+                                slot["arguments"] += fn.arguments
+                result = ("".join(parts), [slots[k] for k in sorted(slots)])
+                if not reported and usage is not None:
+                    # 服务商不支持 include_usage：用本地估算补齐，并记录估算的请求数
+                    calls_text = "".join(c["name"] + c["arguments"] for c in result[1])
+                    usage["prompt_tokens"] = usage.get("prompt_tokens", 0) + messages_tokens(
+                        kwargs.get("messages") or []
+                    )
+                    usage["completion_tokens"] = usage.get("completion_tokens", 0) + estimate_tokens(
+                        result[0] + calls_text
+                    )
+                    usage["estimated"] = usage.get("estimated", 0) + 1
+        except BadRequestError:
+            raise
+        except Exception as e:
+            if provider:
+                self.providers.record_failure(provider, e, time.monotonic() - t0)
+            raise
+        if provider:
+            self.providers.record_success(provider, (first or time.monotonic()) - t0)
+        return result
+
+    async def _call_with_failover(
+        self,
+        session: ChatSession,
+        messages: List[Dict[str, Any]],
+        candidates: List[str],
+        *,
+        model: Optional[str],
+        temperature: Optional[float],
+        tools: Optional[List[Dict[str, Any]]],
+        usage: Optional[Dict[str, int]],
+        streamer: Optional[ChunkStreamer],
+    ) -> Tuple[str, str]:
+        """按候选顺序调用，出错或超时时切换到下一个服务商；返回 (回复, 实际服务商)
+
+        流式输出已发出内容后不再切换（避免重复回复）；请求参数错误直接抛出；
+        所有成员都排队已满时抛出 QueueFull。
+        """
+        last_exc: Optional[BaseException] = None
+        for name in candidates:
+            client = self._get_client_for(name)
+            if client is None:
+                continue
+            try:
+                text = await self._call_ai(
+                    session,
+                    list(messages),
+                    model=model,
+                    temperature=temperature,
+                    tools=tools,
+                    client=client,
+                    usage=usage,
+                    streamer=streamer,
+                    provider=name,
+                )
+                return text, name
+            except BadRequestError:
+                raise
+            except QueueFull as e:
+                # 该成员繁忙：不计入健康度，直接尝试下一个
+                if streamer is not None:
+                    if streamer.sent:
+                        raise
+                    streamer.discard()
+                last_exc = e
+                continue
+            except Exception as e:
+                if streamer is not None:
+                    if streamer.sent:
+                        raise
+                    # 未达到发送字数的半截回复不能拼到下一个服务商的回复前面
+                    streamer.discard()
+                last_exc = e
+                if name != candidates[-1]:
+                    logger.warning(f"[AI Chat] 服务商 {name} 调用失败，切换到下一个: {e}")
+        if last_exc is not None:
+            raise last_exc
+        return "AI 未配置或暂不可用", ""
+
+    async def _stream_tts(
+        self,
+        session_id: str,
+        text: str,
+        on_voice: Optional[Callable[[str], Awaitable[None]]],
+    ) -> Tuple[Optional[str], bool]:
+        """用流式首段生成语音并尽快发送；返回 (语音路径, 是否已发送)"""
+        from .tts import run_tts
+
+        path = await run_tts(session_id=session_id, text=text, manager=self)
+        if path and on_voice is not None:
+            try:
+                await on_voice(str(path))
+                return path, True
+            except Exception as e:
+                logger.debug(f"[AI Chat] 发送首段语音失败: {e}")
+        return path, False
 
     # ==================== 输出多模态处理 ====================
 
@@ -689,35 +1548,25 @@ class ChatManager:
         except Exception:
             return text
 
-    async def _save_conversation(
-        self,
-        session_id: str,
-        user_name: str,
-        message: str,
-        response: str,
-        max_history: int,
-    ) -> None:
-        """异步保存对话历史（仅维护会话 JSON 历史）"""
+    # ==================== 管理接口 ====================
 
-        try:
-            lock = self._history_locks.setdefault(session_id, asyncio.Lock())
-            async with lock:
-                now = datetime.now().isoformat()
-                items = [
-                    {"role": "user", "content": message, "user_name": user_name, "created_at": now},
-                    {"role": "assistant", "content": response, "created_at": now},
-                ]
-                _ = await ChatSession.append_history_items(
-                    session_id=session_id, items=items, max_history=max_history
-                )
-        except Exception as e:
-            logger.error(f"[AI Chat] 保存对话失败: {e}")
+    def capture_passive(self, session_id: str, user_name: str, text: str) -> None:
+        """旁听群消息：未 @ 机器人的群消息只写入聊天室记录，不进入 AI 流程
 
-    # ==================== 管理接口 ====================
+        开启 session.chatroom_passive_capture 时由消息入口调用；仅写内存，不读数据库。
+        已缓存且关闭了 AI 的会话不记录。
+        """
+        if not text:
+            return
+        entry = self.cache.peek(session_id)
+        if entry is not None and not entry.row.is_active:
+            return
+        self.ltm.record_user(session_id, user_name, text)
 
     async def clear_history(self, session_id: str):
         """清空会话历史"""
 
+        self.cache.drop(session_id)
         await ChatSession.clear_history_json(session_id=session_id)
         try:
             _ = self.ltm.clear(session_id)
@@ -740,13 +1589,51 @@ class ChatManager:
     async def get_session_info(self, session_id: str) -> Optional[ChatSession]:
         """获取会话信息"""
 
+        await self.cache.flush_session(session_id)
         return await ChatSession.get_by_session_id(session_id=session_id)
 
+    def _record_prompt_usage(self, layout: str, usage: Dict[str, int]) -> None:
+        st = self.prompt_stats.setdefault(
+            layout, {"requests": 0, "reported": 0, "prompt_tokens": 0, "cached_tokens": 0}
+        )
+        st["requests"] += 1
+        if "prompt_tokens" in usage and not usage.get("estimated"):
+            # 只统计接口返回了用量的请求（不含本地估算），命中率才可比
+            st["reported"] += 1
+            st["prompt_tokens"] += int(usage["prompt_tokens"])
+            st["cached_tokens"] += int(usage.get("cached_tokens", 0))
+
+    def stats(self) -> Dict[str, Any]:
+        """会话缓存、提示词前缀缓存、聊天室记录与突发合并的运行统计"""
+        layouts: Dict[str, Any] = {}
+        for layout, st in self.prompt_stats.items():
+            pt = st["prompt_tokens"]
+            layouts[layout] = dict(st, hit_rate=(round(st["cached_tokens"] / pt, 4) if pt else None))
+        return {
+            "session_cache": self.cache.stats(),
+            "prompt_cache": layouts,
+            "stable_prefix": bool(getattr(get_config().session, "stable_prefix", True)),
+            "chatroom": self.ltm.stats(),
+            "coalesce": dict(self.coalesce_stats),
+        }
+
 
 # ==================== 全局实例 ====================
 
 chat_manager = ChatManager()
 
 
+# 关闭时写入缓存中尚未落库的对话历史
+try:
+    from nonebot import get_driver
+
+    @get_driver().on_shutdown
+    async def _flush_session_cache() -> None:
+        await chat_manager.close_summaries()
+        await chat_manager.cache.close()
+except Exception as e:
+    logger.debug(f"[AI Chat] 注册会话缓存关闭钩子失败: {e}")
+
+
 
 
@@ -1,17 +1,226 @@
 """AI 对话数据模型（移除好感度）
 
-仅包含 ChatSession 表与相关便捷方法。
+ChatSession 会话表与 ChatMessage 历史消息表，以及相关便捷方法。
 """
 from __future__ import annotations
 
+import asyncio
+import json
 from datetime import datetime
-from typing import Optional, List, Dict, Any
+from typing import Callable, Optional, List, Dict, Any, Set, Tuple
 
+from nonebot.log import logger
+from sqlalchemy import Index, delete, event, insert, text, update
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
 from sqlmodel import Field, select
-from sqlalchemy import or_
+from sqlalchemy import and_, func, or_
 
-from ...db.base_models import BaseIDModel, with_session
+from ...db.base_models import BaseIDModel, decode_cursor, encode_cursor, with_session
+from ...db.change_feed import record_change
+from .search import ChatSearchIndex, message_text
+from .tokens import message_tokens
+
+
+# ==================== 会话缓存失效通知 ====================
+#
+# ChatManager 在内存中缓存热点会话；控制台/命令对会话的修改在事务提交后
+# 通过这里通知其丢弃缓存（回滚则不通知）。session_id 为 None 表示全部失效。
+
+_INVALIDATE_KEY = "ai_chat_invalidate"
+_invalidate_listeners: List[Callable[[Optional[str]], None]] = []
+
+
+def add_invalidate_listener(fn: Callable[[Optional[str]], None]) -> None:
+    if fn not in _invalidate_listeners:
+        _invalidate_listeners.append(fn)
+
+
+def _mark_invalid(session: AsyncSession, session_id: Optional[str]) -> None:
+    if not _invalidate_listeners:
+        return
+    pending: Set[Optional[str]] = session.info.setdefault(_INVALIDATE_KEY, set())
+    pending.add(session_id)
+
+
+@event.listens_for(Session, "after_commit")
+def _fire_invalidations(session: Session) -> None:
+    pending = session.info.pop(_INVALIDATE_KEY, None)
+    if not pending:
+        return
+    for sid in pending:
+        for fn in list(_invalidate_listeners):
+            try:
+                fn(sid)
+            except Exception as e:
+                logger.debug(f"[AI Chat] 会话缓存失效回调异常: {e}")
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_invalidations(session: Session, previous_transaction: Any) -> None:
+    session.info.pop(_INVALIDATE_KEY, None)
+
+
+# ==================== 历史消息表 ====================
+#
+# 每条历史一行，按 (session_id, seq) 建唯一索引：追加是 INSERT，按 max_history
+# 裁剪是一次区间 DELETE，读取最近 N 条是带 LIMIT 的索引倒序扫描。
+# 同一会话的 seq 连续递增（只从头部裁剪，覆盖时重新编号）。
+
+# 条目中直接落到列上的字段，其余字段（含多模态 content 列表）存入 extra_json
+_ITEM_COLS = ("role", "content", "user_name", "created_at", "token_count")
+
+_migrated = False
+_migrate_lock = asyncio.Lock()
+
+
+class ChatMessage(BaseIDModel, table=True):
+    """AI 对话历史消息（追加写入）"""
+
+    __tablename__ = "ai_chat_messages"
+    __table_args__ = (Index("ix_ai_chat_messages_session_seq", "session_id", "seq", unique=True),)
+
+    session_id: str = Field(description="会话唯一标识")
+    seq: int = Field(description="会话内递增序号")
+    role: str = Field(default="", description="角色: user | assistant | ...")
+    user_name: Optional[str] = Field(default=None, description="发言者昵称")
+    content: str = Field(default="", description="消息文本（全文索引内容）")
+    extra_json: Optional[str] = Field(default=None, description="其余字段（JSON）")
+    created_at: str = Field(default="", description="消息时间")
+    token_count: Optional[int] = Field(default=None, description="消息 token 数（估算）")
+
+    @staticmethod
+    def row_from_item(session_id: str, seq: int, item: Any) -> Dict[str, Any]:
+        d = item if isinstance(item, dict) else {"content": item}
+        content = d.get("content")
+        extra = {k: v for k, v in d.items() if k not in _ITEM_COLS}
+        if content is not None and not isinstance(content, str):
+            extra["content"] = content
+        return {
+            "session_id": session_id,
+            "seq": seq,
+            "role": str(d.get("role") or ""),
+            "user_name": (str(d["user_name"]) if d.get("user_name") is not None else None),
+            "content": content if isinstance(content, str) else message_text(d),
+            "extra_json": json.dumps(extra, ensure_ascii=False) if extra else None,
+            "created_at": str(d.get("created_at") or ""),
+            # 按内容重新估算，避免控制台改写内容后沿用旧值
+            "token_count": message_tokens(d),
+        }
+
+    def to_item(self) -> Dict[str, Any]:
+        """还原为历史条目 dict（与旧 history_json 中的格式一致）"""
+        item: Dict[str, Any] = {"role": self.role, "content": self.content}
+        if self.user_name is not None:
+            item["user_name"] = self.user_name
+        if self.created_at:
+            item["created_at"] = self.created_at
+        if self.token_count is not None:
+            item["token_count"] = self.token_count
+        if self.extra_json:
+            try:
+                extra = json.loads(self.extra_json)
+                if isinstance(extra, dict):
+                    item.update(extra)
+            except Exception:
+                pass
+        return item
+
+    @classmethod
+    @with_session
+    async def last_seq(cls, session: AsyncSession, session_id: str) -> int:
+        """会话最大序号；没有消息时返回 -1"""
+        rs = await session.execute(select(func.max(cls.seq)).where(cls.session_id == session_id))
+        v = rs.scalar()
+        return int(v) if v is not None else -1
+
+    @classmethod
+    @with_session
+    async def recent(cls, session: AsyncSession, session_id: str, limit: int = 0) -> List[Dict[str, Any]]:
+        """按时间顺序返回最近 limit 条（limit<=0 表示全部）"""
+        stmt = select(cls).where(cls.session_id == session_id).order_by(cls.seq.desc())  # type: ignore[attr-defined]
+        if limit and limit > 0:
+            stmt = stmt.limit(int(limit))
+        rows = (await session.execute(stmt)).scalars().all()
+        return [r.to_item() for r in reversed(rows)]
+
+    @classmethod
+    @with_session
+    async def append(
+        cls, session: AsyncSession, session_id: str, items: List[Any], max_history: int = 0
+    ) -> int:
+        """追加若干条并按 max_history 裁掉最旧的；返回写入条数"""
+        if not items:
+            return 0
+        last = await cls.last_seq(session=session, session_id=session_id)
+        rows = [cls.row_from_item(session_id, last + 1 + i, it) for i, it in enumerate(items)]
+        await session.execute(insert(cls), rows)
+        last += len(rows)
+        if max_history > 0 and last + 1 > max_history:
+            await session.execute(
+                delete(cls).where(cls.session_id == session_id, cls.seq <= last - max_history)  # type: ignore[operator]
+            )
+        return len(rows)
+
+    @classmethod
+    @with_session
+    async def replace(cls, session: AsyncSession, session_id: str, items: List[Any]) -> None:
+        """覆盖会话全部历史（重新从 0 编号）"""
+        await session.execute(delete(cls).where(cls.session_id == session_id))
+        if items:
+            await session.execute(
+                insert(cls), [cls.row_from_item(session_id, i, it) for i, it in enumerate(items)]
+            )
+
+    @classmethod
+    async def ensure_migrated(cls) -> None:
+        """一次性把旧版 ai_chat_sessions.history_json 迁移到消息表。须在调用方开启写事务之前调用。"""
+        global _migrated
+        if _migrated:
+            return
+        async with _migrate_lock:
+            if _migrated:
+                return
+            try:
+                n = await cls._migrate_json()
+                if n:
+                    logger.info(f"[AI Chat] 已将 {n} 个会话的历史迁移到 ai_chat_messages")
+            except Exception as e:
+                logger.warning(f"[AI Chat] 迁移会话历史失败: {e}")
+            _migrated = True
+
+    @classmethod
+    @with_session
+    async def _migrate_json(cls, session: AsyncSession) -> int:
+        cols = [row[1] for row in (await session.execute(text("PRAGMA table_info(ai_chat_sessions)"))).fetchall()]
+        if "history_json" not in cols:
+            return 0
+        rs = await session.execute(
+            text(
+                "SELECT session_id, history_json FROM ai_chat_sessions "
+                "WHERE history_json IS NOT NULL AND history_json NOT IN ('', '[]')"
+            )
+        )
+        count = 0
+        for sid, raw in rs.fetchall():
+            try:
+                items = json.loads(raw or "[]")
+            except Exception:
+                items = []
+            # 已有消息的会话视为迁移过（例如上次迁移后旧列未能清空）
+            if isinstance(items, list) and items and await cls.last_seq(session=session, session_id=sid) < 0:
+                await cls.replace(session=session, session_id=sid, items=items)
+                count += 1
+            await session.execute(
+                text("UPDATE ai_chat_sessions SET history_json = '[]' WHERE session_id = :sid"), {"sid": sid}
+            )
+        return count
+
+
+async def _ensure_history_store() -> None:
+    """写历史之前：完成旧数据迁移与全文索引建表（SQLite 单写者，须在开启写事务前完成）"""
+    await ChatMessage.ensure_migrated()
+    await ChatSearchIndex.ensure()
 
 
 class ChatSession(BaseIDModel, table=True):
@@ -26,19 +235,35 @@ class ChatSession(BaseIDModel, table=True):
     user_id: Optional[str] = Field(default=None, description="用户 QQ（私聊会话）")
 
     # 服务商（每会话可独立设置；为空时使用配置的默认服务商）
-    provider_name: Optional[str] = Field(default=None, description="本会话使用的服务商名称")
+    provider_name: Optional[str] = Field(default=None, index=True, description="本会话使用的服务商名称")
 
     # 配置（直接存储，无外键）
-    persona_name: str = Field(default="default", description="人格名称")
+    persona_name: str = Field(default="default", index=True, description="人格名称")
     max_history: int = Field(default=20, description="最大历史记录条数")
     config_json: str = Field(default="{}", description="其他配置（JSON）")
-    # 会话级历史：存最近对话条目，减少查询次数
-    history_json: str = Field(default="[]", description="会话历史 JSON")
+    # 旧版会话历史 JSON：历史已改存 ai_chat_messages，仅保留用于迁移
+    history_json: str = Field(default="[]", description="旧版会话历史 JSON（已迁移）")
 
     # 状态
     is_active: bool = Field(default=True, description="是否启用")
     created_at: str = Field(default_factory=lambda: datetime.now().isoformat(), description="创建时间")
-    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat(), description="更新时间")
+    updated_at: str = Field(default_factory=lambda: datetime.now().isoformat(), index=True, description="更新时间")
+
+    def to_summary(self) -> Dict[str, Any]:
+        """控制台列表与变更事件使用的会话概要（不含历史与配置 JSON）。"""
+        return {
+            "id": self.id,
+            "session_id": self.session_id,
+            "session_type": self.session_type,
+            "group_id": self.group_id,
+            "user_id": self.user_id,
+            "provider_name": getattr(self, "provider_name", None),
+            "persona_name": self.persona_name,
+            "max_history": self.max_history,
+            "is_active": self.is_active,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
 
     # ==================== 数据库操作方法 ====================
 
@@ -83,6 +308,7 @@ class ChatSession(BaseIDModel, table=True):
         session.add(chat_session)
         await session.flush()
         await session.refresh(chat_session)
+        record_change(session, "session", "upsert", session_id, chat_session.to_summary())
         return chat_session
 
     @classmethod
@@ -99,6 +325,8 @@ class ChatSession(BaseIDModel, table=True):
             chat_session.updated_at = datetime.now().isoformat()
             session.add(chat_session)
             await session.flush()
+            _mark_invalid(session, session_id)
+            record_change(session, "session", "upsert", session_id, chat_session.to_summary())
             return True
         return False
 
@@ -116,6 +344,8 @@ class ChatSession(BaseIDModel, table=True):
             chat_session.updated_at = datetime.now().isoformat()
             session.add(chat_session)
             await session.flush()
+            _mark_invalid(session, session_id)
+            record_change(session, "session", "upsert", session_id, chat_session.to_summary())
             return True
         return False
 
@@ -157,33 +387,27 @@ class ChatSession(BaseIDModel, table=True):
 
     @classmethod
     @with_session
-    async def get_history_list(cls, session: AsyncSession, session_id: str) -> List[Dict]:
-        """读取会话 history_json 列为列表"""
-        row = await cls.get_by_session_id(session=session, session_id=session_id)
-        if not row:
-            return []
-        try:
-            import json
-            data = json.loads(row.history_json or "[]")
-            return data if isinstance(data, list) else []
-        except Exception:
-            return []
+    async def get_history_list(cls, session: AsyncSession, session_id: str, limit: int = 0) -> List[Dict]:
+        """读取会话历史（按时间顺序；limit>0 时只取最近 limit 条）"""
+        await ChatMessage.ensure_migrated()
+        return await ChatMessage.recent(session=session, session_id=session_id, limit=limit)
 
     @classmethod
     @with_session
     async def set_history_list(
         cls, session: AsyncSession, session_id: str, history: List[Dict]
     ) -> bool:
-        """覆盖会话 history_json"""
+        """覆盖会话历史"""
+        await _ensure_history_store()
         row = await cls.get_by_session_id(session=session, session_id=session_id)
         if not row:
             return False
         try:
-            import json
-            row.history_json = json.dumps(history, ensure_ascii=False)
+            await ChatMessage.replace(session=session, session_id=session_id, items=history)
             row.updated_at = datetime.now().isoformat()
             session.add(row)
             await session.flush()
+            _mark_invalid(session, session_id)
             return True
         except Exception:
             return False
@@ -207,6 +431,8 @@ class ChatSession(BaseIDModel, table=True):
         row.updated_at = datetime.now().isoformat()
         session.add(row)
         await session.flush()
+        record_change(session, "session", "upsert", session_id, row.to_summary())
+        _mark_invalid(session, session_id)
         return True
 
     @classmethod
@@ -220,6 +446,9 @@ class ChatSession(BaseIDModel, table=True):
         except Exception:
             pass
         from sqlalchemy import update as sa_update
+        # 批量修改：通知控制台整体刷新会话列表
+        record_change(session, "session", "resync", None)
+        _mark_invalid(session, None)
         try:
             await session.execute(
                 sa_update(cls).values(provider_name=(provider_name or None), updated_at=datetime.now().isoformat())
@@ -250,42 +479,31 @@ class ChatSession(BaseIDModel, table=True):
         session_id: str,
         items: List[Dict],
         max_history: int,
-    ) -> List[Dict]:
-        """追加若干历史项，并按 max_history 裁剪，返回最新列表"""
-        row = await cls.get_by_session_id(session=session, session_id=session_id)
-        if not row:
-            return []
-        try:
-            import json
-            try:
-                lst = json.loads(row.history_json or "[]")
-                if not isinstance(lst, list):
-                    lst = []
-            except Exception:
-                lst = []
-            lst.extend(items)
-            if max_history > 0 and len(lst) > max_history:
-                lst = lst[-max_history:]
-            row.history_json = json.dumps(lst, ensure_ascii=False)
-            row.updated_at = datetime.now().isoformat()
-            session.add(row)
-            await session.flush()
-            await session.refresh(row)
-            return lst
-        except Exception:
-            return []
+    ) -> int:
+        """追加若干历史项，并按 max_history 裁剪最旧条目；返回写入条数（会话不存在时为 0）"""
+        await _ensure_history_store()
+        rs = await session.execute(
+            update(cls).where(cls.session_id == session_id).values(updated_at=datetime.now().isoformat())
+        )
+        if not rs.rowcount:
+            return 0
+        return await ChatMessage.append(
+            session=session, session_id=session_id, items=items, max_history=max_history
+        )
 
     @classmethod
     @with_session
     async def clear_history_json(cls, session: AsyncSession, session_id: str) -> bool:
-        """清空会话 JSON 历史"""
+        """清空会话历史"""
+        await _ensure_history_store()
         row = await cls.get_by_session_id(session=session, session_id=session_id)
         if not row:
             return False
-        row.history_json = "[]"
+        await ChatMessage.replace(session=session, session_id=session_id, items=[])
         row.updated_at = datetime.now().isoformat()
         session.add(row)
         await session.flush()
+        _mark_invalid(session, session_id)
         return True
 
     # ==================== 会话配置 JSON 维护 ====================
@@ -305,7 +523,10 @@ class ChatSession(BaseIDModel, table=True):
 
     @classmethod
     @with_session
-    async def set_config_json(cls, session: AsyncSession, session_id: str, data: Dict) -> bool:
+    async def set_config_json(
+        cls, session: AsyncSession, session_id: str, data: Dict, notify: bool = True
+    ) -> bool:
+        """覆盖 config_json；notify=False 用于 ChatManager 回写自身缓存中已更新的配置。"""
         row = await cls.get_by_session_id(session=session, session_id=session_id)
         if not row:
             return False
@@ -315,6 +536,8 @@ class ChatSession(BaseIDModel, table=True):
             row.updated_at = datetime.now().isoformat()
             session.add(row)
             await session.flush()
+            if notify:
+                _mark_invalid(session, session_id)
             return True
         except Exception:
             return False
@@ -379,6 +602,8 @@ class ChatSession(BaseIDModel, table=True):
         row.updated_at = datetime.now().isoformat()
         session.add(row)
         await session.flush()
+        record_change(session, "session", "upsert", session_id, row.to_summary())
+        _mark_invalid(session, session_id)
         return True
 
     @classmethod
@@ -400,7 +625,7 @@ class ChatSession(BaseIDModel, table=True):
         session_id: str,
         raw: Any,
     ) -> bool:
-        """从任意原始对象/字符串解析并保存 history_json。非法时报 ValueError。"""
+        """从任意原始对象/字符串解析并覆盖会话历史。非法时报 ValueError。"""
         import json
         data = raw
         if isinstance(raw, str):
@@ -441,16 +666,20 @@ class ChatSession(BaseIDModel, table=True):
         session: AsyncSession,
         keyword: Optional[str] = None,
     ) -> List["ChatSession"]:
-        """按关键字查询会话（匹配 session_id / group_id / user_id），为空则返回全部。
-
-        为了兼容现有控制台的筛选逻辑，这里只做关键字过滤，其他筛选在前端处理。
-        """
+        """按关键字查询会话（全文索引匹配会话元数据，不可用时退回 LIKE），为空则返回全部。"""
         kw = (keyword or "").strip()
         if not kw:
             # 直接返回全部
             result = await session.execute(select(cls))
             return result.scalars().all()
 
+        pks = await ChatSearchIndex.match_sessions(session=session, q=kw)
+        if pks is not None:
+            if not pks:
+                return []
+            result = await session.execute(select(cls).where(cls.id.in_(pks)))  # type: ignore[attr-defined]
+            return result.scalars().all()
+
         like = f"%{kw}%"
         stmt = select(cls).where(
             or_(
@@ -461,3 +690,80 @@ class ChatSession(BaseIDModel, table=True):
         )
         result = await session.execute(stmt)
         return result.scalars().all()
+
+    @classmethod
+    @with_session
+    async def page_sessions(
+        cls,
+        session: AsyncSession,
+        *,
+        keyword: Optional[str] = None,
+        session_type: Optional[str] = None,
+        provider: Optional[str] = None,
+        persona: Optional[str] = None,
+        active: Optional[bool] = None,
+        sort: str = "updated_at",
+        order: str = "desc",
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List["ChatSession"], Optional[str], int]:
+        """控制台会话列表：服务端筛选 + 游标分页，返回 (本页, 下一页游标, 总数)。
+
+        排序键为 (sort 列, id)；provider 传空字符串表示“使用默认服务商”的会话。
+        """
+        conds: List[Any] = []
+        kw = (keyword or "").strip()
+        pks = await ChatSearchIndex.match_sessions(session=session, q=kw) if kw else None
+        if pks is not None:
+            conds.append(cls.id.in_(pks))  # type: ignore[attr-defined]
+        elif kw:
+            like = f"%{kw}%"
+            conds.append(
+                or_(
+                    cls.session_id.like(like),  # type: ignore[attr-defined]
+                    cls.group_id.like(like),    # type: ignore[attr-defined]
+                    cls.user_id.like(like),     # type: ignore[attr-defined]
+                )
+            )
+        if session_type:
+            conds.append(cls.session_type == session_type)
+        if provider is not None:
+            if provider == "":
+                conds.append(or_(cls.provider_name.is_(None), cls.provider_name == ""))  # type: ignore[union-attr]
+            else:
+                conds.append(cls.provider_name == provider)
+        if persona:
+            conds.append(cls.persona_name == persona)
+        if active is not None:
+            conds.append(cls.is_active == active)  # noqa: E712
+
+        total_stmt = select(func.count()).select_from(cls)
+        if conds:
+            total_stmt = total_stmt.where(*conds)
+        total = int((await session.execute(total_stmt)).scalar() or 0)
+
+        sort_key = sort if sort in {"updated_at", "created_at", "id"} else "updated_at"
+        col = getattr(cls, sort_key)
+        desc = str(order).lower() != "asc"
+        stmt = select(cls)
+        if conds:
+            stmt = stmt.where(*conds)
+        key = decode_cursor(cursor)
+        if key and len(key) == 2:
+            kval, kid = key[0], int(key[1])
+            if desc:
+                stmt = stmt.where(or_(col < kval, and_(col == kval, cls.id < kid)))  # type: ignore[operator]
+            else:
+                stmt = stmt.where(or_(col > kval, and_(col == kval, cls.id > kid)))  # type: ignore[operator]
+        if desc:
+            stmt = stmt.order_by(col.desc(), cls.id.desc())  # type: ignore[attr-defined]
+        else:
+            stmt = stmt.order_by(col.asc(), cls.id.asc())  # type: ignore[attr-defined]
+        size = max(1, min(int(limit), 500))
+        rows = (await session.execute(stmt.limit(size + 1))).scalars().all()
+        next_cursor = None
+        if len(rows) > size:
+            rows = rows[:size]
+            last = rows[-1]
+            next_cursor = encode_cursor([getattr(last, sort_key), last.id])
+        return list(rows), next_cursor, total
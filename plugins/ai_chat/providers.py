@@ -0,0 +1,128 @@
+"""服务商池：健康度跟踪、故障转移与按延迟选路
+
+- 会话的 provider_name 可以是单个服务商，也可以是 ``provider_groups`` 中的组名
+  （由 config.get_provider_members 展开）；
+- 每个服务商记录请求延迟与错误率的指数滑动平均（EWMA），以及连续失败次数；
+- 组内按得分（延迟 × (1 + 错误惩罚)）从优到劣尝试，连续失败达到阈值的成员冷却一段时间，
+  冷却期内排到最后（仍作为兜底）；
+- 没有样本的成员得分为 0，会被优先尝试一次以获得样本；
+- 每个服务商另有一个 FairLimiter（见 limiter.py）限制并发并公平排队。
+"""
+from __future__ import annotations
+
+import time
+from typing import Any, Dict, List, Optional
+
+from .limiter import FairLimiter
+
+_ALPHA = 0.3
+# 错误率对得分的放大系数：错误率 50% 时得分约为 6 倍延迟
+_ERROR_PENALTY = 10.0
+_FAIL_THRESHOLD = 3
+_COOLDOWN_SECONDS = 60.0
+
+
+class ProviderHealth:
+    __slots__ = (
+        "name",
+        "latency_ewma",
+        "error_ewma",
+        "requests",
+        "failures",
+        "consecutive_failures",
+        "cooldown_until",
+        "last_error",
+        "last_used",
+    )
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.requests = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.cooldown_until = 0.0
+        self.last_error: Optional[str] = None
+        self.last_used: Optional[float] = None
+
+    def cooling(self, now: Optional[float] = None) -> bool:
+        return (now if now is not None else time.monotonic()) < self.cooldown_until
+
+    def score(self) -> float:
+        if self.latency_ewma is None:
+            return 0.0
+        return self.latency_ewma * (1.0 + _ERROR_PENALTY * self.error_ewma)
+
+    def to_dict(self) -> Dict[str, Any]:
+        remaining = self.cooldown_until - time.monotonic()
+        return {
+            "latency_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_ewma, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "cooldown_seconds": round(remaining, 1) if remaining > 0 else 0,
+            "last_error": self.last_error,
+        }
+
+
+class ProviderPool:
+    def __init__(self) -> None:
+        self._health: Dict[str, ProviderHealth] = {}
+        self._limiters: Dict[str, FairLimiter] = {}
+
+    def health(self, name: str) -> ProviderHealth:
+        h = self._health.get(name)
+        if h is None:
+            h = self._health[name] = ProviderHealth(name)
+        return h
+
+    def limiter(self, name: str) -> FairLimiter:
+        lim = self._limiters.get(name)
+        if lim is None:
+            lim = self._limiters[name] = FairLimiter()
+        return lim
+
+    def rank(self, names: List[str]) -> List[str]:
+        """按健康度排序：未冷却的按得分升序，冷却中的按冷却结束时间排在最后"""
+        if len(names) <= 1:
+            return list(names)
+        now = time.monotonic()
+        ready = [n for n in names if not self.health(n).cooling(now)]
+        cooling = [n for n in names if self.health(n).cooling(now)]
+        ready.sort(key=lambda n: self.health(n).score())
+        cooling.sort(key=lambda n: self.health(n).cooldown_until)
+        return ready + cooling
+
+    def record_success(self, name: str, latency: float) -> None:
+        h = self.health(name)
+        h.requests += 1
+        h.last_used = time.monotonic()
+        h.latency_ewma = latency if h.latency_ewma is None else (1 - _ALPHA) * h.latency_ewma + _ALPHA * latency
+        h.error_ewma = (1 - _ALPHA) * h.error_ewma
+        h.consecutive_failures = 0
+        h.cooldown_until = 0.0
+
+    def record_failure(self, name: str, error: BaseException, latency: Optional[float] = None) -> None:
+        h = self.health(name)
+        h.requests += 1
+        h.failures += 1
+        h.last_used = time.monotonic()
+        h.error_ewma = (1 - _ALPHA) * h.error_ewma + _ALPHA
+        if latency is not None:
+            # 超时等失败也计入延迟，避免慢服务商因为失败反而显得快
+            h.latency_ewma = latency if h.latency_ewma is None else (1 - _ALPHA) * h.latency_ewma + _ALPHA * latency
+        h.consecutive_failures += 1
+        h.last_error = (str(error) or error.__class__.__name__)[:200]
+        if h.consecutive_failures >= _FAIL_THRESHOLD:
+            h.cooldown_until = time.monotonic() + _COOLDOWN_SECONDS
+
+    def snapshot(self, names: Optional[List[str]] = None) -> Dict[str, Dict[str, Any]]:
+        keys = names if names is not None else list(self._health)
+        out: Dict[str, Dict[str, Any]] = {}
+        for n in keys:
+            d = self.health(n).to_dict()
+            d["concurrency"] = self.limiter(n).to_dict()
+            out[n] = d
+        return out
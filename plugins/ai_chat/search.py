@@ -0,0 +1,487 @@
+"""AI 对话全文检索（SQLite FTS5）
+
+- ``ai_chat_sessions_fts``：会话元数据（session_id / 群号 / 用户 / 人格 / 服务商），
+  外部内容表，由 ai_chat_sessions 上的触发器同步；
+- ``ai_chat_messages_fts``：历史消息，外部内容表（rowid 即 ai_chat_messages.id），
+  由消息表上的触发器同步；旧版独立存储的消息索引在建表时删除重建；
+- ``ai_chat_messages_chars``：逐字索引（无内容表，unicode61 分词），写入前由 SQL 函数
+  ``ai_chat_chars`` 把正文拆成以空格分隔的单字，供 trigram 无法处理的 1~2 字关键词做短语匹配；
+- 优先使用 trigram 分词（子串匹配，适合中文与 QQ 号），不支持时退回 unicode61 前缀匹配；
+  短关键词走逐字索引，两者都不可用时才退回 LIKE，且只扫描最近 ``LIKE_WINDOW`` 条消息。
+"""
+from __future__ import annotations
+
+import asyncio
+import sqlite3
+import time
+from typing import Any, Dict, List, Optional
+
+from nonebot import get_driver
+from nonebot.log import logger
+from sqlalchemy import bindparam, text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from ...db.base_models import register_sql_function, with_session
+
+
+MSG_FTS = "ai_chat_messages_fts"
+SESSION_FTS = "ai_chat_sessions_fts"
+MSG_TABLE = "ai_chat_messages"
+CHARS_FTS = "ai_chat_messages_chars"
+CHARS_FN = "ai_chat_chars"
+# LIKE 兜底扫描的最近消息条数
+LIKE_WINDOW = 20000
+_MSG_COLS = ("content", "role", "user_name", "created_at")
+# snippet 高亮标记（前端转义后替换为 <mark>）
+HL_OPEN = "\x02"
+HL_CLOSE = "\x03"
+
+_SESSION_COLS = ("session_id", "group_id", "user_id", "persona_name", "provider_name")
+
+_tokenizer: Optional[str] = None  # "trigram" | "unicode61"；None 表示尚未就绪
+_available = True
+_chars_ready = False
+_init_lock = asyncio.Lock()
+
+
+def message_text(item: Any) -> str:
+    """历史条目中的可检索文本（兼容多模态 content 列表）。"""
+    if not isinstance(item, dict):
+        return ""
+    content = item.get("content")
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):
+        parts: List[str] = []
+        for p in content:
+            if isinstance(p, str):
+                parts.append(p)
+            elif isinstance(p, dict) and isinstance(p.get("text"), str):
+                parts.append(p["text"])
+        return "\n".join(parts)
+    return ""
+
+
+def _spaced_chars(content: Any) -> str:
+    """逐字索引的分词输入：每个非空白字符单独成词。"""
+    return " ".join(ch for ch in str(content or "") if not ch.isspace())
+
+
+register_sql_function(CHARS_FN, 1, _spaced_chars)
+
+
+def _probe_tokenizer() -> Optional[str]:
+    for tok in ("trigram", "unicode61"):
+        try:
+            con = sqlite3.connect(":memory:")
+            try:
+                con.execute(f"CREATE VIRTUAL TABLE t USING fts5(x, tokenize='{tok}')")
+            finally:
+                con.close()
+            return tok
+        except Exception:
+            continue
+    return None
+
+
+def _match_query(q: str, tokenizer: str) -> Optional[str]:
+    """把用户输入转为 FTS5 MATCH 表达式（各词 AND）；无法用索引时返回 None。"""
+    terms = [t for t in (q or "").split() if t]
+    if not terms:
+        return None
+    if tokenizer == "trigram" and any(len(t) < 3 for t in terms):
+        return None
+    quoted = ['"' + t.replace('"', '""') + '"' for t in terms]
+    if tokenizer != "trigram":
+        quoted = [x + "*" for x in quoted]
+    return " ".join(quoted)
+
+
+def _chars_query(q: str) -> Optional[str]:
+    """逐字索引的 MATCH 表达式：每个词是由其单字组成的短语（相邻即子串），各词 AND。"""
+    terms = [t for t in (q or "").split() if t]
+    if not terms:
+        return None
+    return " ".join('"' + _spaced_chars(t).replace('"', '""') + '"' for t in terms)
+
+
+def _like_snippet(content: str, q: str, width: int = 30) -> str:
+    pos = content.find(q)
+    if pos < 0:
+        return content[: width * 2]
+    start = max(0, pos - width)
+    end = min(len(content), pos + len(q) + width)
+    return (
+        ("…" if start > 0 else "")
+        + content[start:pos]
+        + HL_OPEN
+        + content[pos : pos + len(q)]
+        + HL_CLOSE
+        + content[pos + len(q) : end]
+        + ("…" if end < len(content) else "")
+    )
+
+
+class ChatSearchIndex:
+    """FTS5 索引维护与查询；方法可传入调用方的 session 以并入同一事务。"""
+
+    @classmethod
+    def ready(cls) -> bool:
+        return _tokenizer is not None
+
+    @classmethod
+    def tokenizer(cls) -> Optional[str]:
+        return _tokenizer
+
+    @classmethod
+    def chars_ready(cls) -> bool:
+        return _chars_ready
+
+    @classmethod
+    async def ensure(cls) -> bool:
+        """建表/触发器，首次建表时索引现有消息。须在调用方开启写事务之前调用。"""
+        global _tokenizer, _available
+        if _tokenizer is not None:
+            return True
+        if not _available:
+            return False
+        async with _init_lock:
+            if _tokenizer is None and _available:
+                try:
+                    tok = await cls._create()
+                    _tokenizer = tok
+                except Exception as e:
+                    _available = False
+                    logger.warning(f"[AI Chat] FTS5 不可用，会话检索退回 LIKE: {e}")
+                else:
+                    await cls._ensure_chars()
+        return _tokenizer is not None
+
+    @classmethod
+    async def _ensure_chars(cls) -> None:
+        global _chars_ready
+        try:
+            await cls._create_chars()
+            _chars_ready = True
+        except Exception as e:
+            logger.warning(f"[AI Chat] 逐字索引不可用，短关键词检索退回 LIKE: {e}")
+
+    @classmethod
+    @with_session
+    async def _create(cls, session: AsyncSession) -> str:
+        rs = await session.execute(
+            text("SELECT name, sql FROM sqlite_master WHERE name IN (:a, :b)"), {"a": MSG_FTS, "b": SESSION_FTS}
+        )
+        existing = {row[0]: str(row[1] or "") for row in rs.fetchall()}
+        if MSG_FTS in existing:
+            tok = "trigram" if "trigram" in existing[MSG_FTS].lower() else "unicode61"
+            if f"content='{MSG_TABLE}'" not in existing[MSG_FTS]:
+                # 旧版索引独立存储消息（rowid = 会话主键 << 20 | 序号），改为外部内容表后重建
+                await session.execute(text(f"DROP TABLE {MSG_FTS}"))
+                del existing[MSG_FTS]
+        else:
+            probed = _probe_tokenizer()
+            if probed is None:
+                raise RuntimeError("SQLite 未编译 FTS5")
+            tok = probed
+
+        # 旧库可能缺少 provider_name 列（与 ChatSession.ensure_provider_column 一致）
+        cols = [row[1] for row in (await session.execute(text("PRAGMA table_info(ai_chat_sessions)"))).fetchall()]
+        if "provider_name" not in cols:
+            await session.execute(text("ALTER TABLE ai_chat_sessions ADD COLUMN provider_name TEXT"))
+
+        if SESSION_FTS not in existing:
+            col_list = ", ".join(_SESSION_COLS)
+            new_vals = ", ".join(f"new.{c}" for c in _SESSION_COLS)
+            old_vals = ", ".join(f"old.{c}" for c in _SESSION_COLS)
+            await session.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {SESSION_FTS} USING fts5({col_list}, "
+                    f"content='ai_chat_sessions', content_rowid='id', tokenize='{tok}')"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {SESSION_FTS}_ai AFTER INSERT ON ai_chat_sessions BEGIN "
+                    f"INSERT INTO {SESSION_FTS}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {SESSION_FTS}_ad AFTER DELETE ON ai_chat_sessions BEGIN "
+                    f"INSERT INTO {SESSION_FTS}({SESSION_FTS}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {SESSION_FTS}_au AFTER UPDATE OF {col_list} ON ai_chat_sessions BEGIN "
+                    f"INSERT INTO {SESSION_FTS}({SESSION_FTS}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+                    f"INSERT INTO {SESSION_FTS}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+                )
+            )
+            await session.execute(text(f"INSERT INTO {SESSION_FTS}({SESSION_FTS}) VALUES ('rebuild')"))
+
+        if MSG_FTS not in existing:
+            col_list = ", ".join(_MSG_COLS)
+            new_vals = ", ".join(f"new.{c}" for c in _MSG_COLS)
+            old_vals = ", ".join(f"old.{c}" for c in _MSG_COLS)
+            await session.execute(
+                text(
+                    f"CREATE VIRTUAL TABLE {MSG_FTS} USING fts5(content, role UNINDEXED, "
+                    f"user_name UNINDEXED, created_at UNINDEXED, "
+                    f"content='{MSG_TABLE}', content_rowid='id', tokenize='{tok}')"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {MSG_FTS}_ai AFTER INSERT ON {MSG_TABLE} BEGIN "
+                    f"INSERT INTO {MSG_FTS}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {MSG_FTS}_ad AFTER DELETE ON {MSG_TABLE} BEGIN "
+                    f"INSERT INTO {MSG_FTS}({MSG_FTS}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); END"
+                )
+            )
+            await session.execute(
+                text(
+                    f"CREATE TRIGGER IF NOT EXISTS {MSG_FTS}_au AFTER UPDATE ON {MSG_TABLE} BEGIN "
+                    f"INSERT INTO {MSG_FTS}({MSG_FTS}, rowid, {col_list}) VALUES ('delete', old.id, {old_vals}); "
+                    f"INSERT INTO {MSG_FTS}(rowid, {col_list}) VALUES (new.id, {new_vals}); END"
+                )
+            )
+            await session.execute(text(f"INSERT INTO {MSG_FTS}({MSG_FTS}) VALUES ('rebuild')"))
+            n = (await session.execute(text(f"SELECT count(*) FROM {MSG_TABLE}"))).scalar()
+            logger.info(f"[AI Chat] 已建立会话全文索引（{tok}），索引 {int(n or 0)} 条消息")
+        return tok
+
+    @classmethod
+    @with_session
+    async def _create_chars(cls, session: AsyncSession) -> None:
+        # 先确认当前连接已注册分词函数，否则触发器会让消息写入失败
+        await session.execute(text(f"SELECT {CHARS_FN}('')"))
+        rs = await session.execute(text("SELECT 1 FROM sqlite_master WHERE name = :n"), {"n": CHARS_FTS})
+        if rs.first() is not None:
+            return
+        await session.execute(
+            text(f"CREATE VIRTUAL TABLE {CHARS_FTS} USING fts5(content, content='', tokenize='unicode61')")
+        )
+        await session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {CHARS_FTS}_ai AFTER INSERT ON {MSG_TABLE} BEGIN "
+                f"INSERT INTO {CHARS_FTS}(rowid, content) VALUES (new.id, {CHARS_FN}(new.content)); END"
+            )
+        )
+        await session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {CHARS_FTS}_ad AFTER DELETE ON {MSG_TABLE} BEGIN "
+                f"INSERT INTO {CHARS_FTS}({CHARS_FTS}, rowid, content) "
+                f"VALUES ('delete', old.id, {CHARS_FN}(old.content)); END"
+            )
+        )
+        await session.execute(
+            text(
+                f"CREATE TRIGGER IF NOT EXISTS {CHARS_FTS}_au AFTER UPDATE OF content ON {MSG_TABLE} BEGIN "
+                f"INSERT INTO {CHARS_FTS}({CHARS_FTS}, rowid, content) "
+                f"VALUES ('delete', old.id, {CHARS_FN}(old.content)); "
+                f"INSERT INTO {CHARS_FTS}(rowid, content) VALUES (new.id, {CHARS_FN}(new.content)); END"
+            )
+        )
+        await cls._fill_chars(session)
+        n = (await session.execute(text(f"SELECT count(*) FROM {MSG_TABLE}"))).scalar()
+        logger.info(f"[AI Chat] 已建立逐字索引，索引 {int(n or 0)} 条消息")
+
+    @staticmethod
+    async def _fill_chars(session: AsyncSession) -> None:
+        # 无内容表不支持 'rebuild'，清空后从消息表重新写入
+        await session.execute(text(f"INSERT INTO {CHARS_FTS}({CHARS_FTS}) VALUES ('delete-all')"))
+        await session.execute(
+            text(f"INSERT INTO {CHARS_FTS}(rowid, content) SELECT id, {CHARS_FN}(content) FROM {MSG_TABLE}")
+        )
+
+    @classmethod
+    @with_session
+    async def rebuild(cls, session: AsyncSession) -> int:
+        """从会话表与消息表全量重建各索引，返回消息条数。"""
+        if _tokenizer is None:
+            return 0
+        await session.execute(text(f"INSERT INTO {MSG_FTS}({MSG_FTS}) VALUES ('rebuild')"))
+        await session.execute(text(f"INSERT INTO {SESSION_FTS}({SESSION_FTS}) VALUES ('rebuild')"))
+        if _chars_ready:
+            await cls._fill_chars(session)
+        n = (await session.execute(text(f"SELECT count(*) FROM {MSG_TABLE}"))).scalar()
+        return int(n or 0)
+
+    # ---- 查询 ----
+
+    @classmethod
+    @with_session
+    async def match_sessions(cls, session: AsyncSession, q: str, limit: int = 1000) -> Optional[List[int]]:
+        """按元数据匹配会话主键（相关度排序）；不能走索引时返回 None，由调用方退回 LIKE。"""
+        if _tokenizer is None:
+            return None
+        mq = _match_query(q, _tokenizer)
+        if mq is None:
+            return None
+        rs = await session.execute(
+            text(f"SELECT rowid FROM {SESSION_FTS} WHERE {SESSION_FTS} MATCH :q ORDER BY rank LIMIT :n"),
+            {"q": mq, "n": int(limit)},
+        )
+        return [int(r[0]) for r in rs.fetchall()]
+
+    @classmethod
+    @with_session
+    async def search(
+        cls,
+        session: AsyncSession,
+        q: str,
+        limit: int = 20,
+        session_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """检索会话与历史消息，返回带高亮片段的结果和查询耗时（毫秒）。"""
+        t0 = time.perf_counter()
+        kw = (q or "").strip()
+        limit = max(1, min(int(limit), 200))
+        out: Dict[str, Any] = {"sessions": [], "messages": [], "mode": "like", "took_ms": 0.0}
+        if not kw:
+            return out
+
+        scope = ""
+        params: Dict[str, Any] = {"n": limit}
+        if session_id:
+            scope = " AND m.session_id = :sid"
+            params["sid"] = session_id
+
+        # trigram 能处理的走主索引；短词（或无 trigram 时）走逐字索引；都不行才用 unicode61 前缀或 LIKE
+        mq = _match_query(kw, _tokenizer) if _tokenizer == "trigram" else None
+        cq = _chars_query(kw) if mq is None and _chars_ready else None
+        if mq is None and cq is None and _tokenizer:
+            mq = _match_query(kw, _tokenizer)
+        msg_rows: List[Any] = []
+        sess_pks: List[int] = []
+        if cq is not None:
+            # 按 rowid 倒序流式取最新命中，不做相关度排序，高频单字也只读到 LIMIT 为止
+            out["mode"] = "fts5_chars"
+            params["q"] = cq
+            rs = await session.execute(
+                text(
+                    f"SELECT m.session_id, m.role, m.user_name, m.created_at, m.content "
+                    f"FROM {CHARS_FTS} JOIN {MSG_TABLE} m ON m.id = {CHARS_FTS}.rowid "
+                    f"WHERE {CHARS_FTS} MATCH :q{scope} ORDER BY {CHARS_FTS}.rowid DESC LIMIT :n"
+                ),
+                params,
+            )
+            first = kw.split()[0]
+            msg_rows = [(r[0], r[1], r[2], r[3], _like_snippet(str(r[4] or ""), first), None) for r in rs.fetchall()]
+        elif mq is not None:
+            out["mode"] = "fts5"
+            params["q"] = mq
+            rs = await session.execute(
+                text(
+                    f"SELECT m.session_id, m.role, m.user_name, m.created_at, "
+                    f"snippet({MSG_FTS}, 0, '{HL_OPEN}', '{HL_CLOSE}', '…', 16), bm25({MSG_FTS}) "
+                    f"FROM {MSG_FTS} JOIN {MSG_TABLE} m ON m.id = {MSG_FTS}.rowid "
+                    f"WHERE {MSG_FTS} MATCH :q{scope} ORDER BY {MSG_FTS}.rank LIMIT :n"
+                ),
+                params,
+            )
+            msg_rows = [tuple(r) for r in rs.fetchall()]
+            if not session_id:
+                sess_pks = await cls.match_sessions(session=session, q=kw, limit=limit) or []
+        else:
+            # 无可用索引：只扫描最近 LIKE_WINDOW 条消息，避免全表扫描
+            out["bounded"] = True
+            params["like"] = f"%{kw}%"
+            params["win"] = LIKE_WINDOW
+            rs = await session.execute(
+                text(
+                    f"SELECT m.session_id, m.role, m.user_name, m.created_at, m.content FROM {MSG_TABLE} m "
+                    f"WHERE m.id > (SELECT coalesce(max(id), 0) FROM {MSG_TABLE}) - :win "
+                    f"AND m.content LIKE :like{scope} ORDER BY m.id DESC LIMIT :n"
+                ),
+                params,
+            )
+            msg_rows = [(r[0], r[1], r[2], r[3], _like_snippet(str(r[4] or ""), kw), None) for r in rs.fetchall()]
+        if not session_id and not sess_pks:
+            like = f"%{kw}%"
+            rs = await session.execute(
+                text(
+                    "SELECT id FROM ai_chat_sessions WHERE session_id LIKE :l OR group_id LIKE :l "
+                    "OR user_id LIKE :l ORDER BY updated_at DESC LIMIT :n"
+                ),
+                {"l": like, "n": limit},
+            )
+            sess_pks = [int(r[0]) for r in rs.fetchall()]
+
+        meta: Dict[Any, Any] = {}
+        sids = sorted({str(r[0]) for r in msg_rows})
+        if sess_pks or sids:
+            stmt = text(
+                "SELECT id, session_id, session_type, group_id, user_id, persona_name, provider_name, updated_at "
+                "FROM ai_chat_sessions WHERE id IN :pks OR session_id IN :sids"
+            ).bindparams(bindparam("pks", expanding=True), bindparam("sids", expanding=True))
+            rs = await session.execute(stmt, {"pks": [int(p) for p in sess_pks] or [-1], "sids": sids or [""]})
+            for r in rs.fetchall():
+                meta[int(r[0])] = r
+                meta[str(r[1])] = r
+
+        for pk in sess_pks:
+            r = meta.get(pk)
+            if r is None:
+                continue
+            out["sessions"].append(
+                {
+                    "session_id": r[1],
+                    "session_type": r[2],
+                    "group_id": r[3],
+                    "user_id": r[4],
+                    "persona_name": r[5],
+                    "provider_name": r[6],
+                    "updated_at": r[7],
+                }
+            )
+        for sid, role, user_name, created_at, snip, score in msg_rows:
+            r = meta.get(str(sid))
+            if r is None:
+                continue
+            out["messages"].append(
+                {
+                    "session_id": r[1],
+                    "role": role,
+                    "user_name": user_name,
+                    "created_at": created_at,
+                    "snippet": snip,
+                    "score": round(float(score), 4) if score is not None else None,
+                }
+            )
+        out["took_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return out
+
+    @classmethod
+    @with_session
+    async def stats(cls, session: AsyncSession) -> Dict[str, Any]:
+        if _tokenizer is None:
+            return {"enabled": False, "tokenizer": None, "chars_index": False, "messages": 0}
+        n = (await session.execute(text(f"SELECT count(*) FROM {MSG_TABLE}"))).scalar()
+        return {"enabled": True, "tokenizer": _tokenizer, "chars_index": _chars_ready, "messages": int(n or 0)}
+
+
+driver = get_driver()
+
+
+@driver.on_startup
+async def _prepare_search_index() -> None:
+    async def _run() -> None:
+        from ...db.base_models import init_database
+
+        try:
+            await init_database()
+            from .models import ChatMessage
+
+            await ChatMessage.ensure_migrated()
+            await ChatSearchIndex.ensure()
+        except Exception as e:
+            logger.debug(f"[AI Chat] 初始化全文索引失败: {e}")
+
+    asyncio.get_running_loop().create_task(_run())
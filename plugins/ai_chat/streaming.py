@@ -0,0 +1,105 @@
+"""流式回复分段发送
+
+- 按增量累积模型输出，遇到完整句子/段落且累计达到最少字数时发送一段；
+- 未闭合的思考标签（``<thinking>`` 等）或代码围栏内不切分，整块交给清洗函数处理；
+- 记录首段发送时间，用于统计首条消息延迟。
+"""
+from __future__ import annotations
+
+import re
+import time
+from typing import Awaitable, Callable, List, Optional
+
+# 句末/段末（中文标点、英文标点后接空白、换行）
+_BOUNDARY = re.compile(r"(?:[。！？!?；;…~～]+[”’」』）)]*|\.(?=\s)|\n)")
+_OPEN_TAG = re.compile(
+    r"(?is)<(thinking|think|analysis|reflection|reasoning|plan|scratchpad|internal|tool_call|function_call)\b[^>]*>"
+)
+
+
+def _unclosed(buf: str) -> bool:
+    if buf.count("```") % 2:
+        return True
+    for m in _OPEN_TAG.finditer(buf):
+        if not re.search(rf"(?is)</{m.group(1)}\s*>", buf[m.end():]):
+            return True
+    return False
+
+
+class ChunkStreamer:
+    """把流式增量切成完整句子/段落后逐段交给 send
+
+    clean 为发送前的清洗函数（去除思考内容、提取图片等），返回空串时跳过该段。
+    """
+
+    def __init__(
+        self,
+        send: Callable[[str], Awaitable[None]],
+        *,
+        min_chars: int = 60,
+        clean: Optional[Callable[[str], str]] = None,
+        on_first: Optional[Callable[[str], None]] = None,
+        started_at: Optional[float] = None,
+    ) -> None:
+        self._send = send
+        self._clean = clean
+        self._on_first = on_first
+        self.min_chars = max(1, int(min_chars))
+        self.started_at = started_at if started_at is not None else time.monotonic()
+        self.first_chunk_at: Optional[float] = None
+        self.chunks: List[str] = []
+        self._buf = ""
+
+    @property
+    def first_chunk_ms(self) -> Optional[float]:
+        if self.first_chunk_at is None:
+            return None
+        return round((self.first_chunk_at - self.started_at) * 1000, 1)
+
+    def _cut(self) -> int:
+        """返回可发送前缀的长度；0 表示继续等待"""
+        if len(self._buf) < self.min_chars or _unclosed(self._buf):
+            return 0
+        last = 0
+        for m in _BOUNDARY.finditer(self._buf):
+            last = m.end()
+        return last if last >= self.min_chars else 0
+
+    async def _emit(self, text: str) -> None:
+        if self._clean is not None:
+            text = self._clean(text)
+        text = text.strip()
+        if not text:
+            return
+        if self.first_chunk_at is None:
+            self.first_chunk_at = time.monotonic()
+            if self._on_first is not None:
+                try:
+                    self._on_first(text)
+                except Exception:
+                    pass
+        self.chunks.append(text)
+        await self._send(text)
+
+    async def feed(self, delta: str) -> None:
+        if not delta:
+            return
+        self._buf += delta
+        n = self._cut()
+        if n:
+            head, self._buf = self._buf[:n], self._buf[n:]
+            await self._emit(head)
+
+    async def finish(self) -> None:
+        """发送剩余内容"""
+        rest, self._buf = self._buf, ""
+        if rest.strip():
+            await self._emit(rest)
+
+    def discard(self) -> None:
+        """丢弃尚未发送的内容（请求失败、改用其它服务商重试前调用）"""
+        self._buf = ""
+
+    @property
+    def sent(self) -> bool:
+        return bool(self.chunks)
@@ -0,0 +1,71 @@
+"""本地 token 估算（不依赖分词器，用于上下文预算）
+
+- CJK 字符（含全角标点）按 1 token/字，其余文本按约 4 字符/token；
+- 每条消息另计固定开销（角色与分隔符），图片按固定值计；
+- 历史条目的估算值缓存在条目的 ``token_count`` 字段，并随 ai_chat_messages 落库，只计算一次。
+"""
+from __future__ import annotations
+
+import re
+from typing import Any, Dict, Iterable
+
+# 每条消息的格式开销
+MESSAGE_OVERHEAD = 4
+# 单张图片的保守估计
+IMAGE_TOKENS = 765
+
+_CJK = re.compile("[\u2e80-\u9fff\uac00-\ud7af\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str) -> int:
+    """估算一段文本的 token 数"""
+    if not text:
+        return 0
+    rest = len(_CJK.sub("", text))
+    return (len(text) - rest) + (rest + 3) // 4
+
+
+def content_tokens(content: Any) -> int:
+    """消息 content 的 token 数（兼容多模态 content 列表）"""
+    if isinstance(content, str):
+        return estimate_tokens(content)
+    if isinstance(content, list):
+        total = 0
+        for p in content:
+            if isinstance(p, str):
+                total += estimate_tokens(p)
+            elif isinstance(p, dict):
+                if p.get("type") == "image_url":
+                    total += IMAGE_TOKENS
+                elif isinstance(p.get("text"), str):
+                    total += estimate_tokens(p["text"])
+        return total
+    return 0
+
+
+def message_tokens(msg: Any) -> int:
+    """单条消息（或历史条目）的 token 数；群聊历史的 "昵称: " 前缀一并计入"""
+    if not isinstance(msg, dict):
+        return MESSAGE_OVERHEAD + estimate_tokens(str(msg or ""))
+    n = MESSAGE_OVERHEAD + content_tokens(msg.get("content"))
+    uname = msg.get("user_name")
+    if uname:
+        n += estimate_tokens(str(uname)) + 1
+    return n
+
+
+def item_tokens(item: Any) -> int:
+    """历史条目的 token 数，优先使用（并写回）条目上缓存的 token_count"""
+    if isinstance(item, dict):
+        cached = item.get("token_count")
+        if isinstance(cached, int) and cached >= 0:
+            return cached
+        n = message_tokens(item)
+        item["token_count"] = n
+        return n
+    return message_tokens(item)
+
+
+def messages_tokens(messages: Iterable[Dict[str, Any]]) -> int:
+    """整段请求消息的 token 数（发送前的估算）"""
+    return sum(message_tokens(m) for m in messages)
@@ -22,7 +22,7 @@ from nonebot.adapters.onebot.v11 import (
     PokeNotifyEvent,
 )
 
-from ...core.api import Plugin, plugin_data_dir
+from ...core.api import Plugin, Priority, get_dispatcher, plugin_data_dir
 from .config import load_cfg, face_list, random_local_image
 
 
@@ -230,7 +230,13 @@ async def _(bot: Bot, event: PokeNotifyEvent):  # type: ignore[override]
             msg_parts.insert(0, MessageSegment.text(text))
 
     if msg_parts:
-        await bot.send(event, Message(msg_parts))
+        group_id = getattr(event, "group_id", None)
+        if group_id:
+            await get_dispatcher().send_group(
+                group_id, Message(msg_parts), priority=Priority.INTERACTIVE, bot_id=str(event.self_id)
+            )
+        else:
+            await bot.send(event, Message(msg_parts))
 
 
 # ---------- 联系主人 ----------
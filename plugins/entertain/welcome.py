@@ -25,6 +25,7 @@ from nonebot.adapters.onebot.v11 import (
 
 from ...core.api import plugin_data_dir, data_dir
 from ...core.api import Plugin
+from ...core.api import Priority, get_dispatcher
 
 
 # Storage
@@ -335,6 +336,12 @@ async def _(event: GroupIncreaseNoticeEvent):
     if not content_str:
         return
     at = MessageSegment.at(event.user_id)
-    await welcome_notice.finish(at + Message(" ") + _render_welcome_content(key, content_str))
+    # 走出站调度器的交互通道：批量入群时按群限速，避免触发风控
+    await get_dispatcher().send_group(
+        event.group_id,
+        at + Message(" ") + _render_welcome_content(key, content_str),
+        priority=Priority.INTERACTIVE,
+        bot_id=str(event.self_id),
+    )
 
 